@@ -0,0 +1,129 @@
+"""
+Copyright 2019 NerdWallet
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Benchmark for replicating objects across many providers
+
+Stamps the same handful of resources, with large tags and policies, across regions x accounts providers and reports
+the memory held by the objects once they're created and the peak memory of compiling them, both when every replica
+has its own full copy of the values and when the replicas share them with Resource.fan_out.
+
+    python benchmarks/bench_fan_out.py [regions] [accounts]
+"""
+
+from __future__ import print_function
+
+import copy
+import sys
+import timeit
+import tracemalloc
+
+from terraformpy import Provider, Resource, TFObject
+
+TAGS = dict(("tag{0}".format(i), "value{0}".format(i) * 4) for i in range(30))
+
+POLICY = {
+    "Version": "2012-10-17",
+    "Statement": [
+        {
+            "Effect": "Allow",
+            "Action": ["s3:GetObject", "s3:PutObject", "s3:ListBucket"],
+            "Resource": ["arn:aws:s3:::bucket{0}/*".format(i) for i in range(20)],
+        }
+        for _ in range(10)
+    ],
+}
+
+TEMPLATES = [
+    ("aws_s3_bucket", "logs", dict(acl="private", tags=TAGS, policy=POLICY)),
+    (
+        "aws_iam_role",
+        "deploy",
+        dict(assume_role_policy=POLICY, tags=TAGS, max_session_duration=3600),
+    ),
+    (
+        "aws_cloudwatch_log_group",
+        "app",
+        dict(retention_in_days=30, tags=TAGS, lifecycle={"prevent_destroy": True}),
+    ),
+]
+
+
+def make_providers(regions, accounts):
+    return [
+        Provider("aws", alias="r{0}_a{1}".format(region, account))
+        for region in range(regions)
+        for account in range(accounts)
+    ]
+
+
+def build_copies(regions, accounts):
+    """every replica is created with its own copy of the values, like a loop declaring them would"""
+    for provider in make_providers(regions, accounts):
+        with provider:
+            for resource_type, name, values in TEMPLATES:
+                Resource(
+                    resource_type,
+                    "{0}_{1}".format(name, provider._values["alias"]),
+                    **copy.deepcopy(values)
+                )
+
+
+def build_shared(regions, accounts):
+    providers = make_providers(regions, accounts)
+    for resource_type, name, values in TEMPLATES:
+        Resource.fan_out(resource_type, name, providers, **copy.deepcopy(values))
+
+
+def measure(build, regions, accounts):
+    """Return the memory held after building, and the peak memory of building and compiling, in bytes"""
+    TFObject.reset()
+    tracemalloc.start()
+    build(regions, accounts)
+    held, _ = tracemalloc.get_traced_memory()
+    config = TFObject.compile()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del config
+    TFObject.reset()
+    return held, peak
+
+
+def main():
+    regions = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    accounts = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+
+    print(
+        "{0} regions x {1} accounts, {2} resources each".format(
+            regions, accounts, len(TEMPLATES)
+        )
+    )
+    for label, build in (("copies", build_copies), ("shared", build_shared)):
+
+        def run():
+            TFObject.reset()
+            build(regions, accounts)
+            TFObject.compile()
+
+        seconds = min(timeit.repeat(run, number=1, repeat=3))
+        held, peak = measure(build, regions, accounts)
+        print(
+            "{0:>8}: {1:8.1f} ms {2:10.1f} KiB held {3:10.1f} KiB peak".format(
+                label, seconds * 1000, held / 1024.0, peak / 1024.0
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Copyright 2019 NerdWallet
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Benchmark for the time it takes to import terraformpy
+
+Each statement is run in a fresh interpreter a number of times and the fastest run is reported, after subtracting the
+time it takes to start an interpreter that does nothing.  Importing terraformpy on its own should not import
+schematics, which is only imported once a ResourceCollection (or OrderedDict) is used.
+
+    python benchmarks/bench_import.py [runs]
+"""
+
+from __future__ import print_function
+
+import subprocess
+import sys
+from timeit import default_timer
+
+STATEMENTS = [
+    ("import terraformpy", "import terraformpy"),
+    (
+        "Resource only",
+        "from terraformpy import Resource; Resource('aws_instance', 'web')",
+    ),
+    (
+        "ResourceCollection",
+        "from terraformpy import ResourceCollection",
+    ),
+    ("schematics only", "import schematics.models, schematics.types"),
+]
+
+
+def run(statement, runs):
+    timings = []
+    for _ in range(runs):
+        start = default_timer()
+        subprocess.check_call([sys.executable, "-c", statement])
+        timings.append(default_timer() - start)
+    return min(timings)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    startup = run("pass", runs)
+    print("{0:>20}: {1:8.1f} ms".format("interpreter startup", startup * 1000))
+    for label, statement in STATEMENTS:
+        elapsed = run(statement, runs) - startup
+        print("{0:>20}: {1:8.1f} ms".format(label, elapsed * 1000))
+
+    loaded = subprocess.check_output(
+        [
+            sys.executable,
+            "-c",
+            "import sys, terraformpy; print('schematics' in sys.modules)",
+        ]
+    )
+    print(
+        "schematics imported by 'import terraformpy': {0}".format(
+            loaded.decode().strip()
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+"""
+Copyright 2019 NerdWallet
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Scale benchmarks for building, compiling and writing large configs
+
+Each scenario generates a synthetic config and times each phase separately:
+
+* construct - declaring the objects (including any ResourceCollections)
+* compile   - TFObject.compile, with no hooks registered
+* hooks     - applying the registered hooks to the built objects
+* write     - streaming the compiled config to a .tf.json file
+
+The peak memory of each scenario is measured in a separate run, since tracing allocations slows everything down.
+
+Results can be saved as a baseline and later runs compared against it, exiting with a non-zero status if any phase got
+slower (or used more memory) than the allowed threshold.
+
+    python benchmarks/bench_scale.py [--scale 1.0] [--repeat 3] [--save baseline.json] [--compare baseline.json]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from timeit import default_timer
+
+from schematics import types
+
+from terraformpy import Provider, Resource, ResourceCollection, TFObject, Variable
+from terraformpy.writer import write_json_file
+
+
+class Service(ResourceCollection):
+    """A leaf collection that declares a handful of resources referencing each other"""
+
+    name = types.StringType(required=True)
+
+    def create_resources(self):
+        self.sg = Resource(
+            "aws_security_group",
+            self.name,
+            name=self.name,
+            tags={"Name": self.name, "Service": self.name},
+        )
+        self.instance = Resource(
+            "aws_instance",
+            self.name,
+            ami="ami-12345678",
+            instance_type="t3.micro",
+            vpc_security_group_ids=[self.sg.id],
+        )
+        self.record = Resource(
+            "aws_route53_record",
+            self.name,
+            name="{0}.example.com".format(self.name),
+            type="A",
+            records=[self.instance.private_ip],
+        )
+
+
+class Group(ResourceCollection):
+    """A collection that nests further groups until depth runs out, then declares services"""
+
+    name = types.StringType(required=True)
+    depth = types.IntType(required=True)
+    width = types.IntType(required=True)
+
+    def create_resources(self):
+        self.children = []
+        for i in range(self.width):
+            name = "{0}_{1}".format(self.name, i)
+            if self.depth > 1:
+                child = Group(name=name, depth=self.depth - 1, width=self.width)
+            else:
+                child = Service(name=name)
+            self.children.append(child)
+
+
+def gen_resources(count):
+    """count flat resources"""
+    for i in range(count):
+        Resource(
+            "aws_instance",
+            "instance{0}".format(i),
+            ami="ami-12345678",
+            instance_type="t3.micro",
+            tags={"Name": "instance{0}".format(i)},
+        )
+
+
+def gen_bulk(count):
+    """the same resources as gen_resources, created with Resource.bulk"""
+    Resource.bulk(
+        "aws_instance",
+        (
+            dict(
+                name="instance{0}".format(i),
+                ami="ami-12345678",
+                instance_type="t3.micro",
+                tags={"Name": "instance{0}".format(i)},
+            )
+            for i in range(count)
+        ),
+    )
+
+
+def gen_collections(count):
+    """nested ResourceCollections, 3 levels deep, with about count resources"""
+    width = max(2, int(round((count / 3.0) ** (1 / 3.0))))
+    Group(name="group", depth=3, width=width)
+
+
+def gen_providers(count):
+    """count aliased providers (regions x accounts) with a resource using each one"""
+    regions = ["us-east-1", "us-east-2", "us-west-1", "us-west-2", "eu-west-1"]
+    for i in range(count):
+        region = regions[i % len(regions)]
+        alias = "{0}_{1}".format(region, i // len(regions))
+        with Provider("aws", alias=alias, region=region):
+            Resource("aws_s3_bucket", "bucket_{0}".format(alias), bucket=alias)
+
+
+def gen_hooks(count):
+    """count resources of a few types, each type having several hooks"""
+    resource_types = ["aws_instance", "aws_s3_bucket", "aws_iam_role", "aws_lambda"]
+
+    def make_hook(i):
+        def hook(object_id, attrs):
+            attrs = dict(attrs)
+            attrs["tags"] = dict(attrs.get("tags", {}), **{"hook{0}".format(i): "yes"})
+            return attrs
+
+        return hook
+
+    for resource_type in resource_types:
+        for i in range(5):
+            Resource.add_hook(resource_type, make_hook(i))
+
+    for i in range(count):
+        Resource(
+            resource_types[i % len(resource_types)],
+            "res{0}".format(i),
+            tags={"Name": "res{0}".format(i)},
+        )
+
+
+def gen_large_values(count):
+    """a smaller number of objects that each carry large, nested values"""
+    for i in range(max(1, count // 100)):
+        Variable(
+            "var{0}".format(i),
+            default=dict(
+                ("key{0}".format(j), {"list": list(range(20)), "text": "x" * 100})
+                for j in range(100)
+            ),
+        )
+        Resource(
+            "aws_iam_policy",
+            "policy{0}".format(i),
+            policy={
+                "Statement": [
+                    {
+                        "Effect": "Allow",
+                        "Action": ["s3:GetObject", "s3:PutObject"],
+                        "Resource": [
+                            "arn:aws:s3:::bucket{0}/*".format(j) for j in range(50)
+                        ],
+                    }
+                    for _ in range(20)
+                ]
+            },
+        )
+
+
+# name -> (generator, number of objects at a scale of 1)
+SCENARIOS = [
+    ("resources", gen_resources, 50000),
+    ("bulk", gen_bulk, 50000),
+    ("collections", gen_collections, 30000),
+    ("providers", gen_providers, 1000),
+    ("hooks", gen_hooks, 20000),
+    ("large_values", gen_large_values, 20000),
+]
+
+
+def apply_hooks():
+    """Build every object and apply the registered hooks to it, the way compile does"""
+    hooks = TFObject._hook_table()
+    outputs = [(obj, obj.build()) for obj in TFObject.registry()]
+
+    start = default_timer()
+    if hooks:
+        for obj, output in outputs:
+            obj._apply_hooks(output, hooks)
+    return default_timer() - start
+
+
+def run_scenario(generator, count, tmpdir):
+    """Run all of the phases of a scenario once, returning a dict of phase name to seconds"""
+    TFObject.reset()
+    timings = {}
+
+    start = default_timer()
+    generator(count)
+    timings["construct"] = default_timer() - start
+
+    timings["hooks"] = apply_hooks()
+
+    # compile on its own, without the hooks
+    TFObject._hooks = None
+    start = default_timer()
+    config = TFObject.compile()
+    timings["compile"] = default_timer() - start
+
+    start = default_timer()
+    write_json_file(os.path.join(tmpdir, "main.tf.json"), config)
+    timings["write"] = default_timer() - start
+
+    TFObject.reset()
+    return timings
+
+
+def measure_peak(generator, count, tmpdir):
+    """Run the scenario with allocation tracing, returning the peak traced memory in bytes"""
+    tracemalloc.start()
+    try:
+        run_scenario(generator, count, tmpdir)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def run(scale, repeat, only=None):
+    results = {}
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name, generator, count in SCENARIOS:
+            if only and name not in only:
+                continue
+
+            count = max(1, int(count * scale))
+            runs = [run_scenario(generator, count, tmpdir) for _ in range(repeat)]
+            result = dict(
+                (phase, min(timings[phase] for timings in runs)) for phase in runs[0]
+            )
+            result["peak_memory"] = measure_peak(generator, count, tmpdir)
+            result["count"] = count
+            results[name] = result
+
+            print(
+                "{0:>14} ({1} objects): {2}, peak {3:.1f} MiB".format(
+                    name,
+                    count,
+                    ", ".join(
+                        "{0} {1:.3f}s".format(phase, result[phase])
+                        for phase in ("construct", "compile", "hooks", "write")
+                    ),
+                    result["peak_memory"] / 1024.0 / 1024.0,
+                )
+            )
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Compare results to a baseline, returning a list of regression descriptions"""
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None or base.get("count") != result["count"]:
+            print("{0:>14}: no comparable baseline".format(name))
+            continue
+
+        for metric in ("construct", "compile", "hooks", "write", "peak_memory"):
+            if not base.get(metric):
+                continue
+            ratio = result[metric] / base[metric]
+            print("{0:>14}: {1:<12} {2:6.2f}x".format(name, metric, ratio))
+            # ignore differences that are too small to measure reliably
+            if ratio > threshold and (metric == "peak_memory" or result[metric] > 0.01):
+                regressions.append("{0} {1} {2:.2f}x".format(name, metric, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="terraformpy scale benchmarks")
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Multiply the number of objects in each scenario by this",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Run each scenario this many times, keeping the fastest time of each phase",
+    )
+    parser.add_argument(
+        "--only",
+        action="append",
+        choices=[name for name, _, _ in SCENARIOS],
+        help="Only run this scenario, can be given multiple times",
+    )
+    parser.add_argument("--save", metavar="PATH", help="Save the results as a baseline")
+    parser.add_argument(
+        "--compare", metavar="PATH", help="Compare the results against a baseline"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="The ratio to the baseline above which a phase is considered a regression",
+    )
+    args = parser.parse_args()
+
+    results = run(args.scale, args.repeat, only=args.only)
+
+    if args.save:
+        with open(args.save, "w") as fd:
+            json.dump(
+                {"python": sys.version, "results": results},
+                fd,
+                indent=2,
+                sort_keys=True,
+            )
+        print("Saved baseline to {0}".format(args.save))
+
+    if args.compare:
+        with open(args.compare) as fd:
+            baseline = json.load(fd)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("Regressions: {0}".format(", ".join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Copyright 2019 NerdWallet
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Benchmark for referencing the attributes of typed objects
+
+Simulates a collection where many resources reference the same handful of attributes (i.e. vpc.id) and reports the time
+taken and the peak memory used, with and without the TypedObjectAttr cache.
+
+    python benchmarks/bench_typed_object_attr.py [references]
+"""
+
+from __future__ import print_function
+
+import sys
+import timeit
+import tracemalloc
+
+from terraformpy import Resource, TFObject
+from terraformpy.objects import TypedObjectAttr
+
+
+def make_references(count):
+    TFObject.reset()
+    vpc = Resource("aws_vpc", "vpc")
+    subnets = [Resource("aws_subnet", "subnet{0}".format(i)) for i in range(10)]
+
+    refs = []
+    for i in range(count):
+        subnet = subnets[i % len(subnets)]
+        refs.append((vpc.id, vpc.cidr_block, subnet.id, subnet.tags["Name"]))
+    return refs
+
+
+def run(count, cache_size):
+    TypedObjectAttr.CACHE_SIZE = cache_size
+    TypedObjectAttr._cache.clear()
+    seconds = min(timeit.repeat(lambda: make_references(count), number=1, repeat=3))
+
+    TypedObjectAttr._cache.clear()
+    tracemalloc.start()
+    refs = make_references(count)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del refs
+
+    return seconds, peak
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    default_size = TypedObjectAttr.CACHE_SIZE
+
+    print("{0} references".format(count))
+    for label, cache_size in (("uncached", 0), ("cached", default_size)):
+        seconds, peak = run(count, cache_size)
+        print(
+            "{0:>10}: {1:8.3f} ms {2:10.1f} KiB peak".format(
+                label, seconds * 1000, peak / 1024.0
+            )
+        )
+
+    TypedObjectAttr.CACHE_SIZE = default_size
+
+
+if __name__ == "__main__":
+    main()
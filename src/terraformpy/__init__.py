@@ -14,11 +14,14 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import importlib
+import sys
+
+from .context import CompileContext  # noqa
 from .objects import (
     Data,
     DuplicateKey,
     Module,
-    OrderedDict,
     Output,
     Provider,
     Resource,
@@ -26,7 +29,56 @@ from .objects import (
     TFObject,
     Variable,
 )  # noqa
-from .resource_collections import ResourceCollection, Variant  # noqa
+from .variant import Variant  # noqa
+
+if sys.version_info >= (3, 7):
+    # the classes based on schematics are imported the first time they are used, since importing schematics makes up
+    # most of the time it takes to import terraformpy
+    _LAZY = {
+        "BatchValidation": "resource_collections",
+        "OrderedDict": "resource_collections",
+        "ResourceCollection": "resource_collections",
+    }
+
+    def __getattr__(name):
+        try:
+            module = _LAZY[name]
+        except KeyError:
+            raise AttributeError(
+                "module {0!r} has no attribute {1!r}".format(__name__, name)
+            )
+        value = getattr(importlib.import_module("." + module, __name__), name)
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(globals()) | set(_LAZY))
+
+else:
+    from .resource_collections import (  # noqa
+        BatchValidation,
+        OrderedDict,
+        ResourceCollection,
+    )
+
+__all__ = [
+    "BatchValidation",
+    "CompileContext",
+    "Data",
+    "DuplicateKey",
+    "Module",
+    "OrderedDict",
+    "Output",
+    "Provider",
+    "Resource",
+    "ResourceCollection",
+    "Terraform",
+    "TFObject",
+    "Variable",
+    "Variant",
+    "compile",
+    "reset",
+]
 
 # add a couple shortcuts
 compile = TFObject.compile
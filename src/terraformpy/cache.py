@@ -0,0 +1,171 @@
+"""
+Copyright 2019 NerdWallet
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+On disk cache of compiled .tf.py fragments
+
+Each .tf.py file gets an entry that stores its compiled fragment along with the local modules that were imported while
+it was loaded.  The entry is only used if the key computed from the current state of the file, those modules, the
+environment and the active Variant matches the key the entry was stored with.
+"""
+
+import hashlib
+import io
+import json
+import os
+import sys
+
+import six
+
+from .helpers import file_hash
+from .variant import Variant
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(".terraformpy", "cache")
+
+# environment variables with these prefixes are always considered relevant
+ENV_PREFIXES = ("TERRAFORMPY_", "TF_")
+
+_package_hash = None
+
+
+def package_hash():
+    """Return a hash of the terraformpy source itself, so that upgrading it invalidates the cache"""
+    global _package_hash
+    if _package_hash is None:
+        digest = hashlib.sha256()
+        root = os.path.dirname(os.path.abspath(__file__))
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith(".py"):
+                    digest.update(file_hash(os.path.join(dirpath, filename)).encode())
+        _package_hash = digest.hexdigest()
+    return _package_hash
+
+
+def is_local_module(module, root):
+    """Is module a module that lives under root, and is not an installed package (i.e. in a virtualenv under root)"""
+    path = getattr(module, "__file__", None)
+    if not path:
+        return False
+    path = os.path.abspath(path)
+    if not path.startswith(root + os.sep):
+        return False
+    return "site-packages" not in path and "dist-packages" not in path
+
+
+def local_modules(root=None):
+    """Return the names of all of the loaded modules that live under root (the current directory by default)"""
+    root = os.path.abspath(root or os.getcwd())
+    return set(
+        name
+        for name, module in list(sys.modules.items())
+        if module is not None and is_local_module(module, root)
+    )
+
+
+class CompileCache(object):
+    """CompileCache stores compiled fragments on disk
+
+    env_names is a list of additional environment variables (besides those prefixed with TERRAFORMPY_ or TF_) whose
+    values the fragments depend on.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_DIR, env_names=None):
+        self.path = path
+        self.env_names = env_names or ()
+
+    def _entry_path(self, filename):
+        name = hashlib.sha256(os.path.abspath(filename).encode("utf-8")).hexdigest()
+        return os.path.join(self.path, name + ".json")
+
+    def _environment(self):
+        return sorted(
+            (name, value)
+            for name, value in os.environ.items()
+            if name.startswith(ENV_PREFIXES) or name in self.env_names
+        )
+
+    def key(self, filename, deps):
+        """Compute the cache key for filename given the paths of the local modules it depends on
+
+        Returns None if any of the files no longer exist.
+        """
+        variant = Variant.CURRENT_VARIANT
+        if variant is not None:
+            variant = [variant.name, repr(sorted(variant.defaults.items()))]
+
+        try:
+            files = [[filename, file_hash(filename)]] + [
+                [dep, file_hash(dep)] for dep in sorted(deps)
+            ]
+        except (IOError, OSError):
+            return None
+
+        data = json.dumps(
+            [
+                CACHE_VERSION,
+                sys.version,
+                package_hash(),
+                files,
+                self._environment(),
+                variant,
+            ]
+        )
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def get(self, filename):
+        """Return the cached fragment for filename, or None if there is no valid entry"""
+        try:
+            with io.open(self._entry_path(filename), encoding="utf-8") as fd:
+                entry = json.load(fd)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if entry.get("version") != CACHE_VERSION:
+            return None
+
+        key = self.key(filename, entry["deps"])
+        if key is None or key != entry["key"]:
+            return None
+
+        return entry["fragment"]
+
+    def put(self, filename, fragment, deps):
+        """Store the fragment compiled from filename, which imported the local module files in deps"""
+        key = self.key(filename, deps)
+        if key is None:
+            return
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        entry_path = self._entry_path(filename)
+        tmp_path = "%s.%d.tmp" % (entry_path, os.getpid())
+        with io.open(tmp_path, "w", encoding="utf-8") as fd:
+            fd.write(
+                six.text_type(
+                    json.dumps(
+                        {
+                            "version": CACHE_VERSION,
+                            "key": key,
+                            "filename": filename,
+                            "deps": sorted(deps),
+                            "fragment": fragment,
+                        }
+                    )
+                )
+            )
+        os.rename(tmp_path, entry_path)
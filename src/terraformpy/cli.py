@@ -14,16 +14,269 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import imp
+import argparse
+import copy
 import json
 import os
 import sys
 
-from terraformpy import compile
+import six
+
+from terraformpy import compile, profiling, server
+from terraformpy.cache import CompileCache
+from terraformpy.graph import DanglingReferenceError, NoMatchError, ReferenceGraph
+from terraformpy.hoist import hoist_locals
+from terraformpy.loader import (
+    compile_fragments,
+    compile_variants,
+    load_file,
+    load_files,
+    merge_fragments,
+)
+from terraformpy.stacks import (
+    StackCycleError,
+    StackOutputError,
+    plan_stacks,
+    write_stacks,
+)
+from terraformpy.watch import Watcher
+from terraformpy.writer import shard_by_type, write_shards
+
+# the names of the files we wrote on the last run, so that we can clean up the ones we no longer write
+SHARD_MANIFEST = os.path.join(".terraformpy", "shards.json")
+
+PROFILE_OUTPUT = os.path.join(".terraformpy", "profile.json")
+
+# the address of the compile server to use when --server isn't given, see terraformpy.server
+SERVER_ENV = "TERRAFORMPY_SERVER"
+
+
+def parse_args(argv):
+    """Parse the terraformpy options from argv
+
+    Our own options must come before the Terraform command, everything from the first argument we don't recognize
+    onwards is passed through to Terraform untouched.
+    """
+    kwargs = {}
+    if sys.version_info >= (3, 5):
+        # don't let abbreviations swallow Terraform's own options
+        kwargs["allow_abbrev"] = False
+
+    parser = argparse.ArgumentParser(prog="terraformpy", add_help=False, **kwargs)
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Write main.tf.json without indentation, using a native JSON encoder if one is installed",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Compile each .tf.py file on its own, in up to this many worker processes at once",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Compile each .tf.py file on its own, and reuse the compiled result of files that have not changed",
+    )
+    parser.add_argument(
+        "--cache-env",
+        action="append",
+        metavar="NAME",
+        help="An environment variable the .tf.py files depend on, which is part of the cache key and is sent to the "
+        "compile server, can be given multiple times",
+    )
+    parser.add_argument(
+        "--shard-by",
+        choices=("source", "type"),
+        help="Write one .tf.json file per .tf.py file (source) or per type of object (type), instead of main.tf.json",
+    )
+    parser.add_argument(
+        "--variants",
+        type=_variant_list,
+        metavar="NAME,NAME,...",
+        help="Compile the files once within each of these Variants, writing main.<variant>.tf.json for each of them",
+    )
+    parser.add_argument(
+        "--batch-validation",
+        action="store_true",
+        help="Report the validation errors of all of the ResourceCollections together once the files are loaded",
+    )
+    parser.add_argument(
+        "--check-references",
+        action="store_true",
+        help="Fail before writing anything if an object references an address that is not defined",
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="Leave out the data sources and variables that nothing references",
+    )
+    parser.add_argument(
+        "--only",
+        action="append",
+        metavar="ADDRESS",
+        help="Only compile the objects whose address matches this glob pattern, and the objects they depend on, can be "
+        "given multiple times",
+    )
+    parser.add_argument(
+        "--graph",
+        metavar="PATH",
+        help="Write the graph of references between objects to PATH, as DOT if it ends with .dot or as JSON",
+    )
+    parser.add_argument(
+        "--propose-stacks",
+        action="store_true",
+        help="Print how the config would be split into separate root stacks, without writing anything",
+    )
+    parser.add_argument(
+        "--split-stacks",
+        metavar="DIR",
+        help="Split the config into separate root stacks, writing each one to DIR/<stack>/main.tf.json",
+    )
+    parser.add_argument(
+        "--stack",
+        action="append",
+        type=_stack_assignment,
+        metavar="NAME=ADDRESS",
+        help="Put the objects whose address matches the glob pattern into the named stack, can be given multiple times",
+    )
+    parser.add_argument(
+        "--hoist-locals",
+        action="store_true",
+        help="Write large values that are repeated throughout the config once, as locals, and reference them instead",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running, and recompile whenever the .tf.py files or the local modules they import change",
+    )
+    parser.add_argument(
+        "--server",
+        metavar="ADDRESS",
+        help="Compile with the terraformpy serve server listening on this Unix socket path or [HOST:]PORT, defaults "
+        "to $%s" % SERVER_ENV,
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Report the wall and CPU time spent on each file, ResourceCollection, hook and phase",
+    )
+    parser.add_argument(
+        "--profile-output",
+        default=PROFILE_OUTPUT,
+        metavar="PATH",
+        help="Where --profile writes its report as JSON",
+    )
+    parser.add_argument("terraform_args", nargs=argparse.REMAINDER)
+
+    args, unknown = parser.parse_known_args(argv)
+    args.terraform_args = unknown + args.terraform_args
+
+    if args.variants:
+        if args.shard_by or args.cache:
+            parser.error("--variants can't be combined with --shard-by or --cache")
+        if args.terraform_args and len(args.variants) > 1:
+            # terraform would load the configs of all of the variants at once
+            parser.error("terraform can't be run with more than one variant")
+
+    if (args.check_references or args.prune or args.graph or args.only) and (
+        args.jobs > 1 or args.cache or args.shard_by == "source" or args.variants
+    ):
+        # the graph is built from the objects registered in this process
+        parser.error(
+            "--check-references, --prune, --graph and --only can't be combined with --jobs, --cache, --shard-by "
+            "source or --variants"
+        )
+
+    splitting = args.propose_stacks or args.split_stacks
+    if args.stack and not splitting:
+        parser.error("--stack can only be used with --propose-stacks or --split-stacks")
+    if splitting and (
+        args.jobs > 1
+        or args.cache
+        or args.shard_by
+        or args.variants
+        or args.only
+        or args.watch
+        or args.terraform_args
+    ):
+        parser.error(
+            "--propose-stacks and --split-stacks can't be combined with --jobs, --cache, --shard-by, --variants, "
+            "--only, --watch or a terraform command"
+        )
+
+    if args.hoist_locals and args.shard_by == "source":
+        # the locals of each file would be defined again by every other file that uses the same values
+        parser.error("--hoist-locals can't be combined with --shard-by source")
+
+    if args.watch and (
+        args.jobs > 1
+        or args.cache
+        or args.shard_by == "source"
+        or args.variants
+        or args.profile
+        or args.terraform_args
+    ):
+        parser.error(
+            "--watch can't be combined with --jobs, --cache, --shard-by source, --variants, --profile or a terraform "
+            "command"
+        )
+
+    local_only = args.watch or args.profile or splitting
+    if args.server and local_only:
+        parser.error(
+            "--server can't be combined with --watch, --profile, --propose-stacks or --split-stacks"
+        )
+    if not args.server and not local_only:
+        args.server = os.environ.get(SERVER_ENV) or None
+
+    return args
+
+
+def _variant_list(value):
+    variants = [name.strip() for name in value.split(",") if name.strip()]
+    if not variants:
+        raise argparse.ArgumentTypeError("no variant names given")
+    return variants
+
+
+def _stack_assignment(value):
+    name, _, pattern = value.partition("=")
+    if not name or not pattern:
+        raise argparse.ArgumentTypeError("expected NAME=ADDRESS, got %r" % value)
+    return name, pattern
+
+
+def phase(name):
+    """Time a phase of main when profiling, see terraformpy.profiling"""
+    profiler = profiling.profiler
+    if profiler is None:
+        return _NullContext()
+    return profiler.timer("phase", name)
+
+
+class _NullContext(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
 
 
 def main():
     """Compile *.tf.py files and run Terraform"""
+    if sys.argv[1:2] == ["serve"]:
+        server.main(sys.argv[2:])
+        return
+
+    argv = sys.argv[1:]
+    args = parse_args(argv)
+
+    if args.profile:
+        profiling.enable()
+
     to_process = [ent for ent in os.listdir(os.getcwd()) if ent.endswith(".tf.py")]
 
     if len(to_process) == 0:
@@ -35,18 +288,248 @@ def main():
 
     print("terraformpy - Processing: %s" % ", ".join(to_process))
 
-    # all we need to do is import our files
-    # the nature of resource declaration will register all of the objects for us to compile
-    for filename in to_process:
-        imp.load_source(filename[:-6], filename)
+    if args.watch:
+        # the files are compiled in this process, so modules that haven't changed stay imported between builds
+        def build(filenames, load):
+            write(args, compile_shards(args, filenames, load=load))
 
-    # now 'compile' everything that was registered, and write it out the tf.json file
-    print("terraformpy - Writing main.tf.json")
-    with open("main.tf.json", "w") as fd:
-        json.dump(compile(), fd, indent=4)
-        fd.write("\n")
+        Watcher(build, load_file).run()
+        return
 
-    if len(sys.argv) > 1:
-        print("terraformpy - Running terraform: %s" % " ".join(sys.argv[1:]))
+    shards = None
+    try:
+        if args.propose_stacks or args.split_stacks:
+            split(args, to_process)
+        elif args.server:
+            shards = compile_with_server(args, argv, to_process)
+        else:
+            shards = compile_config(args, to_process)
+    except Exception as exc:
+        messages = error_messages(args, exc)
+        if messages is None:
+            raise
+        for line in messages:
+            print(line)
+        sys.exit(1)
+
+    if shards is not None:
+        write(args, shards)
+
+    profiler = profiling.disable()
+    if profiler is not None:
+        for line in profiler.format_table():
+            print("terraformpy - Profile: %s" % line)
+        profiler.write_json(args.profile_output)
+        print("terraformpy - Wrote profile to %s" % args.profile_output)
+
+    if args.terraform_args:
+        print("terraformpy - Running terraform: %s" % " ".join(args.terraform_args))
         # replace ourself with terraform
-        os.execvp("terraform", ["terraform"] + sys.argv[1:])
+        os.execvp("terraform", ["terraform"] + args.terraform_args)
+
+
+def error_messages(args, exc):
+    """Return the lines that report an error raised while compiling the config, or None if it's not one we report"""
+    if args.batch_validation:
+        # only import schematics when it's needed
+        from terraformpy.resource_collections import BatchValidationError
+
+        if isinstance(exc, BatchValidationError):
+            return [
+                "terraformpy - Validation error: %s: %s" % (name, json.dumps(errors))
+                for name, errors in six.iteritems(exc.errors)
+            ]
+
+    if isinstance(exc, (NoMatchError, StackCycleError, StackOutputError)):
+        return ["terraformpy - Error: %s" % exc]
+    if isinstance(exc, DanglingReferenceError):
+        return [
+            "terraformpy - Undefined reference: %s references %s" % (address, reference)
+            for address, reference in exc.references
+        ]
+    if isinstance(exc, server.ServerError):
+        return exc.messages
+    return None
+
+
+def compile_config(args, to_process, in_process=False):
+    """Compile the files according to args, returning the shards (a dict of file names to configs) to write
+
+    When in_process is True the files are compiled in this process, even if args asks for worker processes.
+    """
+    if in_process:
+        args = copy.copy(args)
+        args.jobs = 1
+
+    if not args.variants:
+        return compile_shards(args, to_process)
+
+    # every variant is compiled from the same files, in a worker forked from this (already warm) process
+    with phase("compile variants"):
+        results = compile_variants(
+            args.variants,
+            to_process,
+            jobs=1 if in_process else (args.jobs if args.jobs > 1 else None),
+            batch_validation=args.batch_validation,
+        )
+    return dict(
+        ("main.%s.tf.json" % variant, hoist(args, config))
+        for variant, config in results
+    )
+
+
+def compile_with_server(args, argv, to_process):
+    """Have the compile server compile the files, falling back to compiling them in this process if it's unavailable"""
+    try:
+        return server.request_compile(
+            args.server, argv, to_process, env_names=args.cache_env or ()
+        )
+    except server.ServerUnavailable as exc:
+        print("terraformpy - %s, compiling in this process" % exc)
+        return compile_config(args, to_process)
+
+
+def write(args, shards):
+    """Write the shards (a dict of file names to configs), reporting what changed"""
+    with phase("write"):
+        written, removed = write_shards(
+            shards, SHARD_MANIFEST, indent=None if args.compact else 4
+        )
+    for name in written:
+        print("terraformpy - Wrote %s" % name)
+    for name in removed:
+        print("terraformpy - Removed %s" % name)
+    if len(written) < len(shards):
+        print("terraformpy - %d file(s) unchanged" % (len(shards) - len(written)))
+
+
+def split(args, to_process):
+    """Split the config into stacks, printing the plan and writing each of them if args asks for it"""
+    with phase("load"):
+        load_files(to_process, batch_validation=args.batch_validation)
+    with phase("graph"):
+        graph = ReferenceGraph.build()
+    if args.graph:
+        graph.write(args.graph)
+        print("terraformpy - Wrote graph to %s" % args.graph)
+    if args.check_references:
+        graph.check()
+
+    with phase("plan stacks"):
+        plan = plan_stacks(graph, args.stack or ())
+    for stack in plan.stacks.values():
+        print(
+            "terraformpy - Stack %s: %d object(s)" % (stack.name, len(stack.addresses))
+        )
+        for name in stack.depends_on():
+            imported = [
+                address
+                for address, other in six.iteritems(stack.imports)
+                if other == name
+            ]
+            print(
+                "terraformpy -     reads %s from stack %s" % (", ".join(imported), name)
+            )
+
+    if args.split_stacks:
+        with phase("write"):
+            written = write_stacks(
+                plan,
+                args.split_stacks,
+                indent=None if args.compact else 4,
+                transform=lambda config: hoist(args, config),
+            )
+        for path in written:
+            print("terraformpy - Wrote %s" % path)
+        if len(written) < len(plan.stacks):
+            print(
+                "terraformpy - %d file(s) unchanged" % (len(plan.stacks) - len(written))
+            )
+
+
+def analyze(args):
+    """Build the graph of references between the registered objects if args asks for it, checking and writing it
+
+    Returns the objects to compile, or None to compile all of them.
+    """
+    if not (args.check_references or args.prune or args.graph or args.only):
+        return None
+
+    with phase("graph"):
+        # only the objects that --only selects need to be scanned, unless we need the whole graph
+        graph = ReferenceGraph.build(
+            scan=bool(args.check_references or args.prune or args.graph)
+        )
+
+    if args.graph:
+        graph.write(args.graph)
+        print("terraformpy - Wrote graph to %s" % args.graph)
+    if args.check_references:
+        graph.check()
+    if args.only:
+        # the selection only has the data sources and variables the selected objects reference, nothing to prune
+        with phase("select"):
+            return graph.select(args.only)
+    if args.prune:
+        return graph.prune()
+    return None
+
+
+def hoist(args, config):
+    """Hoist repeated values into locals if args asks for it, see terraformpy.hoist"""
+    if not args.hoist_locals:
+        return config
+    with phase("hoist locals"):
+        return hoist_locals(config)
+
+
+def compile_shards(args, to_process, load=load_file):
+    """Compile the files and split the config into the .tf.json files to write, according to args
+
+    load is used to load each file when they are compiled in this process.
+    """
+    fragments = None
+    if args.jobs > 1 or args.cache or args.shard_by == "source":
+        # each file is compiled on its own (in a separate worker, or loaded from the cache) and the results are merged
+        cache = CompileCache(env_names=args.cache_env) if args.cache else None
+        with phase("compile files"):
+            fragments = compile_fragments(
+                to_process,
+                jobs=args.jobs,
+                cache=cache,
+                batch_validation=args.batch_validation,
+            )
+        with phase("merge"):
+            merger = merge_fragments(fragments)
+        for path, previous, filename in merger.conflicts:
+            print(
+                "terraformpy - Conflict: %s is defined in both %s and %s, using the value from %s"
+                % (".".join(path), previous, filename, filename)
+            )
+        config = merger.result
+    else:
+        # all we need to do is import our files
+        # the nature of resource declaration will register all of the objects for us to compile
+        with phase("load"):
+            load_files(to_process, batch_validation=args.batch_validation, load=load)
+        select = analyze(args)
+
+        # now 'compile' everything that was registered
+        with phase("compile"):
+            config = compile(select=select)
+
+    config = hoist(args, config)
+
+    # and split it into the tf.json file(s) to write
+    if args.shard_by == "source":
+        shards = dict(
+            (filename[:-6] + ".tf.json", fragment)
+            for filename, fragment in fragments
+            if fragment
+        )
+    elif args.shard_by == "type":
+        shards = shard_by_type(config)
+    else:
+        shards = {"main.tf.json": config}
+
+    return shards
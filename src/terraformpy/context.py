@@ -0,0 +1,134 @@
+"""
+Copyright 2019 NerdWallet
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+The state of the config being declared and compiled
+
+Everything terraformpy keeps track of while objects are declared and compiled (the objects themselves, the hooks, the
+current Provider, Variant and BatchValidation, etc) lives in a CompileContext.  Unless another context has been
+activated everything goes into a single, process wide, default context, which is what the module level API
+(``TFObject.compile``, ``TFObject.reset``, etc) has always used.
+
+Activating a new context with a with statement isolates everything declared within it, in the current thread or
+asyncio task, so that independent configs can be declared and compiled concurrently:
+
+.. code-block:: python
+
+    def build(variant):
+        with CompileContext(), Variant(variant):
+            declare_everything()
+            return TFObject.compile()
+
+    with concurrent.futures.ThreadPoolExecutor() as pool:
+        configs = list(pool.map(build, ["dev", "prod"]))
+
+The active context is tracked with contextvars, so an asyncio task sees the context that was active when it was created.
+On Pythons without contextvars (before 3.7) it is tracked for each thread instead.
+
+Note that the modules imported by .tf.py files are still shared by the whole process.
+"""
+
+import itertools
+import threading
+
+try:
+    import contextvars
+except ImportError:
+    # python < 3.7
+    contextvars = None
+
+
+class CompileContext(object):
+    """CompileContext holds the state of a config that is being declared and compiled
+
+    instances maps each TFObject class to the list of its own instances (the instances of its subclasses are in their
+    own lists), see TFObject.__new__.  The other attributes are exposed as class attributes, i.e. hooks and frozen as
+    ``TFObject._hooks`` and ``TFObject._frozen`` and provider as ``Provider.CURRENT_PROVIDER``.
+
+    A context can be activated with a with statement, which makes it the current context until the block exits:
+
+    .. code-block:: python
+
+        with CompileContext() as context:
+            Resource('aws_instance', 'web', ami='ami-12345678')
+            config = TFObject.compile()
+    """
+
+    def __init__(self):
+        self.provider = None
+        self.variant = None
+        self.batch = None
+        self._tokens = []
+        self.reset()
+
+    def reset(self):
+        """Forget all of the objects and hooks, like TFObject.reset"""
+        self.instances = {}
+        self.registry = None
+        self.hooks = None
+        self.frozen = False
+        self.sequence = itertools.count()
+
+    def __enter__(self):
+        self._tokens.append(_activate(self))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _deactivate(self._tokens.pop())
+
+
+_default_context = CompileContext()
+
+if contextvars is not None:
+    _current = contextvars.ContextVar("terraformpy_context", default=_default_context)
+
+    # current_context() returns the active CompileContext, it is called for every object that is created so it is the
+    # ContextVar's own get rather than a function that calls it
+    current_context = _current.get
+
+    def _activate(context):
+        return _current.set(context)
+
+    def _deactivate(token):
+        _current.reset(token)
+
+else:
+    _local = threading.local()
+
+    def current_context():
+        return getattr(_local, "context", _default_context)
+
+    def _activate(context):
+        previous = current_context()
+        _local.context = context
+        return previous
+
+    def _deactivate(previous):
+        _local.context = previous
+
+
+def context_property(name):
+    """Return a property, for use on a metaclass, that gets and sets an attribute of the current context
+
+    This is how the state that used to be kept in class attributes (i.e. ``Variant.CURRENT_VARIANT``) is still
+    available as class attributes.
+    """
+
+    def fget(cls):
+        return getattr(current_context(), name)
+
+    def fset(cls, value):
+        setattr(current_context(), name, value)
+
+    return property(fget, fset)
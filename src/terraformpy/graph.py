@@ -0,0 +1,473 @@
+"""
+Copyright 2019 NerdWallet
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+The graph of references between objects
+
+Interpolations are simply strings within the values of objects, so the references between objects are found by
+scanning the values of every registered object once for:
+
+* the interpolations within strings, i.e. ``${aws_instance.web.id}``, ``${var.name}`` or ``${data.aws_ami.ecs.id}``
+* the addresses listed in ``depends_on``
+* the ``provider`` of typed objects (or the default provider of their type, if one is defined) and the ``providers``
+  of modules
+
+References to locals, and to ``count``, ``each``, ``self``, ``path`` and ``terraform``, are ignored.  Since the
+iteration variables of ``for`` expressions look just like references, only names containing an underscore (as every
+resource type does) are considered to be references to resources.
+"""
+
+import collections
+import fnmatch
+import io
+import json
+import re
+
+import six
+
+from .objects import TFObject, TypedObjectAttr, _plain_values
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+# the first part of references that don't refer to objects
+IGNORED_PREFIXES = frozenset(["count", "each", "local", "path", "self", "terraform"])
+
+# the kinds of objects prune removes by default when nothing references them
+PRUNABLE = ("data", "variable")
+
+_GLOB_CHARS = re.compile(r"[*?[]")
+_STRING_LITERAL = re.compile(r'"(?:[^"\\]|\\.)*"')
+_REFERENCE = re.compile(
+    r"(?<![\w.-])([A-Za-z_][\w-]*)\.([A-Za-z_][\w-]*)(?:\.([A-Za-z_][\w-]*))?"
+)
+
+
+class DanglingReferenceError(ValueError):
+    """Raised by ReferenceGraph.check when objects reference addresses that are not defined
+
+    references is a list of (address, reference) tuples, where reference is the address that address refers to.
+    """
+
+    @property
+    def references(self):
+        return self.args[0]
+
+    def __str__(self):
+        return ", ".join(
+            "{0} references undefined {1}".format(address, reference)
+            for address, reference in self.references
+        )
+
+
+class NoMatchError(ValueError):
+    """Raised when a glob pattern selecting objects doesn't match any of them, pattern is the pattern"""
+
+    @property
+    def pattern(self):
+        return self.args[0]
+
+    def __str__(self):
+        return "{0} doesn't match any objects".format(self.pattern)
+
+
+def _expression_spans(text):
+    """Generate the (start, end) indexes of the expressions within the interpolations (``${...}``) of text"""
+    start = text.find("${")
+    while start != -1:
+        if start > 0 and text[start - 1] == "$":
+            # $${ is an escaped, literal, ${
+            start = text.find("${", start + 2)
+            continue
+
+        index = text.find("}", start + 2)
+        if index == -1:
+            return
+        expression = text[start + 2 : index]
+        if '"' not in expression and "{" not in expression:
+            # the common case, i.e. ${aws_instance.web.id}
+            yield start + 2, index
+            start = text.find("${", index)
+            continue
+
+        depth = 0
+        quoted = False
+        index = start + 2
+        while index < len(text):
+            char = text[index]
+            if quoted:
+                if char == "\\":
+                    index += 1
+                elif char == '"':
+                    quoted = False
+            elif char == '"':
+                quoted = True
+            elif char == "{":
+                depth += 1
+            elif char == "}":
+                if depth == 0:
+                    break
+                depth -= 1
+            index += 1
+
+        yield start + 2, index
+        start = text.find("${", index)
+
+
+def _expressions(text):
+    """Generate the expressions within the interpolations (``${...}``) of text"""
+    for start, end in _expression_spans(text):
+        yield text[start:end]
+
+
+def _address(parts):
+    """Return the address that the parts of a reference (i.e. ('aws_instance', 'web', 'id')) refer to, or None"""
+    first, second, third = parts
+    if first in IGNORED_PREFIXES:
+        return None
+    if first == "var":
+        return "variable." + second
+    if first == "module":
+        return "module." + second
+    if first == "data":
+        if third is None:
+            return None
+        return "data.{0}.{1}".format(second, third)
+    if "_" not in first:
+        return None
+    return "resource.{0}.{1}".format(first, second)
+
+
+def references(text):
+    """Return the list of addresses referenced by the interpolations within text"""
+    if isinstance(text, TypedObjectAttr):
+        # indexing a TypedObjectAttr references an attribute of it, rather than returning a character
+        text = str.__str__(text)
+
+    found = []
+    for expression in _expressions(text):
+        expression = _STRING_LITERAL.sub('""', expression)
+        for match in _REFERENCE.finditer(expression):
+            address = _address(match.groups())
+            if address is not None and address not in found:
+                found.append(address)
+    return found
+
+
+def rewrite_references(text, rewrite):
+    """Return text with the references within its interpolations rewritten
+
+    rewrite is called with the address and the text of each reference, i.e. ``resource.aws_instance.web`` and
+    ``aws_instance.web``, and returns the text to replace the reference with, or None to leave it alone.  Whatever
+    follows the reference (i.e. ``.id``) is kept.
+    """
+    if isinstance(text, TypedObjectAttr):
+        text = str.__str__(text)
+
+    def replace(match):
+        first, second, third = match.groups()
+        address = _address((first, second, third))
+        if address is None:
+            return match.group(0)
+
+        if first == "data":
+            reference, rest = match.group(0), ""
+        else:
+            reference = "{0}.{1}".format(first, second)
+            rest = "" if third is None else "." + third
+
+        new = rewrite(address, reference)
+        if new is None:
+            return match.group(0)
+        return new + rest
+
+    parts = []
+    position = 0
+    for start, end in _expression_spans(text):
+        parts.append(text[position:start])
+        parts.append(_REFERENCE.sub(replace, text[start:end]))
+        position = end
+    if not parts:
+        return text
+    parts.append(text[position:])
+    return "".join(parts)
+
+
+def _bare_reference(text):
+    # depends_on lists addresses without an interpolation, i.e. aws_instance.web or data.aws_ami.ecs
+    if "${" in text:
+        return references(text)
+    match = _REFERENCE.match(text)
+    if match is None:
+        return []
+    address = _address(match.groups())
+    return [] if address is None else [address]
+
+
+class _Scanner(object):
+    """Finds the references within values, remembering the references of each string since the same interpolations
+    (i.e. vpc.id) tend to be used over and over again
+    """
+
+    def __init__(self):
+        self._strings = {}
+
+    def strings(self, text):
+        try:
+            return self._strings[text]
+        except KeyError:
+            found = self._strings[text] = references(text) if "${" in text else []
+            return found
+
+    def scan(self, value, found):
+        if isinstance(value, six.string_types):
+            found.extend(self.strings(value))
+        elif isinstance(value, Mapping):
+            for key, val in six.iteritems(value):
+                if key == "depends_on" and isinstance(val, (list, tuple)):
+                    for item in val:
+                        if isinstance(item, six.string_types):
+                            found.extend(_bare_reference(item))
+                else:
+                    self.scan(val, found)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                self.scan(item, found)
+
+
+def _provider_address(name):
+    return "provider." + name
+
+
+class ReferenceGraph(object):
+    """ReferenceGraph holds the references between objects, keyed by their addresses (see Registry)
+
+    ``objects`` maps each address to its object, in the order they were created.  ``references`` maps each address to
+    the list of addresses it references that are defined, and ``dangling`` is the list of ``(address, reference)``
+    tuples of references to addresses that are not defined.  Both are only complete once every object has been scanned,
+    see build.
+    """
+
+    def __init__(self):
+        self.objects = collections.OrderedDict()
+        self.references = {}
+        self.dangling = []
+        self._scanner = _Scanner()
+
+    @classmethod
+    def build(cls, objects=None, scan=True):
+        """Build the graph of the given objects, all of the registered objects by default, in a single pass
+
+        When scan is False the references of each object are only found when they're first needed, so that selecting a
+        few objects and their dependencies (see select) doesn't need to scan the values of every object.
+        """
+        if objects is None:
+            objects = TFObject.registry()
+
+        graph = cls()
+        for obj in objects:
+            graph.objects.setdefault(obj._address, obj)
+
+        if scan:
+            graph._scan_all()
+        return graph
+
+    def _scan_all(self):
+        for address in self.objects:
+            self.references_of(address)
+
+    def references_of(self, address):
+        """Return the list of defined addresses that the object at address references"""
+        try:
+            return self.references[address]
+        except KeyError:
+            pass
+
+        obj = self.objects[address]
+        # reading the shared values of a replica (see SharedValues) through the mapping would copy them
+        values = _plain_values(obj._values)
+        found = []
+        self._scanner.scan(values, found)
+
+        provider = values.get("provider")
+        if isinstance(provider, six.string_types):
+            found.append(_provider_address(provider))
+        elif provider is None and hasattr(obj, "_type"):
+            # the default provider is only a reference if it's defined here
+            default = _provider_address(obj._type.split("_")[0])
+            if default in self.objects:
+                found.append(default)
+
+        providers = values.get("providers")
+        if obj.TF_TYPE == "module" and isinstance(providers, Mapping):
+            found.extend(
+                _provider_address(name)
+                for name in six.itervalues(providers)
+                if isinstance(name, six.string_types)
+            )
+
+        refs = []
+        seen = set([address])
+        for reference in found:
+            if reference in seen:
+                continue
+            seen.add(reference)
+            if reference in self.objects:
+                refs.append(reference)
+            else:
+                self.dangling.append((address, reference))
+        self.references[address] = refs
+        return refs
+
+    def referenced_by(self):
+        """Return a dict of each address to the list of addresses that reference it"""
+        self._scan_all()
+        result = dict((address, []) for address in self.objects)
+        for address, refs in six.iteritems(self.references):
+            for reference in refs:
+                result[reference].append(address)
+        return result
+
+    def check(self):
+        """Raise a DanglingReferenceError if any object references an address that is not defined"""
+        self._scan_all()
+        if self.dangling:
+            raise DanglingReferenceError(list(self.dangling))
+
+    def prune(self, kinds=PRUNABLE):
+        """Return the list of objects to keep, without the objects of the given kinds (TF_TYPEs) that nothing
+        references
+
+        Objects that are only referenced by pruned objects are pruned as well.  Outputs are never referenced from
+        within a config, they are its interface, so they're always kept along with everything they reference.
+        """
+        self._scan_all()
+        referrers = dict((address, 0) for address in self.objects)
+        for refs in six.itervalues(self.references):
+            for reference in refs:
+                referrers[reference] += 1
+
+        pruned = set()
+        pending = [
+            address
+            for address, obj in six.iteritems(self.objects)
+            if obj.TF_TYPE in kinds and not referrers[address]
+        ]
+        while pending:
+            address = pending.pop()
+            pruned.add(address)
+            for reference in self.references[address]:
+                referrers[reference] -= 1
+                if (
+                    not referrers[reference]
+                    and self.objects[reference].TF_TYPE in kinds
+                    and reference not in pruned
+                ):
+                    pending.append(reference)
+
+        return [
+            obj for address, obj in six.iteritems(self.objects) if address not in pruned
+        ]
+
+    def match(self, pattern):
+        """Return the list of addresses matching the glob pattern, i.e. ``resource.aws_instance.web*``
+
+        Like Terraform's ``-target`` resources can also be matched without the ``resource.`` prefix of their address.
+        """
+        if not _GLOB_CHARS.search(pattern):
+            return [
+                address
+                for address in (pattern, "resource." + pattern)
+                if address in self.objects
+            ]
+
+        match = re.compile(fnmatch.translate(pattern)).match
+        return [
+            address
+            for address in self.objects
+            if match(address) or (address.startswith("resource.") and match(address, 9))
+        ]
+
+    def dependencies(self, addresses):
+        """Return the set of the addresses and everything they reference, directly or indirectly"""
+        result = set()
+        pending = list(addresses)
+        while pending:
+            address = pending.pop()
+            if address in result:
+                continue
+            result.add(address)
+            pending.extend(self.references_of(address))
+        return result
+
+    def select(self, patterns):
+        """Return the list of objects matching any of the glob patterns along with everything they depend on, in the
+        order they were created, see match
+
+        Raises NoMatchError if any of the patterns doesn't match anything.
+        """
+        addresses = []
+        for pattern in patterns:
+            matched = self.match(pattern)
+            if not matched:
+                raise NoMatchError(pattern)
+            addresses.extend(matched)
+        selected = self.dependencies(addresses)
+        return [
+            obj for address, obj in six.iteritems(self.objects) if address in selected
+        ]
+
+    def to_dict(self):
+        """Return the graph as a dict of nodes, edges and dangling references that can be encoded as JSON"""
+        self._scan_all()
+        return {
+            "nodes": list(self.objects),
+            "edges": [
+                [address, reference]
+                for address in self.objects
+                for reference in self.references[address]
+            ],
+            "dangling": [list(item) for item in self.dangling],
+        }
+
+    def to_dot(self):
+        """Return the graph in the DOT language of Graphviz, with dangling references drawn dashed"""
+        self._scan_all()
+        lines = ["digraph terraformpy {", "    rankdir=LR;"]
+        for address in self.objects:
+            lines.append("    {0};".format(json.dumps(address)))
+        for address in self.objects:
+            for reference in self.references[address]:
+                lines.append(
+                    "    {0} -> {1};".format(json.dumps(address), json.dumps(reference))
+                )
+        for address, reference in self.dangling:
+            lines.append(
+                "    {0} -> {1} [style=dashed, color=red];".format(
+                    json.dumps(address), json.dumps(reference)
+                )
+            )
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the graph to path, as DOT if path ends with .dot and as JSON otherwise"""
+        if path.endswith(".dot"):
+            text = self.to_dot()
+        else:
+            text = json.dumps(self.to_dict(), indent=2) + "\n"
+        with io.open(path, "w", encoding="utf-8") as fd:
+            fd.write(six.text_type(text))
@@ -14,8 +14,9 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import inspect
+import hashlib
 import os
+import sys
 
 
 def relative_file(filename, _caller_depth=1):
@@ -47,8 +48,31 @@ def relative_file(filename, _caller_depth=1):
     )
 
 
+# (cwd, caller directory, path) -> the result of relative_path
+_relative_paths = {}
+
+
 def relative_path(path, _caller_depth=1):
-    caller = inspect.stack()[_caller_depth]
-    return "${{path.module}}/{0}".format(
-        os.path.relpath(os.path.join(os.path.dirname(caller[1]), path))
+    # only the file name of the caller's code is needed, which doesn't require building the frame records (and reading
+    # the source lines) of the entire stack like inspect.stack() does
+    caller_dir = os.path.dirname(sys._getframe(_caller_depth).f_code.co_filename)
+
+    key = (os.getcwd(), caller_dir, path)
+    try:
+        return _relative_paths[key]
+    except KeyError:
+        pass
+
+    result = _relative_paths[key] = "${{path.module}}/{0}".format(
+        os.path.relpath(os.path.join(caller_dir, path))
     )
+    return result
+
+
+def file_hash(path):
+    """Return the hex sha256 digest of the content of path"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for chunk in iter(lambda: fd.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,229 @@
+"""
+Copyright 2019 NerdWallet
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Hoisting of repeated values into Terraform locals
+
+Large values that are repeated many times in a compiled config (tag maps, policy documents, etc) can be written once
+under ``locals`` and replaced by a ``${local.<name>}`` reference everywhere they occur.  Since Terraform requires blocks
+to be written out literally only values that are known to be attributes are hoisted:
+
+* strings, anywhere within the body of a resource, data source, module or output
+* the maps of the attributes named in MAP_ATTRIBUTES, i.e. ``tags``
+
+Values referencing ``self``, ``count`` or ``each`` are left in place, since those are only available within the object
+itself, as are the meta-arguments (``provider``, ``depends_on``, ``lifecycle``, etc) and descriptions that Terraform
+needs to be literal.
+
+Each local is named after an attribute it was found in and the hash of its value, so the names don't change as long as
+the values don't, which keeps diffs of the generated files small.
+"""
+
+import hashlib
+import json
+import re
+
+import six
+
+# the sections whose values are hoisted, and the depth of the object bodies within them
+SECTIONS = {"resource": 2, "data": 2, "module": 1, "output": 1}
+
+# attributes whose (map) values are hoisted as a whole
+MAP_ATTRIBUTES = frozenset(["tags", "tags_all", "labels"])
+
+# keys whose values are never hoisted, or looked into
+SKIP_KEYS = frozenset(
+    [
+        "connection",
+        "count",
+        "depends_on",
+        "description",
+        "dynamic",
+        "for_each",
+        "lifecycle",
+        "provider",
+        "providers",
+        "provisioner",
+        "sensitive",
+        "source",
+        "version",
+    ]
+)
+
+# values that are smaller than this, as compact JSON, are not worth hoisting
+MIN_SIZE = 256
+
+_OBJECT_REFERENCE = re.compile(r"\$\{[^}]*\b(self|count|each)\.")
+_INVALID_NAME_CHARS = re.compile(r"[^A-Za-z0-9_-]")
+
+
+def _dumps(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+class _Candidates(object):
+    """Counts each hoistable value by the hash of its value, along with the attributes it was found in"""
+
+    def __init__(self, min_size):
+        self.min_size = min_size
+        self.counts = {}
+        self.attributes = {}
+        self.values = {}
+        # compiled configs often hold the very same map many times over, so hashes are remembered by the id of the
+        # value (along with the value, so that its id can't be reused)
+        self._digests = {}
+
+    def digest(self, value):
+        """Return the hash of value, or None if it can't or shouldn't be hoisted"""
+        if isinstance(value, six.string_types) and len(value) < self.min_size:
+            return None
+
+        try:
+            known, digest = self._digests[id(value)]
+            if known is value:
+                return digest
+        except KeyError:
+            pass
+
+        if isinstance(value, six.string_types):
+            text = value
+        else:
+            text = _dumps(value)
+        if len(text) < self.min_size or _OBJECT_REFERENCE.search(text):
+            digest = None
+        else:
+            digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+        self._digests[id(value)] = (value, digest)
+        return digest
+
+    def add(self, attribute, value):
+        digest = self.digest(value)
+        if digest is not None:
+            self.counts[digest] = self.counts.get(digest, 0) + 1
+            self.attributes.setdefault(digest, set()).add(attribute)
+            self.values.setdefault(digest, value)
+
+
+def _walk(value, visit):
+    """Call visit(attribute, value) for each hoistable value within value, replacing it with what visit returns
+
+    Containers are only copied when something within them was replaced, so the result shares everything else with
+    value, which itself is never modified.
+    """
+    if isinstance(value, dict):
+        result = None
+        for key, val in six.iteritems(value):
+            if key in SKIP_KEYS:
+                continue
+            if isinstance(val, six.string_types) or (
+                key in MAP_ATTRIBUTES and isinstance(val, dict)
+            ):
+                new = visit(key, val)
+            elif isinstance(val, list):
+                new = _walk_list(key, val, visit)
+            else:
+                new = _walk(val, visit)
+            if new is not val:
+                if result is None:
+                    result = dict(value)
+                result[key] = new
+        return value if result is None else result
+
+    return value
+
+
+def _walk_list(attribute, values, visit):
+    # strings within a list are hoisted under the name of the attribute holding the list
+    result = None
+    for index, val in enumerate(values):
+        if isinstance(val, six.string_types):
+            new = visit(attribute, val)
+        elif isinstance(val, list):
+            new = _walk_list(attribute, val, visit)
+        else:
+            new = _walk(val, visit)
+        if new is not val:
+            if result is None:
+                result = list(values)
+            result[index] = new
+    return values if result is None else result
+
+
+def _walk_bodies(config, visit):
+    result = dict(config)
+    for section, depth in six.iteritems(SECTIONS):
+        if section in config:
+            result[section] = _walk_section(config[section], depth, visit)
+    return result
+
+
+def _walk_section(value, depth, visit):
+    if not isinstance(value, dict):
+        return value
+    if depth == 0:
+        return _walk(value, visit)
+
+    result = None
+    for key, val in six.iteritems(value):
+        new = _walk_section(val, depth - 1, visit)
+        if new is not val:
+            if result is None:
+                result = dict(value)
+            result[key] = new
+    return value if result is None else result
+
+
+def local_name(attribute, digest):
+    """Return the name of the local for a value of attribute with the given (hex) hash"""
+    return "{0}_{1}".format(_INVALID_NAME_CHARS.sub("_", attribute), digest[:10])
+
+
+def hoist_locals(config, min_size=MIN_SIZE, min_count=2):
+    """Return a copy of the compiled config with the values that are at least min_size characters long (as compact JSON)
+    and occur at least min_count times moved into locals
+
+    The config itself is not modified, and the returned config shares all of the values that were not changed with it.
+    """
+    candidates = _Candidates(min_size)
+
+    def count(attribute, value):
+        candidates.add(attribute, value)
+        return value
+
+    _walk_bodies(config, count)
+
+    # a value found in more than one attribute is named after the first of them, so that the name doesn't depend on
+    # the order of the objects
+    hoisted = dict(
+        (digest, local_name(min(candidates.attributes[digest]), digest))
+        for digest, occurrences in six.iteritems(candidates.counts)
+        if occurrences >= min_count
+    )
+    if not hoisted:
+        return config
+
+    def replace(attribute, value):
+        try:
+            return "${local.%s}" % hoisted[candidates.digest(value)]
+        except KeyError:
+            return value
+
+    result = _walk_bodies(config, replace)
+
+    new_locals = dict(result.get("locals") or {})
+    for digest in sorted(hoisted, key=hoisted.get):
+        new_locals.setdefault(hoisted[digest], candidates.values[digest])
+    result["locals"] = new_locals
+    return result
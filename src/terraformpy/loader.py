@@ -0,0 +1,489 @@
+"""
+Copyright 2019 NerdWallet
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Loading of .tf.py files
+
+Files can either be loaded into the shared, global registry (which is what the CLI does by default), or each one can be
+compiled on its own into a "fragment" that is then merged with the fragments of the other files.  Compiling files on
+their own allows them to be compiled in parallel, in separate worker processes.
+
+Fragments are passed around as compact JSON text, which keeps the repeated keys of the provider section intact.
+
+The same set of files can also be compiled once for each of a number of variants, with each variant being loaded in a
+process forked from the (already warm) parent.
+
+The compiled code of each .tf.py file is cached in .terraformpy/bytecode, so a file is only parsed and compiled again
+when its content changes.
+"""
+
+import ast
+import collections
+import hashlib
+import importlib
+import io
+import json
+import marshal
+import multiprocessing
+import os
+import sys
+
+from . import profiling
+from .cache import local_modules
+from .context import CompileContext
+from .objects import ConfigMerger, DuplicateKey, Provider, TFObject
+from .variant import Variant
+from .watch import _purge_module
+from .writer import get_encoder, iter_json
+
+try:
+    import importlib.machinery
+    import importlib.util
+
+    MAGIC_NUMBER = importlib.util.MAGIC_NUMBER
+    module_from_spec = importlib.util.module_from_spec
+except (ImportError, AttributeError):
+    # python 2
+    module_from_spec = None
+
+BYTECODE_DIR = os.path.join(".terraformpy", "bytecode")
+
+
+if module_from_spec is not None:
+
+    class TFLoader(importlib.machinery.SourceFileLoader):
+        """TFLoader loads .tf.py files, caching their compiled code by the hash of their content in BYTECODE_DIR
+
+        Each file has a single entry, named after the hash of its path, that starts with the hash of the content the
+        code was compiled from.  The cache is best effort, if it can't be read or written the file is simply compiled.
+        """
+
+        def _entry_path(self):
+            name = hashlib.sha256(self.path.encode("utf-8")).hexdigest()
+            return os.path.join(BYTECODE_DIR, name)
+
+        def get_code(self, fullname):
+            source = self.get_data(self.path)
+
+            digest = hashlib.sha256(MAGIC_NUMBER)
+            digest.update(self.path.encode("utf-8"))
+            digest.update(source)
+            key = digest.hexdigest().encode("ascii")
+
+            entry_path = self._entry_path()
+            try:
+                with io.open(entry_path, "rb") as fd:
+                    if fd.read(len(key)) == key:
+                        return marshal.load(fd)
+            except (IOError, OSError, EOFError, ValueError, TypeError):
+                pass
+
+            code = self.source_to_code(source, self.path)
+
+            try:
+                if not os.path.isdir(BYTECODE_DIR):
+                    os.makedirs(BYTECODE_DIR)
+                tmp_path = "%s.%d.tmp" % (entry_path, os.getpid())
+                with io.open(tmp_path, "wb") as fd:
+                    fd.write(key)
+                    marshal.dump(code, fd)
+                os.rename(tmp_path, entry_path)
+            except (IOError, OSError):
+                pass
+
+            return code
+
+
+def _load_source(name, filename):
+    if module_from_spec is None:
+        import imp
+
+        return imp.load_source(name, filename)
+
+    # like imp.load_source the module is named after the file and its __file__ is the path we were given, which is
+    # what helpers.relative_path resolves paths from
+    loader = TFLoader(name, filename)
+    spec = importlib.util.spec_from_file_location(name, filename, loader=loader)
+    module = module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        loader.exec_module(module)
+    except BaseException:
+        sys.modules.pop(name, None)
+        raise
+    return module
+
+
+def load_file(filename):
+    """Load a .tf.py file, registering all of the objects it declares"""
+    profiler = profiling.profiler
+    if profiler is None:
+        return _load_source(filename[:-6], filename)
+
+    with profiler.timer("file", filename):
+        return _load_source(filename[:-6], filename)
+
+
+def load_files(filenames, batch_validation=False, load=load_file):
+    """Load each of the files with load (load_file by default)
+
+    When batch_validation is True the ResourceCollections created by all of the files are validated together once they
+    have all been loaded, see BatchValidation.
+    """
+    if not batch_validation:
+        for filename in filenames:
+            load(filename)
+        return
+
+    # only import schematics when it's needed
+    from .resource_collections import BatchValidation
+
+    with BatchValidation():
+        for filename in filenames:
+            load(filename)
+
+
+def _fresh_registry(keep=()):
+    # forget about local modules that were imported by previously compiled files, so that we see (and execute) every
+    # local module the file depends on, other than those in keep (see _warm_imports)
+    for name in local_modules():
+        if name not in keep:
+            del sys.modules[name]
+
+    TFObject.reset()
+
+
+class _InProcess(object):
+    """Compiles files, or variants, one after the other in this process, each of them as if it was compiled by a worker
+    process forked from this one
+
+    The modules and hooks that a worker would start with are recorded when this is created.  Before each compile the
+    registry is reset, those hooks are added again and every module imported since then, and every local module, is
+    forgotten, so that the modules a compile imports are executed, and declare their objects and hooks, for each of
+    them.
+    """
+
+    def __init__(self):
+        # the workers don't share schematics, but we must, since it can't be forgotten while resource_collections is
+        # still using it
+        importlib.import_module("terraformpy.resource_collections")
+        self.modules = set(sys.modules)
+        self.hooks = TFObject._hooks
+
+    def fresh_registry(self, keep=()):
+        for name in (set(sys.modules) - self.modules) | local_modules():
+            if name not in keep:
+                _purge_module(name)
+
+        TFObject.reset()
+        if self.hooks:
+            TFObject._hooks = list(self.hooks)
+
+
+def compile_file(filename, batch_validation=False, fresh_registry=_fresh_registry):
+    """Load a single .tf.py file into an empty registry and compile it
+
+    Returns a tuple of the compiled config, as JSON text, and the paths of the local modules that were imported while
+    loading the file.  The registry is emptied by calling fresh_registry.
+    """
+    fresh_registry()
+    load_files([filename], batch_validation=batch_validation)
+
+    deps = set()
+    for name in local_modules():
+        path = os.path.relpath(sys.modules[name].__file__)
+        if path.endswith(".pyc"):
+            path = path[:-1]
+        if path != filename:
+            deps.add(path)
+
+    return dump_fragment(TFObject.compile()), sorted(deps)
+
+
+def dump_fragment(config):
+    return "".join(iter_json(config, indent=None, encoder=get_encoder(indent=None)))
+
+
+def _object_pairs(pairs):
+    keys = [key for key, _ in pairs]
+    if len(set(keys)) == len(keys):
+        return dict(pairs)
+    return dict((DuplicateKey(key), val) for key, val in pairs)
+
+
+def _call(task):
+    func, args = task
+    return func(*args)
+
+
+def _profiled_call(task):
+    # profile a call in a worker process, returning the entries of the worker's profiler along with the result
+    profiler = profiling.enable()
+    return _call(task), profiler.entries
+
+
+def _map_in_workers(pool, func, args):
+    """Call func with each of the tuples in args in the pool's worker processes, returning the list of results"""
+    tasks = [(func, task_args) for task_args in args]
+
+    profiler = profiling.profiler
+    if profiler is None:
+        return list(pool.imap(_call, tasks, chunksize=1))
+
+    results = []
+    for result, entries in pool.imap(_profiled_call, tasks, chunksize=1):
+        profiler.update(entries)
+        results.append(result)
+    return results
+
+
+def load_fragment(text):
+    """Load a fragment produced by dump_fragment back into a config that can be merged"""
+    config = json.loads(text, object_pairs_hook=_object_pairs)
+
+    # providers are keyed by DuplicateKey, even when a fragment only has a single provider of a given name, so that
+    # they do not collide with the providers of other fragments when merged
+    try:
+        providers = config[Provider.TF_TYPE]
+    except KeyError:
+        pass
+    else:
+        config[Provider.TF_TYPE] = dict(
+            (key if isinstance(key, DuplicateKey) else DuplicateKey(key), val)
+            for key, val in providers.items()
+        )
+
+    return config
+
+
+def _compile_file_collecting_errors(
+    filename, batch_validation, fresh_registry=_fresh_registry
+):
+    # validation errors are returned rather than raised, so that the errors of all of the files are reported together
+    from .resource_collections import BatchValidationError
+
+    try:
+        return compile_file(filename, batch_validation, fresh_registry)
+    except BatchValidationError as exc:
+        return exc
+
+
+def _raise_validation_errors(results):
+    from .resource_collections import BatchValidationError
+
+    errors = collections.OrderedDict()
+    for result in results:
+        if isinstance(result, BatchValidationError):
+            errors.update(result.errors)
+    if errors:
+        raise BatchValidationError(errors)
+
+
+def compile_fragments(filenames, jobs=1, cache=None, batch_validation=False):
+    """Compile each file on its own, returning a list of (filename, config) tuples in the order of filenames
+
+    When jobs is more than one the files are compiled in worker processes, using up to jobs processes at once.  When a
+    CompileCache is provided files that have a valid entry in it are not executed at all.  When batch_validation is True
+    the errors of every file are raised together in a single BatchValidationError.
+    """
+    fragments = {}
+    if cache is not None:
+        for filename in filenames:
+            fragment = cache.get(filename)
+            if fragment is not None:
+                fragments[filename] = fragment
+
+    misses = [filename for filename in filenames if filename not in fragments]
+    func = _compile_file_collecting_errors if batch_validation else compile_file
+    if jobs > 1 and len(misses) > 1:
+        # every file gets a fresh worker, so that nothing (registered objects, hooks, imported modules) leaks between
+        # files
+        pool = multiprocessing.Pool(processes=jobs, maxtasksperchild=1)
+        try:
+            results = _map_in_workers(
+                pool, func, [(filename, batch_validation) for filename in misses]
+            )
+        finally:
+            pool.terminate()
+            pool.join()
+    elif misses:
+        fresh_registry = _InProcess().fresh_registry
+        results = [
+            func(filename, batch_validation, fresh_registry) for filename in misses
+        ]
+    else:
+        results = []
+
+    if batch_validation:
+        _raise_validation_errors(results)
+
+    for filename, (fragment, deps) in zip(misses, results):
+        fragments[filename] = fragment
+        if cache is not None:
+            cache.put(filename, fragment, deps)
+
+    return [(filename, load_fragment(fragments[filename])) for filename in filenames]
+
+
+def merge_fragments(fragments):
+    """Merge the (filename, config) tuples from compile_fragments
+
+    Fragments are merged in the order given, regardless of the order in which they were compiled, so that the result is
+    deterministic.  Returns a ConfigMerger whose origins are the file names, so any conflicts can be reported with the
+    file that defined each side.
+    """
+    merger = ConfigMerger()
+    for filename, config in fragments:
+        merger.merge(config, origin=filename)
+    return merger
+
+
+def compile_files(filenames, jobs=1, cache=None, batch_validation=False):
+    """Compile each file on its own and merge the results, see compile_fragments and merge_fragments"""
+    return merge_fragments(
+        compile_fragments(
+            filenames, jobs=jobs, cache=cache, batch_validation=batch_validation
+        )
+    )
+
+
+def compile_variant(
+    variant, filenames, batch_validation=False, keep=(), fresh_registry=_fresh_registry
+):
+    """Load all of the files into an empty registry within the named Variant and compile them
+
+    The registry is emptied by calling fresh_registry with keep, the local modules that don't depend on the variant and
+    that are used as they are rather than imported again.  Returns the compiled config as JSON text, see dump_fragment.
+    """
+    with Variant(variant):
+        fresh_registry(keep)
+        load_files(filenames, batch_validation=batch_validation)
+        return dump_fragment(TFObject.compile())
+
+
+def _imported_names(filenames):
+    """Return the names of the modules imported (with absolute imports) by the files, in the order they are imported"""
+    names = []
+    for filename in filenames:
+        try:
+            with io.open(filename, "rb") as fd:
+                tree = ast.parse(fd.read(), filename)
+        except (IOError, OSError, SyntaxError, ValueError):
+            # the file will fail to load, and report why, when it's compiled
+            continue
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+                names.append(node.module)
+    return names
+
+
+class _WarmContext(CompileContext):
+    """The context modules are imported into by _warm_imports, which notices if they look at the current Variant"""
+
+    def __init__(self):
+        self.variant_used = False
+        super(_WarmContext, self).__init__()
+
+    @property
+    def variant(self):
+        self.variant_used = True
+        return self._variant
+
+    @variant.setter
+    def variant(self, value):
+        self._variant = value
+
+    @property
+    def declared(self):
+        return bool(self.instances or self.hooks or self.registry)
+
+
+def _warm_imports(filenames):
+    """Import schematics, and the modules the files import, so that the processes forked from this one share them
+    rather than each of them importing everything again
+
+    Modules that declare objects or hooks, or that look at the current Variant, when they're imported are forgotten
+    again, since they must be imported within each variant.  Returns the names of the local modules that were kept,
+    see compile_variant.
+    """
+    importlib.import_module("terraformpy.resource_collections")
+
+    kept = set()
+    for name in _imported_names(filenames):
+        if name in sys.modules:
+            continue
+
+        before = set(sys.modules)
+        context = _WarmContext()
+        with context:
+            try:
+                importlib.import_module(name)
+            except Exception:
+                # the file will report it when it's compiled
+                pass
+        imported = set(sys.modules) - before
+
+        if context.declared or context.variant_used:
+            for module_name in imported:
+                del sys.modules[module_name]
+        else:
+            kept.update(imported)
+
+    return kept & local_modules()
+
+
+def _fork_context():
+    """Return a multiprocessing context that forks, or the multiprocessing module itself if forking isn't possible"""
+    get_context = getattr(multiprocessing, "get_context", None)
+    if get_context is None:
+        # python 2 always forks on posix
+        return multiprocessing
+    if "fork" in multiprocessing.get_all_start_methods():
+        return get_context("fork")
+    return get_context()
+
+
+def compile_variants(variants, filenames, jobs=None, batch_validation=False):
+    """Compile the files once for each of the named variants, returning a list of (variant, config) tuples in the order
+    of variants
+
+    Each variant is compiled in its own worker process, forked from this one so that everything that has already been
+    imported is shared, using up to jobs processes (the number of CPUs by default) at once.  With a single job they're
+    compiled in this process instead, one after the other (see _InProcess).  Before forking, the
+    modules that the files import, and that don't depend on the variant, are imported here (see _warm_imports).
+    """
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = min(jobs, len(variants))
+
+    keep = _warm_imports(filenames)
+    args = [(variant, filenames, batch_validation, keep) for variant in variants]
+    if jobs > 1:
+        pool = _fork_context().Pool(processes=jobs, maxtasksperchild=1)
+        try:
+            results = _map_in_workers(pool, compile_variant, args)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        fresh_registry = _InProcess().fresh_registry
+        results = [
+            compile_variant(*(task_args + (fresh_registry,))) for task_args in args
+        ]
+
+    return [
+        (variant, load_fragment(result)) for variant, result in zip(variants, results)
+    ]
@@ -18,21 +18,41 @@ Terraform "objects"
 This module provides a set of classes that can be used to build Terraform configurations in a (mostly) declarative way,
 while also leveraging Python to add some functional aspects to automate some of the more repetitive aspects of HCL.
 """
-import collections
+
+import copy
+import itertools
+import sys
+import warnings
 
 import six
-from schematics.types import compound
 
-from .resource_collections import Variant
+from . import profiling
+from .context import context_property, current_context
+
+try:
+    from collections.abc import Mapping, MutableMapping
+except ImportError:
+    from collections import Mapping, MutableMapping
+
+
+if sys.version_info >= (3, 7):
+
+    def __getattr__(name):
+        # OrderedDict is a schematics type, schematics is only imported once it is used
+        if name == "OrderedDict":
+            from .resource_collections import OrderedDict
+
+            return OrderedDict
+        raise AttributeError(
+            "module {0!r} has no attribute {1!r}".format(__name__, name)
+        )
+
+else:
+    from .resource_collections import OrderedDict  # noqa
 
 
 def recursive_update(dest, source):
     """Like dict.update, but recursive"""
-    try:
-        from collections.abc import Mapping
-    except ImportError:
-        from collections import Mapping
-
     for key, val in six.iteritems(source):
         if isinstance(val, Mapping):
             recurse = recursive_update(dest.get(key, {}), val)
@@ -42,6 +62,183 @@ def recursive_update(dest, source):
     return dest
 
 
+def _hook_name(key, hook):
+    """Describe a hook registered with key for the profiler, i.e. resource.aws_instance:add_tags"""
+    name = getattr(hook, "__name__", None) or repr(hook)
+    return "{0}:{1}".format(".".join(part for part in key if part), name)
+
+
+class ConflictWarning(UserWarning):
+    """Emitted when an object is created with the address of an existing object, or when two objects write different
+    values to the same address in the compiled output
+    """
+
+
+class ConfigMerger(object):
+    """ConfigMerger accumulates built objects into a single ``{tf_type: {type: {name: body}}}`` config in one pass.
+
+    Unlike folding every fragment into the result with ``recursive_update`` the fragments are inserted directly, and
+    only the (rare) addresses that are defined more than once are walked and merged.  The merged output is identical to
+    what ``recursive_update`` would have produced, including key order.
+
+    Since the inserted bodies are not copied the merged result shares them with the objects that built them.  Any dict
+    that would need to be modified during a merge is copied first, so the objects themselves are never mutated.
+
+    Every value that gets overwritten with a different value is recorded in ``conflicts`` as a tuple of
+    ``(path, previous_origin, origin)``, where ``path`` is the tuple of keys leading to the value and the origins are
+    whatever was passed to ``merge`` for the fragments involved.
+    """
+
+    def __init__(self):
+        self.result = {}
+        self.conflicts = []
+        self._owned = set([id(self.result)])
+        self._origins = {}
+
+    def merge(self, fragment, origin=None):
+        self._merge(self.result, fragment, (), origin)
+        return self.result
+
+    def _merge(self, dest, source, path, origin):
+        for key, val in six.iteritems(source):
+            try:
+                existing = dest[key]
+            except KeyError:
+                dest[key] = val
+                self._origins[path + (key,)] = origin
+                continue
+
+            if isinstance(val, Mapping) and isinstance(existing, Mapping):
+                if id(existing) not in self._owned:
+                    existing = dict(existing)
+                    self._owned.add(id(existing))
+                    dest[key] = existing
+                self._merge(existing, val, path + (key,), origin)
+                continue
+
+            if existing != val:
+                self.conflicts.append(
+                    (path + (key,), self.origin_of(path + (key,)), origin)
+                )
+            dest[key] = val
+            self._origins[path + (key,)] = origin
+
+    def origin_of(self, path):
+        """Return the origin of the fragment that defined the value at path"""
+        for end in range(len(path), 0, -1):
+            try:
+                return self._origins[path[:end]]
+            except KeyError:
+                continue
+        return None
+
+
+class SharedValues(MutableMapping):
+    """SharedValues are the values of an object that share their structure with the values of other objects
+
+    The shared dict is never modified.  Values that are set on an instance are kept in a dict of its own, which takes
+    precedence over the shared values, so replicas only use memory for the values that differ between them.  Nested
+    dicts are copied into our own dict the first time they are accessed, so that they are plain dicts that can be
+    changed in place, and every access returns the same dict.  Code that only reads the values should use plain()
+    instead, so that nothing is copied.
+
+    Lists (and anything nested within them) are shared as they are, replace them rather than changing them in place.
+    """
+
+    __slots__ = ("_shared", "_own")
+
+    def __init__(self, shared, own=None):
+        self._shared = shared
+        self._own = own
+
+    def __getitem__(self, key):
+        own = self._own
+        if own is not None and key in own:
+            return own[key]
+        value = self._shared[key]
+        if type(value) is dict:
+            value = self[key] = _copy_dicts(value)
+        return value
+
+    def __setitem__(self, key, value):
+        if self._own is None:
+            self._own = {}
+        self._own[key] = value
+
+    def __delitem__(self, key):
+        if key in self._shared:
+            # deletes are rare, so we simply stop sharing
+            own = self._own
+            self._shared = dict(self._shared)
+            self._shared.update(own or ())
+            self._own = None
+            del self._shared[key]
+        else:
+            del self._own[key]
+
+    def __contains__(self, key):
+        return key in self._shared or (self._own is not None and key in self._own)
+
+    def __iter__(self):
+        for key in self._shared:
+            yield key
+        for key in self._own or ():
+            if key not in self._shared:
+                yield key
+
+    def __len__(self):
+        return len(self._shared) + sum(
+            1 for key in self._own or () if key not in self._shared
+        )
+
+    def __repr__(self):
+        return "{0}({1!r})".format(type(self).__name__, self.plain())
+
+    def copy(self):
+        return SharedValues(self._shared, _copy_dicts(self._own) if self._own else None)
+
+    def plain(self):
+        """Return our values as a dict, with the values that haven't been accessed or modified still shared"""
+        result = dict(self._shared)
+        if self._own:
+            result.update(self._own)
+        return result
+
+
+def _copy_dicts(value):
+    # the dicts nested within value are copied as well, since any of them could be changed in place
+    if type(value) is not dict:
+        return value
+    return dict((key, _copy_dicts(val)) for key, val in six.iteritems(value))
+
+
+def _plain_values(values):
+    if isinstance(values, SharedValues):
+        return values.plain()
+    return values
+
+
+def _variant_values(kwargs, variant_key):
+    """Return the values of kwargs, with the values for the variant named by variant_key (if any) merged in, see
+    NamedObject.__init__
+    """
+    if variant_key is None:
+        return kwargs
+
+    values = {}
+    for key in kwargs:
+        if not key.endswith("_variant"):
+            values[key] = kwargs[key]
+        elif key == variant_key:
+            values.update(kwargs[key])
+    return values
+
+
+def _current_variant_key():
+    variant = current_context().variant
+    return None if variant is None else "{0}_variant".format(variant.name)
+
+
 class DuplicateKey(str):
     """DuplicateKey provides a native string (str) replacement that can be used as a
     dictionary key that will serialize out to JSON and maintain the duplicity.
@@ -49,95 +246,244 @@ class DuplicateKey(str):
     This is needed because the JSON representation of HCL requires duplicate keys for
     provider resources, which is technically not against the JSON spec[1].
 
-    Insertion order is preserved by using a counter value as the hash value per unique
-    key that is generated using this class.
+    Each instance is given the next number from a sequence, which it is hashed and
+    ordered by, so keys are unique and sort in the order they were created no matter
+    what the hash seed is.  The sequence belongs to the current CompileContext and is restarted by TFObject.reset.
 
     [1]: https://stackoverflow.com/a/21833017/11439015
     """
 
-    _next_hash = collections.defaultdict(lambda: 0)
-
     def __new__(cls, key):
         inst = super(DuplicateKey, cls).__new__(cls, key)
+        inst._seq = next(current_context().sequence)
+        return inst
 
-        inst._hash = hash((key, DuplicateKey._next_hash[key]))
-        DuplicateKey._next_hash[key] += 1
+    @classmethod
+    def reset(cls):
+        current_context().sequence = itertools.count()
 
-        return inst
+    def _sort_key(self):
+        return (str(self), self._seq)
 
     def __hash__(self):
-        return self._hash
+        return hash(self._seq)
 
     def __eq__(self, other):
-        return self.__class__ == other.__class__ and self._hash == other._hash
+        return (
+            self.__class__ == other.__class__
+            and self._seq == other._seq
+            and str.__eq__(self, other)
+        )
 
     def __lt__(self, other):
         if self.__class__ == other.__class__:
-            return self._hash < other._hash
+            return self._sort_key() < other._sort_key()
         return super(DuplicateKey, self).__lt__(other)
 
     def __le__(self, other):
         if self.__class__ == other.__class__:
-            return self._hash <= other._hash
+            return self._sort_key() <= other._sort_key()
         return super(DuplicateKey, self).__le__(other)
 
     def __gt__(self, other):
         if self.__class__ == other.__class__:
-            return self._hash > other._hash
+            return self._sort_key() > other._sort_key()
         return super(DuplicateKey, self).__gt__(other)
 
     def __ge__(self, other):
         if self.__class__ == other.__class__:
-            return self._hash >= other._hash
+            return self._sort_key() >= other._sort_key()
         return super(DuplicateKey, self).__ge__(other)
 
 
-class OrderedDict(compound.DictType):
+class Registry(object):
+    """Registry indexes the registered objects by their address, TF_TYPE and type
+
+    Addresses are the TF_TYPE followed by the type (for typed objects) and name of the object, i.e.
+    ``resource.aws_instance.foo``, ``variable.foo`` or ``provider.aws.west2`` (for an aliased provider).
     """
-    A schematic DictType that preserves key insertion order
+
+    def __init__(self):
+        self._objects = []
+        self._addresses = {}
+        self._tf_types = {}
+        self._types = {}
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __iter__(self):
+        return iter(self._objects)
+
+    def add(self, obj):
+        """Add an object, warning if another object with the same address has already been added"""
+        self._objects.append(obj)
+
+        address = obj._address
+        existing = self._addresses.setdefault(address, obj)
+        if existing is not obj:
+            warnings.warn(
+                "Duplicate address %s, it is already defined by %r"
+                % (address, existing),
+                ConflictWarning,
+                stacklevel=_creator_stacklevel(obj),
+            )
+
+        self._tf_types.setdefault(obj.TF_TYPE, []).append(obj)
+        try:
+            object_type = obj._type
+        except AttributeError:
+            pass
+        else:
+            self._types.setdefault(object_type, []).append(obj)
+
+    def extend(self, objects, tf_type, object_type=None, stacklevel=3):
+        """Add a list of objects that all have the same TF_TYPE and type, warning about any duplicate addresses just
+        like add does
+        """
+        self._objects.extend(objects)
+
+        addresses = self._addresses
+        for obj in objects:
+            address = obj._address
+            existing = addresses.setdefault(address, obj)
+            if existing is not obj:
+                warnings.warn(
+                    "Duplicate address %s, it is already defined by %r"
+                    % (address, existing),
+                    ConflictWarning,
+                    stacklevel=stacklevel,
+                )
+
+        self._tf_types.setdefault(tf_type, []).extend(objects)
+        if object_type is not None:
+            self._types.setdefault(object_type, []).extend(objects)
+
+    def remove(self, cls):
+        """Remove the objects that are instances of cls (or its subclasses) from every index"""
+        self._objects = [obj for obj in self._objects if not isinstance(obj, cls)]
+        self._addresses = {}
+        self._tf_types = {}
+        self._types = {}
+        for obj in self._objects:
+            self._addresses.setdefault(obj._address, obj)
+            self._tf_types.setdefault(obj.TF_TYPE, []).append(obj)
+            try:
+                object_type = obj._type
+            except AttributeError:
+                pass
+            else:
+                self._types.setdefault(object_type, []).append(obj)
+
+    def lookup(self, address):
+        """Return the object with the given address, raises KeyError if there is no such object"""
+        return self._addresses[address]
+
+    def select(self, type=None, tf_type=None, predicate=None):
+        """Return a list of the objects matching all of the given criteria, in the order they were created
+
+        :param type: The type of typed objects, i.e. ``aws_instance``
+        :param tf_type: The TF_TYPE of objects, i.e. ``resource`` or ``variable``
+        :param predicate: A function that receives each object and returns True if it should be selected
+        """
+        if type is not None:
+            objects = self._types.get(type, ())
+            if tf_type is not None:
+                objects = [obj for obj in objects if obj.TF_TYPE == tf_type]
+        elif tf_type is not None:
+            objects = self._tf_types.get(tf_type, ())
+        else:
+            objects = self._objects
+
+        if predicate is not None:
+            return [obj for obj in objects if predicate(obj)]
+        return list(objects)
+
+
+def _creator_stacklevel(obj):
+    """Return the stacklevel that points a warning raised by our caller at the code that created obj
+
+    The frames of this module and of the __init__ methods of obj (i.e. those of subclasses) are skipped, however many
+    of them there are.
+    """
+    frame = sys._getframe(2)
+    stacklevel = 2
+    while frame is not None and (
+        frame.f_globals.get("__name__") == __name__
+        or (frame.f_code.co_name == "__init__" and frame.f_locals.get("self") is obj)
+    ):
+        frame = frame.f_back
+        stacklevel += 1
+    return stacklevel
+
+
+def _registry(context):
+    if context.registry is None:
+        context.registry = Registry()
+    return context.registry
+
+
+class _TFObjectType(type):
+    """The state of the objects is kept in the current CompileContext, these properties make it available as class
+    attributes, i.e. ``Resource._instances`` or ``TFObject._hooks``
     """
 
-    def __init__(self, *args, **kwargs):
-        super(OrderedDict, self).__init__(*args, **kwargs)
-        self.native_type = collections.OrderedDict
+    _frozen = context_property("frozen")
+    _hooks = context_property("hooks")
+    _registry = context_property("registry")
 
-    def convert(self, value, context=None):
-        # okay, this is a little wasteful for the purpose of not having to
-        # copy-paste the implementation that might currently exist
-        # in compound.DictType
-        # so sure, we iterate over the type a couple of times, but this way
-        # we get their validators and updates to their validators
-        temp_data = super(OrderedDict, self).convert(value, context)
+    @property
+    def _instances(cls):
+        return current_context().instances.get(cls)
+
+    @_instances.setter
+    def _instances(cls, value):
+        instances = current_context().instances
+        if value is None:
+            instances.pop(cls, None)
+        else:
+            instances[cls] = value
 
-        # so now, temp_data is a dict filled with the correct (and coerced)
-        # values, we just want it to be ordered now based on how `value`
-        # was passed in
-        # let's trust the validators in `convert()` and not check key existance
-        data = collections.OrderedDict()
-        for k in value.keys():
-            data[k] = temp_data[k]
 
-        return data
+class _ProviderType(_TFObjectType):
+    CURRENT_PROVIDER = context_property("provider")
 
 
+@six.add_metaclass(_TFObjectType)
 class TFObject(object):
-    _instances = None
-    _frozen = False
-    _hooks = None
-
     def __new__(cls, *args, **kwargs):
         # create the instance
         inst = super(TFObject, cls).__new__(cls)
 
-        # register it on the class
+        # register it on the class, in the current context
+        # each class has its own list so that a subclass never appends to its parent's list
+        instances = current_context().instances
         try:
-            cls._instances.append(inst)
-        except AttributeError:
-            cls._instances = [inst]
+            instances[cls].append(inst)
+        except KeyError:
+            instances[cls] = [inst]
 
         # return it
         return inst
 
+    @classmethod
+    def registry(cls):
+        """Return the Registry that named objects are indexed in"""
+        return _registry(current_context())
+
+    @classmethod
+    def lookup(cls, address):
+        """Return the object with the given address, i.e. ``resource.aws_instance.foo``
+
+        Raises KeyError if there is no such object.  See Registry.lookup
+        """
+        return cls.registry().lookup(address)
+
+    @classmethod
+    def select(cls, type=None, tf_type=None, predicate=None):
+        """Return a list of the objects matching all of the given criteria, see Registry.select"""
+        return cls.registry().select(type=type, tf_type=tf_type, predicate=predicate)
+
     @classmethod
     def add_hook(cls, object_type, hook):
         """Add a hook for the given object type
@@ -150,57 +496,131 @@ class TFObject(object):
 
         See NamedObject.add_hook and TypedObject.add_hook
         """
+        TFObject._register_hook((object_type, None), hook)
+
+    @staticmethod
+    def _register_hook(key, hook):
+        """Register a hook under a (TF_TYPE, object type or name) key, where a key of (TF_TYPE, None) receives the full
+        built output of every object of that TF_TYPE
+        """
+        context = current_context()
         try:
-            TFObject._hooks[object_type].append(hook)
-        except TypeError:
-            TFObject._hooks = {object_type: [hook]}
-        except KeyError:
-            TFObject._hooks[object_type] = [hook]
+            context.hooks.append((key, hook))
+        except AttributeError:
+            context.hooks = [(key, hook)]
+
+    @staticmethod
+    def _hook_table():
+        """Build the dispatch table used by compile
+
+        Each (TF_TYPE, object type or name) key maps to the list of ``(full_output, hook)`` tuples that apply to objects
+        with that key, in the order they were registered.  Hooks that receive the full output are included in the list
+        of every key with the same TF_TYPE so that all of the hooks for an object can be applied in a single pass.
+        """
+        registered = current_context().hooks or ()
+
+        profiler = profiling.profiler
+        if profiler is not None:
+            registered = [
+                (key, profiler.wrap("hook", _hook_name(key, hook), hook))
+                for key, hook in registered
+            ]
+
+        table = {}
+        for key, _ in registered:
+            if key not in table:
+                table[key] = [
+                    (hook_key[1] is None, hook)
+                    for hook_key, hook in registered
+                    if hook_key == key or hook_key == (key[0], None)
+                ]
+        return table
+
+    def _apply_hooks(self, output, hooks):
+        """Apply the hooks from the dispatch table to our built output
+
+        Objects without a TF_TYPE only support hooks that receive the full output, keyed by the top level keys of it.
+        """
+        for object_type in output:
+            for _, hook in hooks.get((object_type, None), ()):
+                output = hook(output)
+        return output
 
     @classmethod
     def reset(cls):
+        """Forget all of the objects and hooks in the current CompileContext
+
+        Only the objects of this class and its subclasses are forgotten when it's called on a subclass.  The sequence
+        that numbers DuplicateKeys is only restarted by a full reset.
+        """
+        context = current_context()
+        if cls is TFObject:
+            context.reset()
+            return
+
         def recursive_reset(cls):
-            cls._instances = None
+            context.instances.pop(cls, None)
             for klass in cls.__subclasses__():
                 recursive_reset(klass)
 
         recursive_reset(cls)
-        TFObject._frozen = False
-        TFObject._hooks = None
+        context.frozen = False
+        context.hooks = None
+        if context.registry is not None:
+            context.registry.remove(cls)
+        # the objects of other classes (i.e. Providers) survive, so the DuplicateKey sequence isn't restarted, which
+        # would give new keys the same numbers as theirs
 
     @classmethod
-    def compile(cls):
-        TFObject._frozen = True
+    def compile(cls, select=None):
+        """Build all of the objects, apply the hooks to them and merge them into a single config
+
+        When select is given only the named objects (Providers, Resources, etc) within it are built, in the order they
+        are given, objects that are not in the registry (like Terraform) are always built.  The cost of compiling a
+        selection only depends on the number of objects selected.
+        """
+        context = current_context()
+        context.frozen = True
+
+        merger = ConfigMerger()
+        hooks = TFObject._hook_table()
+        instances = context.instances
+
+        if select is None:
+
+            def instances_of(cls):
+                return instances.get(cls, ())
+
+        else:
+            selected = {}
+            for obj in select:
+                selected.setdefault(type(obj), []).append(obj)
+
+            def instances_of(cls):
+                if issubclass(cls, NamedObject):
+                    return selected.get(cls, ())
+                return instances.get(cls, ())
 
         def recursive_compile(cls):
-            results = []
-            try:
-                for instance in cls._instances:
-                    output = instance.build()
-
-                    for object_type in output:
-                        try:
-                            hooks = TFObject._hooks[object_type]
-                        except (TypeError, KeyError):
-                            pass
-                        else:
-                            for hook in hooks:
-                                output = hook(output)
-
-                    results.append(output)
-            except TypeError:
-                pass
+            for instance in instances_of(cls):
+                output = instance.build()
+                if hooks:
+                    output = instance._apply_hooks(output, hooks)
+                merger.merge(output, origin=instance)
 
             for klass in cls.__subclasses__():
-                results += recursive_compile(klass)
-            return results
+                recursive_compile(klass)
 
-        configs = recursive_compile(cls)
+        recursive_compile(cls)
 
-        result = {}
-        for config in configs:
-            result = recursive_update(result, config)
-        return result
+        for path, previous, instance in merger.conflicts:
+            warnings.warn(
+                "%s is defined by both %r and %r, the value from the latter is used"
+                % (".".join(path), previous, instance),
+                ConflictWarning,
+            )
+
+        return merger.result
 
     def build(self):
         raise NotImplementedError
@@ -251,18 +671,7 @@ class NamedObject(TFObject):
 
         """
 
-        def named_hook(output):
-            for output_name in output[cls.TF_TYPE]:
-                if output_name != object_name:
-                    continue
-
-                output[cls.TF_TYPE][output_name] = hook(
-                    output[cls.TF_TYPE][output_name]
-                )
-
-            return output
-
-        TFObject.add_hook(cls.TF_TYPE, named_hook)
+        TFObject._register_hook((cls.TF_TYPE, object_name), hook)
 
     def __init__(self, _name, _values=None, **kwargs):
         """When creating a TF Object you can supply _values if you want to directly influence the values of the object,
@@ -275,15 +684,22 @@ class NamedObject(TFObject):
         self._name = _name
         self._values = _values or {}
 
-        if Variant.CURRENT_VARIANT is None:
+        context = current_context()
+        if context.variant is None:
             self._values.update(kwargs)
         else:
             for name in kwargs:
                 if not name.endswith("_variant"):
                     self._values[name] = kwargs[name]
-                elif name == "{0}_variant".format(Variant.CURRENT_VARIANT.name):
+                elif name == "{0}_variant".format(context.variant.name):
                     self._values.update(kwargs[name])
 
+        _registry(context).add(self)
+
+    @property
+    def _address(self):
+        return "{0}.{1}".format(self.TF_TYPE, self._name)
+
     def __setattr__(self, name, value):
         if "_values" in self.__dict__ and name in self.__dict__["_values"]:
             self.__dict__["_values"][name] = value
@@ -292,7 +708,7 @@ class NamedObject(TFObject):
 
     def __getattr__(self, name):
         """This is here as a safety so that you cannot generate hard to debug .tf.json files"""
-        if not TFObject._frozen and name in self._values:
+        if not current_context().frozen and name in self._values:
             return self._values[name]
         raise AttributeError(
             "%ss does not provide attribute interpolation through attribute access!"
@@ -303,14 +719,40 @@ class NamedObject(TFObject):
         return (
             isinstance(other, self.__class__)
             and self._name == other._name
-            and self._values == other._values
+            and _plain_values(self._values) == _plain_values(other._values)
         )
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def _apply_hooks(self, output, hooks):
+        try:
+            hooks = hooks[(self.TF_TYPE, self._name)]
+        except KeyError:
+            hooks = hooks.get((self.TF_TYPE, None))
+            if hooks is None:
+                return output
+
+        if isinstance(self._values, SharedValues):
+            # hooks are free to change the values they're given in place, so they get a copy of everything we share
+            output = copy.deepcopy(output)
+
+        for full_output, hook in hooks:
+            if full_output:
+                output = hook(output)
+                continue
+
+            objects = output[self.TF_TYPE]
+            for output_name in objects:
+                if output_name != self._name:
+                    continue
+
+                objects[output_name] = hook(objects[output_name])
+
+        return output
+
     def build(self):
-        result = {self.TF_TYPE: {self._name: self._values}}
+        result = {self.TF_TYPE: {self._name: _plain_values(self._values)}}
         return result
 
     def __repr__(self):
@@ -333,13 +775,38 @@ class TypedObjectAttr(str):
     ${resource_type.resource_name.attribute.key_name}
     """
 
+    # Instances are immutable, so rather than allocating and formatting a new string every time the same attribute is
+    # referenced they are interned in a cache that is cleared whenever it holds CACHE_SIZE references
+    CACHE_SIZE = 65536
+    _cache = {}
+
+    # str subclasses cannot have non-empty slots, the terraform name and path are taken from the string itself instead
+    __slots__ = ()
+
     def __new__(cls, terraform_name, name, item=None):
-        obj = super(TypedObjectAttr, cls).__new__(
-            cls, "${{{0}.{1}}}".format(terraform_name, cls._name_with_index(name, item))
+        key = (cls, terraform_name, name, item)
+        try:
+            return TypedObjectAttr._cache[key]
+        except (KeyError, TypeError):
+            pass
+        return cls._intern(
+            key, "{0}.{1}".format(terraform_name, cls._name_with_index(name, item))
         )
-        obj._terraform_name = terraform_name
-        obj._name = name
-        obj._item = item
+
+    @classmethod
+    def _intern(cls, key, path):
+        obj = super(TypedObjectAttr, cls).__new__(cls, "${" + path + "}")
+
+        cache = TypedObjectAttr._cache
+        if TypedObjectAttr.CACHE_SIZE > 0:
+            if len(cache) >= TypedObjectAttr.CACHE_SIZE:
+                cache.clear()
+            try:
+                cache[key] = obj
+            except TypeError:
+                # the item isn't hashable, i.e. a slice
+                pass
+
         return obj
 
     @staticmethod
@@ -349,15 +816,33 @@ class TypedObjectAttr(str):
         else:
             return "{0}.{1}".format(name, item)
 
+    def _child(self, item):
+        cls = type(self)
+        key = (cls, self, item)
+        try:
+            return TypedObjectAttr._cache[key]
+        except (KeyError, TypeError):
+            pass
+        # our path is everything between the ${ and }
+        path = str.__getitem__(self, slice(2, -1))
+        return cls._intern(key, "{0}.{1}".format(path, item))
+
     def __getitem__(self, item):
-        return TypedObjectAttr(
-            self._terraform_name, self._name_with_index(self._name, self._item), item
-        )
+        return self._child(item)
 
     def __getattr__(self, item):
-        return TypedObjectAttr(
-            self._terraform_name, self._name_with_index(self._name, self._item), item
-        )
+        if item.startswith("__") and item.endswith("__"):
+            # don't pretend to implement protocols like __deepcopy__ or __getstate__
+            raise AttributeError(item)
+        return self._child(item)
+
+    def __reduce__(self):
+        return _restore_attr, (type(self), str(self))
+
+
+def _restore_attr(cls, value):
+    # python 2 can't pickle str.__new__ itself, so unpickling goes through this function
+    return str.__new__(cls, value)
 
 
 class TypedObject(NamedObject):
@@ -393,37 +878,134 @@ class TypedObject(NamedObject):
 
         """
 
-        def typed_hook(output):
-            for output_type in output[cls.TF_TYPE]:
-                if output_type != object_type:
-                    continue
+        TFObject._register_hook((cls.TF_TYPE, object_type), hook)
 
-                for object_id in output[cls.TF_TYPE][object_type]:
-                    output[cls.TF_TYPE][object_type][object_id] = hook(
-                        object_id, output[cls.TF_TYPE][object_type][object_id]
-                    )
+    def __init__(self, _type, _name, **kwargs):
+        # our type needs to be set before NamedObject adds us to the registry
+        self._type = _type
+        super(TypedObject, self).__init__(_name, **kwargs)
 
-            return output
+        provider = current_context().provider
+        if (
+            provider is not None
+            and "provider" not in kwargs
+            and provider._name == self._type.split("_")[0]
+        ):
+            self._values["provider"] = provider.as_provider()
 
-        TFObject.add_hook(cls.TF_TYPE, typed_hook)
+    @classmethod
+    def bulk(cls, _type, rows, name_field="name"):
+        """Create an object of the given type for each of the rows, returning the list of objects
 
-    def __init__(self, _type, _name, **kwargs):
-        super(TypedObject, self).__init__(_name, **kwargs)
-        self._type = _type
+        rows is either an iterable of dicts, each of which holds the keyword arguments of one object, or a dict of
+        columns that each hold a sequence of values (one per object).  The name of each object is taken from the
+        ``name_field`` key of its row, which is not included in its values, or name_field can be a function that
+        receives the row and returns the name.
+
+        The result is the same as creating each object in a loop, but the current Provider and Variant are only
+        looked at once and the objects are registered together, which is much faster for tens of thousands of them:
+
+        .. code-block:: python
 
+            records = Resource.bulk(
+                'aws_route53_record',
+                csv.DictReader(fd),
+                name_field='id',
+            )
+        """
+        assert cls.TF_TYPE is not None, (
+            "Bad programmer.  Set TF_TYPE on %s" % cls.__name__
+        )
+
+        if isinstance(rows, Mapping):
+            columns = list(rows)
+            rows = (dict(zip(columns, values)) for values in zip(*rows.values()))
+
+        if cls.__init__ != TypedObject.__init__:
+            # we can't know what a subclass does in its own __init__, so create them one at a time
+            return [cls._bulk_one(_type, row, name_field) for row in rows]
+
+        # the variant specific values to use, and the provider to add, are the same for every object
+        variant_key = _current_variant_key()
+
+        context = current_context()
+        provider = context.provider
+        if provider is not None and provider._name == _type.split("_")[0]:
+            provider = provider.as_provider()
+        else:
+            provider = None
+
+        new = super(TFObject, cls).__new__
+        objects = []
+        for row in rows:
+            # kwargs is a copy of the row, just like the kwargs of a call would be
+            kwargs = dict(row)
+            if callable(name_field):
+                name = name_field(row)
+            else:
+                name = kwargs.pop(name_field)
+
+            values = _variant_values(kwargs, variant_key)
+            if provider is not None and "provider" not in kwargs:
+                values["provider"] = provider
+
+            obj = new(cls)
+            obj.__dict__.update(_type=_type, _name=name, _values=values)
+            objects.append(obj)
+
+        # register them all at once, see TFObject.__new__ and NamedObject.__init__
+        instances = context.instances
         try:
-            if (
-                "provider" not in kwargs
-                and Provider.CURRENT_PROVIDER._name == self._type.split("_")[0]
-            ):
-                self._values["provider"] = Provider.CURRENT_PROVIDER.as_provider()
-        except AttributeError:
-            # CURRENT_PROVIDER is None
-            pass
+            instances[cls].extend(objects)
+        except KeyError:
+            instances[cls] = list(objects)
+        _registry(context).extend(objects, cls.TF_TYPE, _type)
+
+        return objects
+
+    @classmethod
+    def _bulk_one(cls, _type, row, name_field):
+        if callable(name_field):
+            return cls(_type, name_field(row), **row)
+        kwargs = dict(row)
+        name = kwargs.pop(name_field)
+        return cls(_type, name, **kwargs)
+
+    @classmethod
+    def fan_out(cls, _type, _name, providers, name_format="{name}_{alias}", **kwargs):
+        """Create a replica of the object within each of the providers, returning the list of replicas
+
+        Each replica is named by formatting name_format with the name and the alias of its provider.  The replicas
+        share a single copy of the values (see SharedValues), so replicating an object with large values across many
+        regions and accounts only uses memory for the values that differ, like the provider.  Any value a replica or a
+        hook changes is only changed for that replica.
+
+        .. code-block:: python
+
+            providers = [Provider('aws', alias=region, region=region) for region in regions]
+            buckets = Resource.fan_out('aws_s3_bucket', 'logs', providers, policy=policy, tags=tags)
+        """
+        shared = _variant_values(kwargs, _current_variant_key())
+
+        replicas = []
+        for provider in providers:
+            name = name_format.format(name=_name, alias=provider._values["alias"])
+            if "provider" in shared:
+                replicas.append(cls(_type, name, _values=SharedValues(shared)))
+                continue
+
+            # the provider is added to the replica's own values by __init__
+            with provider:
+                replicas.append(cls(_type, name, _values=SharedValues(shared)))
+        return replicas
 
     def __eq__(self, other):
         return super(TypedObject, self).__eq__(other) and self._type == other._type
 
+    @property
+    def _address(self):
+        return "{0}.{1}.{2}".format(self.TF_TYPE, self._type, self._name)
+
     @property
     def terraform_name(self):
         return ".".join([self._type, self._name])
@@ -448,19 +1030,43 @@ class TypedObject(NamedObject):
                 ...
             )
         """
+        context = current_context()
+        frozen, context.frozen = context.frozen, True
         try:
-            TFObject._frozen = True
             return getattr(self, name)
         finally:
-            TFObject._frozen = False
+            context.frozen = frozen
 
     def __getattr__(self, name):
-        if not TFObject._frozen and name in self._values:
+        if not current_context().frozen and name in self._values:
             return self._values[name]
         return TypedObjectAttr(self.terraform_name, name)
 
+    def _apply_hooks(self, output, hooks):
+        try:
+            hooks = hooks[(self.TF_TYPE, self._type)]
+        except KeyError:
+            hooks = hooks.get((self.TF_TYPE, None))
+            if hooks is None:
+                return output
+
+        if isinstance(self._values, SharedValues):
+            # hooks are free to change the values they're given in place, so they get a copy of everything we share
+            output = copy.deepcopy(output)
+
+        for full_output, hook in hooks:
+            if full_output:
+                output = hook(output)
+                continue
+
+            objects = output[self.TF_TYPE].get(self._type, ())
+            for object_id in objects:
+                objects[object_id] = hook(object_id, objects[object_id])
+
+        return output
+
     def build(self):
-        result = {self.TF_TYPE: {self._type: {self._name: self._values}}}
+        result = {self.TF_TYPE: {self._type: {self._name: _plain_values(self._values)}}}
         return result
 
     def __repr__(self):
@@ -470,6 +1076,7 @@ class TypedObject(NamedObject):
         return self.__repr__()
 
 
+@six.add_metaclass(_ProviderType)
 class Provider(NamedObject):
     """Represents a Terraform provider configuration.
 
@@ -485,7 +1092,6 @@ class Provider(NamedObject):
     """
 
     TF_TYPE = "provider"
-    CURRENT_PROVIDER = None
 
     def __init__(self, *args, **kwargs):
         super(Provider, self).__init__(*args, **kwargs)
@@ -495,18 +1101,27 @@ class Provider(NamedObject):
         assert self._values[
             "alias"
         ], "Providers must have an alias to be used as a context manager!"
-        self._previous_provider = Provider.CURRENT_PROVIDER
-        Provider.CURRENT_PROVIDER = self
+        context = current_context()
+        self._previous_provider = context.provider
+        context.provider = self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        Provider.CURRENT_PROVIDER = self._previous_provider
+        current_context().provider = self._previous_provider
+
+    @property
+    def _address(self):
+        address = super(Provider, self)._address
+        alias = self._values.get("alias")
+        if alias:
+            address = "{0}.{1}".format(address, alias)
+        return address
 
     def as_provider(self):
         return ".".join([self._name, self._values["alias"]])
 
     # override build to support duplicate key values
     def build(self):
-        result = {self.TF_TYPE: {self._key: self._values}}
+        result = {self.TF_TYPE: {self._key: _plain_values(self._values)}}
         return result
 
 
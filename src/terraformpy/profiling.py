@@ -0,0 +1,153 @@
+"""
+Copyright 2019 NerdWallet
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Wall and CPU time profiling of the work terraformpy does
+
+The module level profiler is None unless profiling has been enabled, so the code being profiled only pays for a global
+lookup and a None check when it is off:
+
+.. code-block:: python
+
+    profiler = profiling.profiler
+    if profiler is not None:
+        with profiler.timer("file", filename):
+            ...
+
+Timings are grouped by a category (file, collection, hook or phase) and a name.  The time of nested entries is included
+in the entries that contain them, i.e. a ResourceCollection that creates other collections includes their time.
+"""
+
+import io
+import json
+import os
+import time
+from timeit import default_timer
+
+import six
+
+try:
+    process_time = time.process_time
+except AttributeError:
+    # python 2
+    process_time = time.clock
+
+profiler = None
+
+
+def enable():
+    """Start profiling into a new Profiler, which is returned"""
+    global profiler
+    profiler = Profiler()
+    return profiler
+
+
+def disable():
+    """Stop profiling, returning the Profiler that was in use (if any)"""
+    global profiler
+    current, profiler = profiler, None
+    return current
+
+
+class _Timer(object):
+    __slots__ = ("entry", "wall", "cpu")
+
+    def __init__(self, entry):
+        self.entry = entry
+
+    def __enter__(self):
+        self.wall = default_timer()
+        self.cpu = process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.entry[0] += 1
+        self.entry[1] += default_timer() - self.wall
+        self.entry[2] += process_time() - self.cpu
+
+
+class Profiler(object):
+    """Profiler accumulates the number of calls, wall time and CPU time (in seconds) of each (category, name)"""
+
+    def __init__(self):
+        self.entries = {}
+
+    def _entry(self, category, name):
+        key = (category, name)
+        try:
+            return self.entries[key]
+        except KeyError:
+            entry = self.entries[key] = [0, 0.0, 0.0]
+            return entry
+
+    def timer(self, category, name):
+        """Return a context manager that adds the time spent within it to (category, name)"""
+        return _Timer(self._entry(category, name))
+
+    def wrap(self, category, name, func):
+        """Return a function that calls func, timing every call under (category, name)"""
+
+        def wrapper(*args, **kwargs):
+            with self.timer(category, name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    def update(self, entries):
+        """Add the entries of another profiler to ours, i.e. those recorded in a worker process"""
+        for (category, name), (calls, wall, cpu) in six.iteritems(entries):
+            entry = self._entry(category, name)
+            entry[0] += calls
+            entry[1] += wall
+            entry[2] += cpu
+
+    def report(self):
+        """Return a list of dicts for each entry, sorted by wall time with the slowest first"""
+        rows = [
+            dict(category=category, name=name, calls=calls, wall=wall, cpu=cpu)
+            for (category, name), (calls, wall, cpu) in six.iteritems(self.entries)
+        ]
+        rows.sort(key=lambda row: (-row["wall"], row["category"], row["name"]))
+        return rows
+
+    def format_table(self):
+        """Format the report as a table of text lines"""
+        rows = self.report()
+        name_width = max([len(row["name"]) for row in rows] + [4])
+        line = "{0:<10}  {1:<{width}}  {2:>6}  {3:>10}  {4:>10}"
+        lines = [
+            line.format(
+                "category", "name", "calls", "wall ms", "cpu ms", width=name_width
+            )
+        ]
+        for row in rows:
+            lines.append(
+                line.format(
+                    row["category"],
+                    row["name"],
+                    row["calls"],
+                    "%.1f" % (row["wall"] * 1000),
+                    "%.1f" % (row["cpu"] * 1000),
+                    width=name_width,
+                )
+            )
+        return lines
+
+    def write_json(self, path):
+        """Write the report to path as JSON"""
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with io.open(path, "w", encoding="utf-8") as fd:
+            fd.write(six.text_type(json.dumps(self.report(), indent=2)))
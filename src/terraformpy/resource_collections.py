@@ -14,11 +14,21 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import collections
+import hashlib
+import json
+import os
+import sys
+
 import six
-from schematics.exceptions import MockCreationError
+from schematics.exceptions import DataError, MockCreationError
 from schematics.models import Model
+from schematics.types import compound
 
+from terraformpy import profiling
+from terraformpy.context import context_property, current_context
 from terraformpy.helpers import relative_file as _relative_file
+from terraformpy.variant import Variant  # noqa
 
 
 class ResourceCollection(Model):
@@ -79,10 +89,31 @@ class ResourceCollection(Model):
             (k, v) for k, v in six.iteritems(kwargs) if not k.endswith("_variant")
         )
 
-        super(ResourceCollection, self).__init__(kwargs)
+        batch = current_context().batch
+        try:
+            super(ResourceCollection, self).__init__(kwargs)
+        except DataError as exc:
+            # within a batch conversion errors are reported along with everything else
+            if batch is None:
+                raise
+            batch.add(self, kwargs, sys._getframe(1), error=exc)
+            return
 
-        self.validate()
-        self.create_resources()
+        profiler = profiling.profiler
+        if profiler is None:
+            if self._validate(kwargs, batch):
+                self.create_resources()
+        else:
+            with profiler.timer("collection", type(self).__name__):
+                if self._validate(kwargs, batch):
+                    self.create_resources()
+
+    def _validate(self, raw_data, batch):
+        """Validate ourselves, or add ourselves to the batch, returning True if we're valid"""
+        if batch is None:
+            self.validate()
+            return True
+        return batch.add(self, raw_data, sys._getframe(2))
 
     def relative_file(self, filename):
         return _relative_file(filename, _caller_depth=2)
@@ -97,26 +128,141 @@ class ResourceCollection(Model):
         pass
 
 
-class Variant(object):
-    """When used as a context manager it provides the ability for ResourceCollection's to vary their inputs based on a
-    symbolc string name that allows you to define a resource collection for multiple environments where most of the
-    inputs are shared, with only a few differences.
+class BatchValidationError(ValueError):
+    """Raised by BatchValidation with the errors of every collection that failed validation
 
-    Any kwargs passed to the constructor become defaults for non-variant inputs.  This allows you to supply inputs that
-    are shared between many different ResourceCollections at the variant level so you don't need to pass them over and
-    over again.
+    errors is a dict keyed by a description of each collection (its class and where it was created), with the primitive
+    form of the schematics errors of each as the values.  Unlike the schematics errors it can be pickled, so that it can
+    be raised from a worker process.
     """
 
-    CURRENT_VARIANT = None
+    def __init__(self, errors):
+        super(BatchValidationError, self).__init__(errors)
+
+    @property
+    def errors(self):
+        return self.args[0]
+
+    def __str__(self):
+        return "\n".join(
+            "{0}: {1}".format(name, json.dumps(errors))
+            for name, errors in six.iteritems(self.errors)
+        )
+
+
+def _inputs_hash(raw_data):
+    """Hash the inputs of a collection, returning None if they can't be normalized"""
+    try:
+        normalized = json.dumps(raw_data, sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
 
-    def __init__(self, name, **kwargs):
-        self.name = name
-        self.defaults = kwargs
-        self.previous_variant = None
+
+class _BatchValidationType(type):
+    # the current batch is kept in the current CompileContext
+    CURRENT_BATCH = context_property("batch")
+
+
+@six.add_metaclass(_BatchValidationType)
+class BatchValidation(object):
+    """When used as a context manager the errors of all of the ResourceCollections created within it are collected,
+    rather than the first one being raised right away, and are raised together as a BatchValidationError when the
+    context exits.
+
+    Within a batch the outcome of validating a collection is memoized by its class and a hash of its inputs, so
+    collections with identical inputs are only validated once.  Collections whose inputs can't be serialized to JSON
+    (i.e. because they reference other objects) are always validated.
+
+    A collection that fails to validate (or whose inputs can't be converted) doesn't create its resources.
+
+    .. code-block:: python
+
+        with BatchValidation():
+            for name in names:
+                MyCollection(name=name)
+    """
+
+    def __init__(self):
+        self.errors = collections.OrderedDict()
+        self.results = {}
+        self.count = 0
+        self.previous_batch = None
 
     def __enter__(self):
-        self.previous_variant = Variant.CURRENT_VARIANT
-        Variant.CURRENT_VARIANT = self
+        context = current_context()
+        self.previous_batch = context.batch
+        context.batch = self
+        return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        Variant.CURRENT_VARIANT = self.previous_variant
+        current_context().batch = self.previous_batch
+        if exc_type is None:
+            self.validate()
+
+    def add(self, collection, raw_data, frame=None, error=None):
+        """Validate a collection, created from raw_data (in frame), unless error is the DataError that creating it
+        raised, returning True if it is valid
+        """
+        index = self.count
+        self.count += 1
+
+        if error is None:
+            inputs_hash = _inputs_hash(raw_data)
+            key = (type(collection), inputs_hash)
+            if inputs_hash is not None and key in self.results:
+                error = self.results[key]
+            else:
+                try:
+                    collection.validate()
+                except DataError as exc:
+                    error = exc
+                if inputs_hash is not None:
+                    self.results[key] = error
+
+        if error is None:
+            return True
+
+        if frame is not None:
+            where = "{0}:{1}".format(
+                os.path.relpath(frame.f_code.co_filename), frame.f_lineno
+            )
+        else:
+            where = "#{0}".format(index)
+        name = "{0} #{1} ({2})".format(type(collection).__name__, index, where)
+        self.errors[name] = error.to_primitive()
+        return False
+
+    def validate(self):
+        """Raise a BatchValidationError if any of the collections failed to validate"""
+        errors, self.errors = self.errors, collections.OrderedDict()
+        if errors:
+            raise BatchValidationError(errors)
+
+
+class OrderedDict(compound.DictType):
+    """
+    A schematic DictType that preserves key insertion order
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(OrderedDict, self).__init__(*args, **kwargs)
+        self.native_type = collections.OrderedDict
+
+    def convert(self, value, context=None):
+        # okay, this is a little wasteful for the purpose of not having to
+        # copy-paste the implementation that might currently exist
+        # in compound.DictType
+        # so sure, we iterate over the type a couple of times, but this way
+        # we get their validators and updates to their validators
+        temp_data = super(OrderedDict, self).convert(value, context)
+
+        # so now, temp_data is a dict filled with the correct (and coerced)
+        # values, we just want it to be ordered now based on how `value`
+        # was passed in
+        # let's trust the validators in `convert()` and not check key existance
+        data = collections.OrderedDict()
+        for k in value.keys():
+            data[k] = temp_data[k]
+
+        return data
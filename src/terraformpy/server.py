@@ -0,0 +1,466 @@
+"""
+Copyright 2019 NerdWallet
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+A compile server, so that each run of the CLI doesn't pay for starting Python and importing everything
+
+``terraformpy serve`` listens on a Unix socket (or a localhost port) and compiles the requests it receives in a pool of
+worker processes.  The workers are forked once everything that can be shared (terraformpy itself, schematics, and the
+modules given with --preload) has been imported, and are kept between requests.  Every other module a request imports
+is forgotten once it's done, so that each request imports (and runs) them like a new process would.
+``terraformpy --server ADDRESS`` sends its compile to the server instead of doing it in process, then writes the result
+and runs Terraform like it always does.
+
+Requests and responses are a single line of JSON each.  A request holds the directory, the files to compile, the CLI's
+arguments and the part of its environment that the compile depends on (see request_environment).  The response holds the
+compiled shards (see dump_fragment), or the error messages to report, along with everything the compile wrote to stdout
+and stderr.
+"""
+
+from __future__ import print_function
+
+import argparse
+import contextlib
+import errno
+import importlib
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+import traceback
+import warnings
+
+import six
+from six.moves import socketserver
+
+from .cache import ENV_PREFIXES
+from .context import CompileContext
+from .loader import _fork_context, dump_fragment, load_fragment
+from .objects import ConflictWarning, TFObject
+
+PROTOCOL_VERSION = 1
+
+DEFAULT_ADDRESS = os.path.join(tempfile.gettempdir(), "terraformpy.sock")
+
+# how long, in seconds, a request waits for its compile by default
+DEFAULT_TIMEOUT = 600
+
+# the modules every worker imports before it is handed any requests, the CLI imports the rest of terraformpy
+PRELOAD = ("terraformpy.cli", "terraformpy.resource_collections")
+
+# the hooks added by the preloaded modules, every request starts out with them
+_preloaded_hooks = ()
+
+
+class ServerError(Exception):
+    """Raised by request_compile when the server failed to compile the config
+
+    messages is the list of lines that report the error, like the CLI would have printed them.
+    """
+
+    def __init__(self, messages):
+        super(ServerError, self).__init__(messages)
+
+    @property
+    def messages(self):
+        return self.args[0]
+
+    def __str__(self):
+        return "\n".join(self.messages)
+
+
+class ServerUnavailable(Exception):
+    """Raised by request_compile when the server can't be reached"""
+
+
+def parse_address(address):
+    """Return the socket family and address of a server address, which is either [HOST:]PORT or a Unix socket path"""
+    host, _, port = address.rpartition(":")
+    if port.isdigit() and os.sep not in address:
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    return socket.AF_UNIX, address
+
+
+def is_loopback(host):
+    """Return True if host is an address (or name) of this machine that can't be reached from other machines"""
+    try:
+        return socket.gethostbyname(host).startswith("127.")
+    except socket.error:
+        return False
+
+
+def request_environment(env_names=()):
+    """Return the environment variables a request is compiled with
+
+    Rather than the whole environment, which is likely to hold credentials, only PYTHONPATH, the variables prefixed with
+    TERRAFORMPY_ or TF_ and those named in env_names (see --cache-env) are sent to the server.
+    """
+    return dict(
+        (name, value)
+        for name, value in os.environ.items()
+        if name == "PYTHONPATH" or name.startswith(ENV_PREFIXES) or name in env_names
+    )
+
+
+def request_compile(address, argv, files, env_names=()):
+    """Ask the server at address to compile the files in the current directory, returning the shards to write
+
+    argv are the arguments of the CLI, the server compiles the files the same way the CLI would have.  The files see the
+    environment returned by request_environment(env_names).  Anything the compile printed is printed here.  Raises
+    ServerUnavailable if the server can't be reached, or ServerError if the config couldn't be compiled.
+    """
+    family, sockaddr = parse_address(address)
+    request = {
+        "version": PROTOCOL_VERSION,
+        "directory": os.getcwd(),
+        "files": files,
+        "argv": argv,
+        "env": request_environment(env_names),
+    }
+
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    with contextlib.closing(sock):
+        try:
+            sock.connect(sockaddr)
+            with contextlib.closing(sock.makefile("rwb")) as fd:
+                fd.write(json.dumps(request).encode("utf-8") + b"\n")
+                fd.flush()
+                line = fd.readline()
+        except (IOError, OSError) as exc:
+            raise ServerUnavailable("Can't reach the server at %s: %s" % (address, exc))
+    if not line:
+        raise ServerUnavailable("The server at %s closed the connection" % address)
+
+    response = json.loads(line.decode("utf-8"))
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+    if "error" in response:
+        raise ServerError(response["error"])
+    return dict(
+        (name, load_fragment(text)) for name, text in six.iteritems(response["shards"])
+    )
+
+
+def _add_python_path(pythonpath):
+    """Add the entries of the client's PYTHONPATH, which is where it would have imported modules from, to sys.path"""
+    entries = [
+        os.path.abspath(entry)
+        for entry in (pythonpath or "").split(os.pathsep)
+        if entry
+    ]
+    added = [entry for entry in entries if entry not in sys.path]
+    sys.path[:0] = added
+
+    invalidate_caches = getattr(importlib, "invalidate_caches", None)
+    if invalidate_caches is not None:
+        # modules may have been added since the last request
+        invalidate_caches()
+
+
+def compile_request(request):
+    """Compile the files of a request in this process, returning the response
+
+    The files are loaded within the directory and environment (including the PYTHONPATH) of the request, into a
+    CompileContext of their own that starts out with the hooks added by the preloaded modules.  Once the request is
+    done every module it imported is forgotten.  The next request may be for another directory (or checkout) with
+    modules of the same names, and modules that declare objects or add hooks when they're imported have to be imported
+    into the context of each request.  Installed packages that are used by every request can be preloaded instead.
+    """
+    directory = request["directory"]
+    stdout = six.StringIO()
+    stderr = six.StringIO()
+
+    cwd = os.getcwd()
+    environ = dict(os.environ)
+    path = list(sys.path)
+    modules = set(sys.modules)
+    streams = sys.stdout, sys.stderr
+    try:
+        os.chdir(directory)
+        os.environ.clear()
+        os.environ.update(request["env"])
+        _add_python_path(request["env"].get("PYTHONPATH"))
+        sys.stdout, sys.stderr = stdout, stderr
+
+        with CompileContext() as context, warnings.catch_warnings():
+            # changing the filters (even to what they already are) forgets which warnings have been shown, so that
+            # every request reports its warnings like a new process would
+            warnings.simplefilter("default", ConflictWarning)
+            context.hooks = list(_preloaded_hooks) or None
+            response = _compile(request)
+    finally:
+        sys.stdout, sys.stderr = streams
+        sys.path[:] = path
+        os.environ.clear()
+        os.environ.update(environ)
+        os.chdir(cwd)
+        for name in set(sys.modules) - modules:
+            del sys.modules[name]
+
+    response["stdout"] = stdout.getvalue()
+    response["stderr"] = stderr.getvalue()
+    return response
+
+
+def _compile(request):
+    # the CLI imports this module, so we import it once we need it
+    from . import cli
+
+    try:
+        args = cli.parse_args(request["argv"])
+    except SystemExit:
+        # argparse has already printed what's wrong
+        return {"error": []}
+
+    try:
+        # requests are compiled in parallel by the workers, which can't start worker processes of their own
+        shards = cli.compile_config(args, request["files"], in_process=True)
+    except BaseException as exc:
+        # including SystemExit (i.e. sys.exit() in a .tf.py), which would otherwise take the worker down with it
+        messages = cli.error_messages(args, exc)
+        if messages is None:
+            messages = traceback.format_exc().splitlines()
+        return {"error": messages}
+
+    return {
+        "shards": dict(
+            (name, dump_fragment(config)) for name, config in six.iteritems(shards)
+        )
+    }
+
+
+def _init_worker(preload):
+    global _preloaded_hooks
+
+    # when the worker was forked these are already imported
+    for name in preload:
+        importlib.import_module(name)
+    _preloaded_hooks = tuple(TFObject._hooks or ())
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+
+        start = time.time()
+        try:
+            request = json.loads(line.decode("utf-8"))
+        except ValueError:
+            request = None
+        if not isinstance(request, dict) or request.get("version") != PROTOCOL_VERSION:
+            response = {
+                "error": [
+                    "terraformpy - Error: the request isn't one this server understands"
+                ],
+                "stdout": "",
+                "stderr": "",
+            }
+        else:
+            response = self.server.compile_server.compile(request)
+            print(
+                "terraformpy - %s %s in %.2fs"
+                % (
+                    "Failed to compile" if "error" in response else "Compiled",
+                    request["directory"],
+                    time.time() - start,
+                )
+            )
+
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socket, "AF_UNIX"):
+
+    class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+class CompileServer(object):
+    """CompileServer accepts requests on address and compiles them in a pool of workers processes
+
+    Each connection is handled by a thread of its own, which hands the request to the next free worker, so up to
+    workers requests (the number of CPUs by default) are compiled at once.  The modules named in preload are imported
+    before the workers are started.  Hooks they add when imported apply to every request.  A request that isn't
+    compiled within timeout seconds (i.e. because its worker died) gets an error.
+
+    Since anyone that can connect to the server can have it run code, a HOST:PORT address must be a loopback address
+    unless allow_remote is True, otherwise ValueError is raised.
+    """
+
+    def __init__(
+        self,
+        address,
+        workers=None,
+        preload=(),
+        timeout=DEFAULT_TIMEOUT,
+        allow_remote=False,
+    ):
+        family, sockaddr = parse_address(address)
+        if (
+            family == socket.AF_INET
+            and not allow_remote
+            and not is_loopback(sockaddr[0])
+        ):
+            raise ValueError(
+                "%s isn't a loopback address, listening on it lets other machines run code on this one"
+                % sockaddr[0]
+            )
+
+        self.address = address
+        self.workers = workers or multiprocessing.cpu_count()
+        self.timeout = timeout
+
+        preload = list(PRELOAD) + list(preload)
+        _init_worker(preload)
+        self.pool = _fork_context().Pool(
+            processes=self.workers, initializer=_init_worker, initargs=(preload,)
+        )
+
+        try:
+            self.server = self._bind()
+        except BaseException:
+            self.pool.terminate()
+            self.pool.join()
+            raise
+        self.server.compile_server = self
+
+    def _bind(self):
+        family, sockaddr = parse_address(self.address)
+        if family == socket.AF_INET:
+            return _TCPServer(sockaddr, _RequestHandler)
+
+        if os.path.exists(sockaddr):
+            # a socket left behind by a server that is no longer running is removed, but not one that is in use
+            probe = socket.socket(family, socket.SOCK_STREAM)
+            try:
+                probe.connect(sockaddr)
+            except (IOError, OSError):
+                os.unlink(sockaddr)
+            else:
+                raise socket.error(
+                    errno.EADDRINUSE, "A server is already running at %s" % sockaddr
+                )
+            finally:
+                probe.close()
+        return _UnixServer(sockaddr, _RequestHandler)
+
+    def compile(self, request):
+        """Compile a request in the next free worker, returning the response"""
+        result = self.pool.apply_async(compile_request, (request,))
+        try:
+            return result.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            messages = [
+                "terraformpy - Error: the compile didn't finish within %g seconds"
+                % self.timeout
+            ]
+        except Exception:
+            # i.e. the request's directory doesn't exist
+            messages = traceback.format_exc().splitlines()
+        return {"error": messages, "stdout": "", "stderr": ""}
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def shutdown(self):
+        """Stop serve_forever, which must be running in another thread"""
+        self.server.shutdown()
+
+    def close(self):
+        self.server.server_close()
+        self.pool.terminate()
+        self.pool.join()
+        family, sockaddr = parse_address(self.address)
+        if family != socket.AF_INET and os.path.exists(sockaddr):
+            os.unlink(sockaddr)
+
+
+def main(argv):
+    """Run ``terraformpy serve``"""
+    parser = argparse.ArgumentParser(
+        prog="terraformpy serve",
+        description="Compile the requests of terraformpy --server ADDRESS in a pool of warm worker processes",
+    )
+    parser.add_argument(
+        "address",
+        nargs="?",
+        default=DEFAULT_ADDRESS,
+        help="The Unix socket path, or [HOST:]PORT, to listen on (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="The number of worker processes, and requests compiled at once (default: the number of CPUs)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        metavar="SECONDS",
+        help="Report an error for requests that aren't compiled within this many seconds (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--allow-remote",
+        action="store_true",
+        help="Allow listening on a HOST:PORT that other machines can connect to, only do so on a network you trust",
+    )
+    parser.add_argument(
+        "--preload",
+        action="append",
+        metavar="MODULE",
+        help="Import this module before starting the workers, can be given multiple times",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        server = CompileServer(
+            args.address,
+            workers=args.workers,
+            preload=args.preload or (),
+            timeout=args.timeout,
+            allow_remote=args.allow_remote,
+        )
+    except ValueError as exc:
+        print(
+            "terraformpy - Error: %s, pass --allow-remote to listen on it anyway" % exc
+        )
+        sys.exit(1)
+    except (IOError, OSError) as exc:
+        print("terraformpy - Error: can't listen on %s: %s" % (args.address, exc))
+        sys.exit(1)
+
+    # clean up when we're stopped by a service manager, just like when we're interrupted
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(
+        "terraformpy - Serving on %s with %d worker(s), press Ctrl-C to stop"
+        % (args.address, server.workers)
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
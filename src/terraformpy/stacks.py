@@ -0,0 +1,424 @@
+"""
+Copyright 2019 NerdWallet
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Splitting a config into separate root stacks
+
+Resources and modules are the only objects that end up in the state, so they're what gets split between stacks.  The
+other objects (providers, variables, data sources) are copied into every stack that uses them.
+
+Resources are grouped by the weakly connected components of the reference graph, where a reference made through a
+data source, provider or variable (i.e. a data source that looks up the ARN of a resource) connects the resources on
+either side of it just like a direct reference does.  Stacks can also be named explicitly, by matching the addresses of
+the objects they hold with glob patterns, in which case the remaining components join the explicit stack they are
+connected to (if there is only one) or become stacks of their own.
+
+When a reference crosses from one stack to another the stack that defines the object exports it as an output, and the
+stack that references it reads it through a ``terraform_remote_state`` data source.  Since stacks are applied one after
+the other the references between stacks can't form a cycle.
+"""
+
+import collections
+import os
+import re
+
+import six
+
+from .graph import NoMatchError, rewrite_references
+from .objects import TFObject
+from .writer import write_json_file
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+# the kinds of objects that are part of the state, and are split between stacks
+STATEFUL = frozenset(["resource", "module"])
+
+_INVALID_NAME_CHARS = re.compile(r"[^A-Za-z0-9_-]")
+
+
+class StackCycleError(ValueError):
+    """Raised when the stacks reference each other in a cycle, which would make it impossible to apply them
+
+    stacks is the list of the names of the stacks in the cycle.
+    """
+
+    @property
+    def stacks(self):
+        return self.args[0]
+
+    def __str__(self):
+        return "the stacks reference each other in a cycle: {0}".format(
+            " -> ".join(self.stacks)
+        )
+
+
+class StackOutputError(ValueError):
+    """Raised when the output that a stack would export an object with has the name of another output of the stack"""
+
+    def __init__(self, stack, name, address):
+        super(StackOutputError, self).__init__(stack, name, address)
+
+    def __str__(self):
+        stack, name, address = self.args
+        return "the stack {0} can't export {1} as the output {2}, which is already defined".format(
+            stack, address, name
+        )
+
+
+def _name(address):
+    """The name of the stack, or output, for an address, i.e. aws_vpc_main for resource.aws_vpc.main"""
+    if address.startswith("resource."):
+        address = address[9:]
+    return _INVALID_NAME_CHARS.sub("_", address.replace(".", "_"))
+
+
+def _reference(address):
+    """The text of a reference to the object at address, i.e. aws_vpc.main for resource.aws_vpc.main"""
+    if address.startswith("resource."):
+        return address[9:]
+    return address
+
+
+class Stack(object):
+    """A stack of objects that is compiled into its own root config
+
+    ``addresses`` are the addresses of the resources, modules and outputs in the stack, in the order they were created.
+    ``imports`` maps the addresses this stack references in other stacks to the name of their stack, and ``exports``
+    lists the addresses other stacks reference in this one.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.addresses = []
+        self.imports = collections.OrderedDict()
+        self.exports = []
+
+    def __repr__(self):
+        return "Stack({0!r}, {1} objects)".format(self.name, len(self.addresses))
+
+    def depends_on(self):
+        """Return the names of the stacks this stack imports from"""
+        names = []
+        for name in six.itervalues(self.imports):
+            if name not in names:
+                names.append(name)
+        return names
+
+
+class StackPlan(object):
+    """StackPlan splits the objects of a ReferenceGraph into stacks, see plan_stacks"""
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.stacks = collections.OrderedDict()
+        self.stack_of = {}
+        self._reach = {}
+        self._order = dict(
+            (address, index) for index, address in enumerate(graph.objects)
+        )
+
+    def stateful(self, address):
+        return self.graph.objects[address].TF_TYPE in STATEFUL
+
+    def reach(self, address):
+        """Return the stateful addresses that address references, directly or through other (stateless) objects"""
+        try:
+            return self._reach[address]
+        except KeyError:
+            pass
+
+        # guard against stateless objects that reference each other
+        self._reach[address] = []
+        reached = []
+        for reference in self.graph.references_of(address):
+            if self.stateful(reference):
+                found = [reference]
+            else:
+                found = self.reach(reference)
+            for item in found:
+                if item not in reached and item != address:
+                    reached.append(item)
+        self._reach[address] = reached
+        return reached
+
+    def add(self, name, address):
+        try:
+            stack = self.stacks[name]
+        except KeyError:
+            stack = self.stacks[name] = Stack(name)
+        stack.addresses.append(address)
+        self.stack_of[address] = name
+
+    def selection(self, stack):
+        """Return the objects to compile for the stack: its own objects and the stateless objects they use"""
+        selected = set(stack.addresses)
+        pending = list(stack.addresses)
+        while pending:
+            address = pending.pop()
+            for reference in self.graph.references_of(address):
+                if reference in selected or self.stateful(reference):
+                    continue
+                selected.add(reference)
+                pending.append(reference)
+        return [
+            self.graph.objects[address]
+            for address in sorted(selected, key=self._order.__getitem__)
+        ]
+
+
+def plan_stacks(graph, assignments=()):
+    """Split the objects of graph into stacks, returning a StackPlan
+
+    assignments is a list of (name, pattern) tuples that put the resources, modules and outputs matching the glob
+    pattern (see ReferenceGraph.match) into the named stack.  Raises NoMatchError if a pattern doesn't match any
+    resources, modules or outputs, and StackCycleError if the stacks would reference each other in a cycle.
+    """
+    plan = StackPlan(graph)
+    splittable = [
+        address
+        for address, obj in six.iteritems(graph.objects)
+        if obj.TF_TYPE in STATEFUL or obj.TF_TYPE == "output"
+    ]
+
+    # the first pattern that matches an object decides its stack
+    explicit = {}
+    candidates = set(splittable)
+    for name, pattern in assignments:
+        matched = [address for address in graph.match(pattern) if address in candidates]
+        if not matched:
+            raise NoMatchError(pattern)
+        for address in matched:
+            explicit.setdefault(address, name)
+
+    # the weakly connected components of the stateful objects that weren't assigned to a stack
+    parents = {}
+
+    def find(address):
+        root = address
+        while parents[root] != root:
+            root = parents[root]
+        while parents[address] != root:
+            parents[address], address = root, parents[address]
+        return root
+
+    stateful = [address for address in splittable if plan.stateful(address)]
+    for address in stateful:
+        if address not in explicit:
+            parents[address] = address
+    for address in stateful:
+        if address in explicit:
+            continue
+        for reference in plan.reach(address):
+            if reference in parents:
+                parents[find(reference)] = find(address)
+
+    components = collections.OrderedDict()
+    for address in stateful:
+        if address not in explicit:
+            components.setdefault(find(address), []).append(address)
+
+    # a component joins the explicit stack it's connected to, if there's only one, or becomes a stack of its own
+    connected = collections.defaultdict(set)
+    for address in stateful:
+        for reference in plan.reach(address):
+            if address in explicit and reference not in explicit:
+                connected[find(reference)].add(explicit[address])
+            elif address not in explicit and reference in explicit:
+                connected[find(address)].add(explicit[reference])
+
+    component_stack = {}
+    for root, members in six.iteritems(components):
+        stacks = connected[root]
+        component_stack[root] = (
+            next(iter(stacks)) if len(stacks) == 1 else _name(members[0])
+        )
+
+    for address in splittable:
+        obj = graph.objects[address]
+        if address in explicit:
+            name = explicit[address]
+        elif obj.TF_TYPE in STATEFUL:
+            name = component_stack[find(address)]
+        else:
+            # outputs go with the first stateful object they reference
+            reached = plan.reach(address)
+            if reached:
+                if reached[0] in explicit:
+                    name = explicit[reached[0]]
+                else:
+                    name = component_stack[find(reached[0])]
+            elif plan.stacks:
+                name = next(iter(plan.stacks))
+            else:
+                name = "main"
+        plan.add(name, address)
+
+    for stack in six.itervalues(plan.stacks):
+        for address in stack.addresses:
+            for reference in plan.reach(address):
+                other = plan.stack_of[reference]
+                if other != stack.name and reference not in stack.imports:
+                    stack.imports[reference] = other
+                    if reference not in plan.stacks[other].exports:
+                        plan.stacks[other].exports.append(reference)
+
+    _check_cycles(plan)
+    return plan
+
+
+def _check_cycles(plan):
+    visiting = []
+    done = set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise StackCycleError(visiting[visiting.index(name) :] + [name])
+        visiting.append(name)
+        for other in plan.stacks[name].depends_on():
+            visit(other)
+        visiting.pop()
+        done.add(name)
+
+    for name in plan.stacks:
+        visit(name)
+
+
+def _rewrite(value, rewrite):
+    """Rewrite the references within value, copying only the containers that change"""
+    if isinstance(value, six.string_types):
+        if "${" not in value:
+            return value
+        return rewrite_references(value, rewrite)
+
+    if isinstance(value, Mapping):
+        result = None
+        for key, val in six.iteritems(value):
+            if key == "depends_on" and isinstance(val, list):
+                # the objects of other stacks are applied before this one, so there's nothing to wait on
+                new = [
+                    item
+                    for item in val
+                    if not isinstance(item, six.string_types)
+                    or rewrite_references("${%s}" % item, rewrite) == "${%s}" % item
+                ]
+                if new == val:
+                    new = val
+            else:
+                new = _rewrite(val, rewrite)
+            if new is not val:
+                if result is None:
+                    result = dict(value)
+                result[key] = new
+        return value if result is None else result
+
+    if isinstance(value, list):
+        result = [_rewrite(val, rewrite) for val in value]
+        if all(new is old for new, old in zip(result, value)):
+            return value
+        return result
+
+    return value
+
+
+def _state_backend(config, name):
+    """Return the (type, config) of the backend that the stack named name uses, based on the backend of config"""
+    backend = (config.get("terraform") or {}).get("backend")
+    if not backend:
+        return "local", {"path": "terraform.tfstate"}
+
+    backend_type, settings = next(iter(backend.items()))
+    settings = dict(settings or {})
+    for key in ("key", "path"):
+        if key in settings:
+            directory, filename = os.path.split(settings[key])
+            settings[key] = os.path.join(directory, name, filename)
+    if "prefix" in settings:
+        settings["prefix"] = "{0}/{1}".format(settings["prefix"].rstrip("/"), name)
+    return backend_type, settings
+
+
+def compile_stack(plan, stack):
+    """Compile a stack into its own config, with outputs for its exports and remote state lookups for its imports
+
+    Raises StackOutputError if the name of an export's output is already taken by another output.
+    """
+    config = TFObject.compile(select=plan.selection(stack))
+
+    def rewrite(address, reference):
+        try:
+            other = stack.imports[address]
+        except KeyError:
+            return None
+        return "data.terraform_remote_state.{0}.outputs.{1}".format(
+            other, _name(address)
+        )
+
+    result = {}
+    for section, value in six.iteritems(config):
+        result[section] = value if section == "terraform" else _rewrite(value, rewrite)
+
+    backend_type, settings = _state_backend(config, stack.name)
+    if backend_type != "local" or settings != {"path": "terraform.tfstate"}:
+        terraform = dict(result.get("terraform") or {})
+        terraform["backend"] = {backend_type: settings}
+        result["terraform"] = terraform
+
+    if stack.exports:
+        outputs = dict(result.get("output") or {})
+        for address in stack.exports:
+            name = _name(address)
+            if name in outputs:
+                raise StackOutputError(stack.name, name, address)
+            outputs[name] = {"value": "${%s}" % _reference(address)}
+        result["output"] = outputs
+
+    imported = stack.depends_on()
+    if imported:
+        data = dict(result.get("data") or {})
+        remote_states = dict(data.get("terraform_remote_state") or {})
+        for name in imported:
+            backend_type, settings = _state_backend(config, name)
+            if backend_type == "local":
+                settings = {"path": os.path.join("..", name, settings["path"])}
+            remote_states[name] = {"backend": backend_type, "config": settings}
+        data["terraform_remote_state"] = remote_states
+        result["data"] = data
+
+    return result
+
+
+def write_stacks(plan, directory, indent=4, transform=None):
+    """Compile each stack of the plan and write it to <directory>/<stack name>/main.tf.json
+
+    transform, if given, is called with each compiled config and returns the config to write.  Returns the list of the
+    paths that were written, see write_json_file.
+    """
+    written = []
+    for stack in six.itervalues(plan.stacks):
+        config = compile_stack(plan, stack)
+        if transform is not None:
+            config = transform(config)
+
+        stack_dir = os.path.join(directory, stack.name)
+        if not os.path.isdir(stack_dir):
+            os.makedirs(stack_dir)
+        path = os.path.join(stack_dir, "main.tf.json")
+        if write_json_file(path, config, indent=indent):
+            written.append(path)
+    return written
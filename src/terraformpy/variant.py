@@ -0,0 +1,51 @@
+"""
+Copyright 2019 NerdWallet
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Variant is kept apart from ResourceCollection, so that it can be used without importing schematics
+"""
+
+import six
+
+from .context import context_property, current_context
+
+
+class _VariantType(type):
+    # the current variant is kept in the current CompileContext
+    CURRENT_VARIANT = context_property("variant")
+
+
+@six.add_metaclass(_VariantType)
+class Variant(object):
+    """When used as a context manager it provides the ability for ResourceCollection's to vary their inputs based on a
+    symbolc string name that allows you to define a resource collection for multiple environments where most of the
+    inputs are shared, with only a few differences.
+
+    Any kwargs passed to the constructor become defaults for non-variant inputs.  This allows you to supply inputs that
+    are shared between many different ResourceCollections at the variant level so you don't need to pass them over and
+    over again.
+    """
+
+    def __init__(self, name, **kwargs):
+        self.name = name
+        self.defaults = kwargs
+        self.previous_variant = None
+
+    def __enter__(self):
+        context = current_context()
+        self.previous_variant = context.variant
+        context.variant = self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        current_context().variant = self.previous_variant
@@ -0,0 +1,277 @@
+"""
+Copyright 2019 NerdWallet
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Recompile whenever the .tf.py files, or the local modules they import, change
+
+The interpreter (and every module that has been imported) is kept between builds.  When a file changes the registry is
+reset and the .tf.py files are loaded again, but the only local modules that are executed again are:
+
+* the modules that changed
+* the modules that declared objects or added hooks when they were imported, since resetting the registry forgets them
+* the modules that imported any of the above, since they hold references to the old modules
+"""
+
+from __future__ import print_function
+
+import collections
+import os
+import sys
+import time
+import traceback
+
+import six
+from six.moves import builtins
+
+from .cache import local_modules
+from .objects import Terraform, TFObject
+
+
+def _resolve_name(name, globals, level):
+    """Resolve a relative import the same way the import system does"""
+    if not level:
+        return name
+    package = globals.get("__package__")
+    if not package:
+        package = globals.get("__name__", "")
+        if "__path__" not in globals:
+            package = package.rpartition(".")[0]
+    base = package.rsplit(".", level - 1)[0]
+    return "{0}.{1}".format(base, name) if name else base
+
+
+def _registry_state():
+    """A cheap fingerprint of everything that TFObject.reset forgets"""
+    return (
+        len(TFObject.registry()),
+        len(TFObject._hooks or ()),
+        len(Terraform._instances or ()),
+    )
+
+
+class ImportTracker(object):
+    """ImportTracker records which modules import each other and which modules declare objects
+
+    While installed every import statement goes through the tracker, which records an edge from the importing module to
+    each module it imports (even if that module was already imported elsewhere).  Modules whose execution changes the
+    registry (declares objects or adds hooks) are recorded as declaring.  Since nested imports are executed within the
+    import of the outer module, an outer module that imports a declaring module is also considered to be declaring.
+    The submodules named by ``from package import module`` are imported, and recorded, on their own.
+    """
+
+    def __init__(self):
+        self.importers = collections.defaultdict(set)
+        self.declaring = set()
+        self._import = None
+
+    def install(self):
+        self._import = builtins.__import__
+        builtins.__import__ = self.tracked_import
+
+    def uninstall(self):
+        builtins.__import__ = self._import
+        self._import = None
+
+    def tracked_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        globals = globals or {}
+        try:
+            target = _resolve_name(name, globals, level)
+        except (AttributeError, ValueError):
+            target = None
+
+        if target is not None and target not in sys.modules:
+            self._declares(target, self._import, name, globals, locals, (), level)
+
+        # the submodules in the fromlist are imported one at a time first, so that we know which of them declares
+        package = sys.modules.get(target) if target else None
+        if fromlist and hasattr(package, "__path__"):
+            for item in fromlist:
+                if item == "*" or hasattr(package, item):
+                    continue
+                submodule = "{0}.{1}".format(target, item)
+                try:
+                    self._declares(
+                        submodule, self._import, submodule, globals, locals, (), 0
+                    )
+                except ImportError:
+                    # it isn't a submodule, the import itself reports it if it's missing altogether
+                    pass
+
+        module = self._import(name, globals, locals, fromlist, level)
+
+        importer = globals.get("__name__")
+        if importer and target:
+            targets = [target] + [
+                "{0}.{1}".format(target, item) for item in fromlist or ()
+            ]
+            for imported in targets:
+                if imported != importer and imported in sys.modules:
+                    self.importers[imported].add(importer)
+
+        return module
+
+    def _declares(self, name, func, *args):
+        """Call func with args, which imports or loads the module name, recording whether it declares anything"""
+        before = _registry_state()
+        func(*args)
+        if _registry_state() != before:
+            self.declaring.add(name)
+
+    def load(self, load_file, filename):
+        """Load a .tf.py file with load_file, recording whether it declares objects like any other module"""
+        self._declares(filename[:-6], load_file, filename)
+
+    def stale_modules(self, changed):
+        """Return the names of the modules that must be executed again when the modules in changed have changed"""
+        stale = set()
+        pending = list(set(changed) | self.declaring)
+        while pending:
+            name = pending.pop()
+            if name in stale:
+                continue
+            stale.add(name)
+            pending.extend(self.importers.get(name, ()))
+        return stale
+
+    def forget(self, names):
+        for name in names:
+            self.declaring.discard(name)
+            self.importers.pop(name, None)
+
+
+def _purge_module(name):
+    """Remove a module from sys.modules, and from its parent package, so that the next import executes it again"""
+    sys.modules.pop(name, None)
+    parent, _, child = name.rpartition(".")
+    if parent in sys.modules:
+        try:
+            delattr(sys.modules[parent], child)
+        except AttributeError:
+            pass
+
+
+def _source_path(module):
+    path = os.path.abspath(module.__file__)
+    if path.endswith((".pyc", ".pyo")):
+        path = path[:-1]
+    return path
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class Watcher(object):
+    """Watcher polls the .tf.py files in the current directory, and the local modules they import, for changes
+
+    build is called with the list of .tf.py files to (re)compile them into the registry, load_file is used to load each
+    of them.  build is responsible for compiling and writing the result.
+    """
+
+    def __init__(self, build, load_file, interval=0.5):
+        self.build = build
+        self.load_file = load_file
+        self.interval = interval
+        self.tracker = ImportTracker()
+        self.root = os.path.abspath(os.getcwd())
+        self.paths = {}
+        self.mtimes = {}
+
+    def tf_files(self):
+        return sorted(ent for ent in os.listdir(self.root) if ent.endswith(".tf.py"))
+
+    def watched(self):
+        """Return a dict of the paths being watched to the module name they were loaded as"""
+        paths = dict(
+            (os.path.join(self.root, filename), filename[:-6])
+            for filename in self.tf_files()
+        )
+        tf_modules = set(paths.values())
+        for name in local_modules(self.root):
+            if name not in tf_modules:
+                paths.setdefault(_source_path(sys.modules[name]), name)
+        return paths
+
+    def changed(self):
+        """Return the names of the modules whose files changed (or were added or removed) since the last check"""
+        # keep watching the files of modules that were purged, or are no longer imported, in case they come back
+        paths = dict(self.paths)
+        paths.update(self.watched())
+        mtimes = dict((path, _mtime(path)) for path in paths)
+
+        changed = set()
+        for path in set(mtimes) | set(self.mtimes):
+            if mtimes.get(path) != self.mtimes.get(path):
+                changed.add(paths[path])
+        return changed, paths, mtimes
+
+    def _remember(self, paths, mtimes):
+        # files that were imported for the first time by the build are watched from now on
+        for path, name in six.iteritems(self.watched()):
+            if path not in mtimes:
+                paths[path] = name
+                mtimes[path] = _mtime(path)
+        self.paths = paths
+        self.mtimes = mtimes
+
+    def rebuild(self, changed):
+        stale = self.tracker.stale_modules(changed)
+        for name in stale:
+            _purge_module(name)
+        self.tracker.forget(stale)
+
+        TFObject.reset()
+
+        self.tracker.install()
+        try:
+            self.build(self.tf_files(), self.load)
+        finally:
+            self.tracker.uninstall()
+
+    def load(self, filename):
+        self.tracker.load(self.load_file, filename)
+
+    def run_once(self):
+        """Rebuild if anything changed, returning True if a build was attempted"""
+        changed, paths, mtimes = self.changed()
+        if not changed and self.mtimes:
+            return False
+
+        start = time.time()
+        try:
+            self.rebuild(changed)
+        except Exception:
+            traceback.print_exc()
+            # we don't know how far the build got, so start over with every local module the next time
+            self.tracker = ImportTracker()
+            for name in local_modules(self.root):
+                _purge_module(name)
+            print("terraformpy - Build failed, waiting for changes")
+        else:
+            print("terraformpy - Rebuilt in %.2fs" % (time.time() - start))
+
+        self._remember(paths, mtimes)
+        return True
+
+    def run(self):
+        print("terraformpy - Watching for changes, press Ctrl-C to stop")
+        try:
+            while True:
+                self.run_once()
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            pass
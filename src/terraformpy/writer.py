@@ -0,0 +1,267 @@
+"""
+Copyright 2019 NerdWallet
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+JSON writer for compiled configs
+
+Rather than encoding the entire compiled config into one string (or feeding it through the pure Python encoder that
+json.dump uses) the writer walks the top levels of the config itself and streams each object to the file as soon as it
+has been encoded.  Only a single object is ever held in memory as JSON text.
+
+Since the top levels are written by the writer, keys that compare equal but are distinct dictionary keys (see
+DuplicateKey) are written out as repeated keys in the order they were inserted.
+"""
+
+import io
+import json
+import os
+
+import six
+
+from .helpers import file_hash
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+# the number of mapping levels that are streamed, rather than encoded as a whole, for each top level key
+# typed objects are nested one level deeper than named objects, so we stream down to the individual objects
+STREAM_DEPTH = {"resource": 3, "data": 3}
+DEFAULT_STREAM_DEPTH = 2
+
+
+def _default(value):
+    # mappings that aren't dicts, like SharedValues, are encoded as dicts
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError("Object of type %s is not JSON serializable" % type(value).__name__)
+
+
+def _stdlib_encoder(indent):
+    if indent is None:
+        # without an indent (and in one shot) the stdlib uses its C accelerated encoder
+        return lambda value: json.dumps(value, separators=(",", ":"), default=_default)
+    # python 2 separates items with ", " even when indenting, which leaves trailing whitespace on every line
+    return lambda value: json.dumps(
+        value, indent=indent, separators=(",", ": "), default=_default
+    )
+
+
+def _native_encoder(indent):
+    """Return an encode function using the fastest JSON library that is installed and that supports the given indent,
+    or None if there is no such library
+    """
+    try:
+        import orjson
+    except ImportError:
+        pass
+    else:
+        if indent is None:
+            return lambda value: orjson.dumps(value).decode("utf-8")
+        if indent == 2:
+            return lambda value: orjson.dumps(value, option=orjson.OPT_INDENT_2).decode(
+                "utf-8"
+            )
+
+    if indent is not None:
+        return None
+
+    try:
+        import rapidjson
+    except ImportError:
+        pass
+    else:
+        return lambda value: rapidjson.dumps(value)
+
+    try:
+        import ujson
+    except ImportError:
+        pass
+    else:
+        return lambda value: ujson.dumps(value, escape_forward_slashes=False)
+
+    return None
+
+
+def get_encoder(indent=4, native=True):
+    """Return a function that encodes a single value to a JSON string
+
+    When native is True and a native encoder (orjson, rapidjson or ujson) that can produce the requested indent is
+    installed it will be used, with the stdlib json module used for any value the native encoder fails on.
+    """
+    fallback = _stdlib_encoder(indent)
+    encoder = _native_encoder(indent) if native else None
+    if encoder is None:
+        return fallback
+
+    def encode(value):
+        try:
+            return encoder(value)
+        except (TypeError, ValueError, OverflowError):
+            return fallback(value)
+
+    return encode
+
+
+def _encode_key(key):
+    if not isinstance(key, six.string_types):
+        # match the stdlib, which converts numbers, booleans and None into strings for keys
+        key = json.dumps(key)
+    return json.dumps(key)
+
+
+def iter_json(config, indent=4, encoder=None):
+    """Generate the JSON text for config, one chunk at a time
+
+    With the default encoder the concatenated chunks are identical to json.dumps(config, indent=indent) on Python 3.
+    """
+    if encoder is None:
+        encoder = get_encoder(indent)
+
+    if indent is None:
+        key_separator = ":"
+        newline = ""
+    else:
+        key_separator = ": "
+        newline = "\n"
+
+    def indentation(level):
+        if indent is None:
+            return ""
+        return newline + " " * (indent * level)
+
+    def iter_value(value, level, depth):
+        if level >= depth or not isinstance(value, Mapping) or not value:
+            text = encoder(value)
+            if indent is not None and level > 0:
+                text = text.replace("\n", indentation(level))
+            yield text
+            return
+
+        separator = "{"
+        for key, val in six.iteritems(value):
+            yield separator
+            yield indentation(level + 1)
+            yield _encode_key(key)
+            yield key_separator
+
+            child_depth = depth
+            if level == 0:
+                child_depth = STREAM_DEPTH.get(key, DEFAULT_STREAM_DEPTH)
+
+            for chunk in iter_value(val, level + 1, child_depth):
+                yield chunk
+            separator = ","
+
+        yield indentation(level)
+        yield "}"
+
+    return iter_value(config, 0, 1)
+
+
+def write_json(config, fd, indent=4, encoder=None):
+    """Stream config as JSON to the text file like object fd, followed by a newline
+
+    See iter_json
+    """
+    for chunk in iter_json(config, indent=indent, encoder=encoder):
+        if isinstance(chunk, bytes):
+            # on python 2 the encoders, and our own literals, are byte strings
+            chunk = chunk.decode("utf-8")
+        fd.write(chunk)
+    fd.write(six.text_type("\n"))
+
+
+def _same_content(path, other_path):
+    try:
+        if os.path.getsize(path) != os.path.getsize(other_path):
+            return False
+        return file_hash(path) == file_hash(other_path)
+    except (IOError, OSError):
+        return False
+
+
+def write_json_file(path, config, indent=4, encoder=None):
+    """Write config as JSON to path, but only if the content has changed
+
+    The JSON is streamed to a temporary file next to path, which atomically replaces path if its content differs.
+    Returns True if path was written.
+    """
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with io.open(tmp_path, "w", encoding="utf-8") as fd:
+            write_json(config, fd, indent=indent, encoder=encoder)
+
+        if _same_content(tmp_path, path):
+            return False
+
+        os.rename(tmp_path, path)
+        return True
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def shard_by_type(config):
+    """Split config into one shard per top level key, with typed objects split further by their type
+
+    Returns a dict of shard file names to the config for that shard, i.e. ``resource.aws_instance.tf.json``
+    """
+    shards = {}
+    for tf_type, section in six.iteritems(config):
+        if tf_type in STREAM_DEPTH and isinstance(section, Mapping):
+            for object_type, objects in six.iteritems(section):
+                name = "{0}.{1}.tf.json".format(tf_type, object_type)
+                shards[name] = {tf_type: {object_type: objects}}
+        else:
+            shards["{0}.tf.json".format(tf_type)] = {tf_type: section}
+    return shards
+
+
+def write_shards(shards, manifest_path, indent=4, encoder=None):
+    """Write each of the shards (a dict of file names to configs), removing shards written by a previous run that are
+    no longer part of the output
+
+    The names of the shards that were written are tracked in the JSON file at manifest_path.  Since main.tf.json is
+    always generated by terraformpy it is removed when it is not one of the shards.  Each shard is only rewritten when
+    its content changes, see write_json_file.
+
+    Returns a tuple of the lists of shards that were written and removed.
+    """
+    try:
+        with io.open(manifest_path, encoding="utf-8") as fd:
+            previous = set(json.load(fd))
+    except (IOError, OSError, ValueError):
+        previous = set()
+    previous.add("main.tf.json")
+
+    written = []
+    for name in sorted(shards):
+        if write_json_file(name, shards[name], indent=indent, encoder=encoder):
+            written.append(name)
+
+    removed = []
+    for name in sorted(previous - set(shards)):
+        if os.path.exists(name):
+            os.remove(name)
+            removed.append(name)
+
+    manifest_dir = os.path.dirname(manifest_path)
+    if manifest_dir and not os.path.isdir(manifest_dir):
+        os.makedirs(manifest_dir)
+    with io.open(manifest_path, "w", encoding="utf-8") as fd:
+        fd.write(six.text_type(json.dumps(sorted(shards))))
+
+    return written, removed
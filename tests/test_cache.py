@@ -0,0 +1,58 @@
+from terraformpy import Variant
+from terraformpy.cache import CompileCache
+from terraformpy.loader import compile_files
+
+
+def test_cache_invalidation(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join("main.tf.py").write("")
+    tmpdir.join("helper.py").write("")
+
+    cache = CompileCache(path="cache", env_names=["SOME_VAR"])
+    cache.put("main.tf.py", "{}", ["helper.py"])
+    assert cache.get("main.tf.py") == "{}"
+
+    # modules the file imported are part of the key
+    tmpdir.join("helper.py").write("# changed")
+    assert cache.get("main.tf.py") is None
+    cache.put("main.tf.py", "{}", ["helper.py"])
+
+    # as are relevant environment variables
+    monkeypatch.setenv("SOME_VAR", "value")
+    assert cache.get("main.tf.py") is None
+    cache.put("main.tf.py", "{}", ["helper.py"])
+    monkeypatch.setenv("UNRELATED_VAR", "value")
+    assert cache.get("main.tf.py") == "{}"
+
+    # and the variant
+    with Variant("prod"):
+        assert cache.get("main.tf.py") is None
+
+    # a missing dependency is a miss too
+    tmpdir.join("helper.py").remove()
+    assert cache.get("main.tf.py") is None
+
+
+def test_compile_files_with_cache(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.syspath_prepend(str(tmpdir))
+    tmpdir.join("helper.py").write("AMI = 'ami-1'\n")
+    tmpdir.join("main.tf.py").write(
+        "import helper\n"
+        "from terraformpy import Resource\n"
+        "open('executions', 'a').write('x')\n"
+        "Resource('aws_instance', 'web', ami=helper.AMI)\n"
+    )
+
+    cache = CompileCache(path="cache")
+    first = compile_files(["main.tf.py"], cache=cache).result
+    second = compile_files(["main.tf.py"], cache=cache).result
+
+    assert first == second == {"resource": {"aws_instance": {"web": {"ami": "ami-1"}}}}
+    assert tmpdir.join("executions").read() == "x"
+
+    tmpdir.join("helper.py").write("AMI = 'ami-2'\n")
+    third = compile_files(["main.tf.py"], cache=cache).result
+
+    assert third == {"resource": {"aws_instance": {"web": {"ami": "ami-2"}}}}
+    assert tmpdir.join("executions").read() == "xx"
@@ -0,0 +1,108 @@
+import threading
+
+import pytest
+
+from terraformpy import (
+    CompileContext,
+    Provider,
+    Resource,
+    TFObject,
+    Variable,
+    Variant,
+)
+from terraformpy.context import current_context
+
+
+def test_context_isolation():
+    outer = Resource("aws_instance", "outer", ami="ami-outer")
+    Resource.add_hook("aws_instance", lambda object_id, attrs: dict(attrs, hooked=True))
+
+    with CompileContext() as context:
+        assert current_context() is context
+        assert TFObject._hooks is None
+        assert Resource._instances is None
+
+        inner = Resource("aws_instance", "inner", ami="ami-inner")
+        assert Resource._instances == [inner]
+        assert TFObject.lookup("resource.aws_instance.inner") is inner
+
+        assert TFObject.compile() == {
+            "resource": {"aws_instance": {"inner": {"ami": "ami-inner"}}}
+        }
+        assert TFObject._frozen
+
+    assert not TFObject._frozen
+    assert Resource._instances == [outer]
+    assert TFObject.compile() == {
+        "resource": {"aws_instance": {"outer": {"ami": "ami-outer", "hooked": True}}}
+    }
+
+    # the context keeps its objects, so it can be used again
+    with context:
+        assert [obj._name for obj in TFObject.registry()] == ["inner"]
+        TFObject.reset()
+        assert len(TFObject.registry()) == 0
+
+
+def test_context_provider_and_variant():
+    with Variant("prod"), Provider("aws", alias="west2", region="us-west-2"):
+        with CompileContext():
+            assert Variant.CURRENT_VARIANT is None
+            assert Provider.CURRENT_PROVIDER is None
+
+            with Variant("dev"):
+                Variable("size", dev_variant=dict(default="tiny"))
+                assert Variant.CURRENT_VARIANT.name == "dev"
+
+            assert TFObject.compile() == {"variable": {"size": {"default": "tiny"}}}
+
+        assert Variant.CURRENT_VARIANT.name == "prod"
+        sg = Resource("aws_security_group", "sg")
+        assert sg.provider == "aws.west2"
+
+
+def test_interpolated_within_compile():
+    sg = Resource("aws_security_group", "sg", name="sg")
+
+    TFObject._frozen = True
+    assert sg.interpolated("name") == "${aws_security_group.sg.name}"
+    assert TFObject._frozen
+    assert sg.name == "${aws_security_group.sg.name}"
+
+
+def declare(index, barrier):
+    with Provider("aws", alias="p{0}".format(index), region="r{0}".format(index)):
+        for i in range(50):
+            Resource("aws_s3_bucket", "b{0}".format(i), bucket="t{0}".format(index))
+            if i == 25:
+                barrier()
+
+
+@pytest.mark.skipif(not hasattr(threading, "Barrier"), reason="requires Barrier")
+def test_concurrent_threads():
+    barrier = threading.Barrier(4)
+    results = {}
+
+    def build(index):
+        with CompileContext():
+            declare(index, barrier.wait)
+            results[index] = TFObject.compile()
+
+    threads = [threading.Thread(target=build, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for index, config in results.items():
+        assert list(config["provider"].values()) == [
+            {"alias": "p{0}".format(index), "region": "r{0}".format(index)}
+        ]
+        buckets = config["resource"]["aws_s3_bucket"]
+        assert len(buckets) == 50
+        assert all(
+            bucket
+            == {"bucket": "t{0}".format(index), "provider": "aws.p{0}".format(index)}
+            for bucket in buckets.values()
+        )
+    assert len(TFObject.registry()) == 0
@@ -0,0 +1,26 @@
+import asyncio
+
+from terraformpy import CompileContext, TFObject, Variable, Variant
+
+
+def test_concurrent_tasks():
+    async def build(index, event):
+        with CompileContext():
+            with Variant("v{0}".format(index)):
+                Variable("a", default=index)
+                await event.wait()
+                Variable("b", default=Variant.CURRENT_VARIANT.name)
+            return TFObject.compile()
+
+    async def main():
+        event = asyncio.Event()
+        tasks = [asyncio.ensure_future(build(i, event)) for i in range(3)]
+        await asyncio.sleep(0)
+        event.set()
+        return await asyncio.gather(*tasks)
+
+    configs = asyncio.run(main())
+    assert configs == [
+        {"variable": {"a": {"default": i}, "b": {"default": "v{0}".format(i)}}}
+        for i in range(3)
+    ]
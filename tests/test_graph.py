@@ -0,0 +1,140 @@
+import json
+
+import pytest
+
+from terraformpy import Data, Module, Output, Provider, Resource, TFObject, Variable
+from terraformpy.graph import (
+    DanglingReferenceError,
+    NoMatchError,
+    ReferenceGraph,
+    references,
+)
+
+
+def make_objects():
+    Provider("aws", region="us-east-1")
+    west = Provider("aws", region="${var.west_region}", alias="west")
+    region = Variable("west_region", default="us-west-2")
+    Variable("unused", default="x")
+    ami = Data("aws_ami", "ecs", most_recent=True)
+    unused_ami = Data("aws_ami", "unused", owners=["${var.unused}"])
+    vpc = Resource("aws_vpc", "main", cidr_block="10.0.0.0/16")
+    with west:
+        web = Resource(
+            "aws_instance",
+            "web",
+            ami=ami.id,
+            subnet_id="${element(aws_subnet.private.*.id, 0)}",
+            user_data='${templatefile("${path.module}/init.sh", {vpc = aws_vpc.main.id})}',
+            tags={"Name": "web ${count.index} $${literal.ref}"},
+            depends_on=["aws_vpc.main", "module.net"],
+        )
+    Module("net", source="./net", vpc_id=vpc.id, providers={"aws": "aws.west"})
+    Output("web_ip", value=web.private_ip)
+    return region, unused_ami
+
+
+def test_references():
+    assert references("${aws_instance.web.tags.Name} ${var.a} ${local.b}") == [
+        "resource.aws_instance.web",
+        "variable.a",
+    ]
+    assert references('${lookup(var.map, "aws_x.y")} ${data.aws_ami.x.id}') == [
+        "variable.map",
+        "data.aws_ami.x",
+    ]
+    assert references("${[for s in var.list : s.id]} $${aws_vpc.escaped.id}") == [
+        "variable.list"
+    ]
+
+
+def test_reference_graph():
+    make_objects()
+    graph = ReferenceGraph.build()
+
+    assert graph.references["resource.aws_instance.web"] == [
+        "data.aws_ami.ecs",
+        "resource.aws_vpc.main",
+        "module.net",
+        "provider.aws.west",
+    ]
+    assert graph.references["resource.aws_vpc.main"] == ["provider.aws"]
+    assert graph.references["provider.aws.west"] == ["variable.west_region"]
+    assert graph.references["module.net"] == [
+        "resource.aws_vpc.main",
+        "provider.aws.west",
+    ]
+    assert graph.references["output.web_ip"] == ["resource.aws_instance.web"]
+    assert graph.referenced_by()["variable.west_region"] == ["provider.aws.west"]
+
+    assert graph.dangling == [
+        ("resource.aws_instance.web", "resource.aws_subnet.private")
+    ]
+    with pytest.raises(DanglingReferenceError) as excinfo:
+        graph.check()
+    assert excinfo.value.references == graph.dangling
+    assert "resource.aws_subnet.private" in str(excinfo.value)
+
+    data = json.loads(json.dumps(graph.to_dict()))
+    assert data["nodes"] == list(graph.objects)
+    assert ["output.web_ip", "resource.aws_instance.web"] in data["edges"]
+    assert '"output.web_ip" -> "resource.aws_instance.web";' in graph.to_dot()
+
+
+def test_prune():
+    region, unused_ami = make_objects()
+
+    kept = ReferenceGraph.build().prune()
+    addresses = [obj._address for obj in kept]
+
+    # the unused variable is only referenced by the unused data source
+    assert "data.aws_ami.unused" not in addresses
+    assert "variable.unused" not in addresses
+    assert "variable.west_region" in addresses
+    assert "data.aws_ami.ecs" in addresses
+    assert "output.web_ip" in addresses
+
+    compiled = TFObject.compile(select=kept)
+    assert list(compiled["variable"]) == ["west_region"]
+    assert list(compiled["data"]["aws_ami"]) == ["ecs"]
+
+
+def test_select(mocker):
+    make_objects()
+    hook = mocker.Mock(side_effect=lambda object_id, attrs: attrs)
+    Resource.add_hook("aws_vpc", hook)
+    # the references are only scanned as they're needed
+    graph = ReferenceGraph.build(scan=False)
+    assert graph.references == {}
+
+    # resources can be matched without the resource. prefix, like terraform's -target
+    assert graph.match("aws_vpc.*") == ["resource.aws_vpc.main"]
+    assert graph.match("aws_vpc.main") == ["resource.aws_vpc.main"]
+    assert graph.match("module.net") == ["module.net"]
+    assert graph.match("data.aws_ami.*") == ["data.aws_ami.ecs", "data.aws_ami.unused"]
+    assert graph.match("resource.aws_subnet.*") == []
+
+    selected = graph.select(["module.n?t"])
+    assert [obj._address for obj in selected] == [
+        "provider.aws",
+        "provider.aws.west",
+        "variable.west_region",
+        "resource.aws_vpc.main",
+        "module.net",
+    ]
+
+    assert "resource.aws_instance.web" not in graph.references
+
+    with pytest.raises(NoMatchError, match="aws_subnet"):
+        graph.select(["module.net", "aws_subnet.*"])
+
+    compiled = TFObject.compile(select=selected)
+    assert sorted(compiled) == ["module", "provider", "resource", "variable"]
+    assert list(compiled["resource"]) == ["aws_vpc"]
+    assert hook.call_count == 1
+
+    # objects that aren't selected are neither built nor given to hooks
+    compiled = TFObject.compile(select=graph.select(["output.*"]))
+    assert list(compiled["resource"]) == ["aws_vpc", "aws_instance"]
+    assert list(compiled["output"]) == ["web_ip"]
+    assert hook.call_count == 2
@@ -0,0 +1,94 @@
+import hashlib
+import json
+
+from terraformpy import Module, Output, Resource, TFObject, Variable
+from terraformpy.hoist import hoist_locals, local_name
+
+TAGS = dict(("tag{0}".format(i), "value{0}".format(i) * 4) for i in range(20))
+POLICY = json.dumps(
+    {"Statement": [{"Resource": "arn:aws:s3:::bucket/%d" % i} for i in range(10)]}
+)
+
+
+def test_hoist_locals():
+    for i in range(3):
+        Resource(
+            "aws_s3_bucket",
+            "bucket{0}".format(i),
+            tags=TAGS,
+            policy=POLICY,
+            lifecycle={"ignore_changes": ["tags"]},
+            small_tags={"a": "b"},
+        )
+    Resource("aws_iam_role", "role", tags=TAGS, description=POLICY, inline=[POLICY])
+    Variable("tags", default=TAGS)
+    Module("mod", source=POLICY)
+    Output("out", value=POLICY, description=POLICY)
+
+    config = TFObject.compile()
+    original = json.dumps(config, sort_keys=True)
+    result = hoist_locals(config)
+
+    # the config that was passed in is left alone
+    assert json.dumps(config, sort_keys=True) == original
+
+    assert sorted(result["locals"]) == sorted(
+        [local_name("inline", policy_digest()), local_name("tags", tags_digest())]
+    )
+    # the policy is found in the inline, policy and value attributes
+    policy_ref = "${local.%s}" % local_name("inline", policy_digest())
+    tags_ref = "${local.%s}" % local_name("tags", tags_digest())
+    assert result["locals"][policy_ref[8:-1]] == POLICY
+    assert result["locals"][tags_ref[8:-1]] == TAGS
+
+    bucket = result["resource"]["aws_s3_bucket"]["bucket1"]
+    assert bucket["tags"] == tags_ref
+    assert bucket["policy"] == policy_ref
+    assert bucket["lifecycle"] == {"ignore_changes": ["tags"]}
+    assert bucket["small_tags"] == {"a": "b"}
+
+    # the same value is hoisted into the same local wherever it's found
+    role = result["resource"]["aws_iam_role"]["role"]
+    assert role["tags"] == tags_ref
+    assert role["inline"] == [policy_ref]
+    assert result["output"]["out"]["value"] == policy_ref
+
+    # variables can't reference locals, and module sources and descriptions must be literal
+    assert role["description"] == POLICY
+    assert result["variable"]["tags"]["default"] == TAGS
+    assert result["module"]["mod"]["source"] == POLICY
+    assert result["output"]["out"]["description"] == POLICY
+
+
+def policy_digest():
+    return hashlib.sha1(POLICY.encode("utf-8")).hexdigest()
+
+
+def tags_digest():
+    text = json.dumps(TAGS, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def test_hoist_locals_names():
+    assert local_name("tags", "0123456789abcdef") == "tags_0123456789"
+
+    # values that reference the object itself can't be moved
+    for i in range(3):
+        Resource(
+            "aws_instance",
+            "web{0}".format(i),
+            user_data="#!/bin/sh\necho ${self.private_ip}\n" + "x" * 300,
+        )
+    config = TFObject.compile()
+    assert hoist_locals(config) is config
+
+    # the names only depend on the values, so they're the same from one run to the next
+    TFObject.reset()
+    Resource("aws_s3_bucket", "a", tags=TAGS)
+    Resource("aws_s3_bucket", "b", tags=TAGS)
+    first = hoist_locals(TFObject.compile())["locals"]
+
+    TFObject.reset()
+    Resource("aws_s3_bucket", "c", tags=dict(TAGS))
+    Resource("aws_s3_bucket", "d", tags=dict(TAGS))
+    assert hoist_locals(TFObject.compile())["locals"] == first
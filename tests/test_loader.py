@@ -0,0 +1,230 @@
+import json
+import os
+import sys
+
+import pytest
+
+from terraformpy import DuplicateKey, Provider, Resource, TFObject, Variant
+from terraformpy import loader
+from terraformpy.loader import (
+    compile_files,
+    compile_variants,
+    dump_fragment,
+    load_file,
+    load_fragment,
+)
+
+
+def test_fragment_round_trip():
+    Provider("aws", alias="east1")
+    Provider("aws", alias="west2")
+    vpc = Resource("aws_vpc", "main", cidr_block="10.0.0.0/16")
+    Resource("aws_subnet", "a", vpc_id=vpc.id)
+
+    config = TFObject.compile()
+    fragment = load_fragment(dump_fragment(config))
+
+    assert all(isinstance(key, DuplicateKey) for key in fragment["provider"])
+    assert json.dumps(fragment) == json.dumps(config)
+
+
+def test_compile_files(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join("a.tf.py").write(
+        "from terraformpy import Provider, Resource, Variable\n"
+        "Provider('aws', alias='east1')\n"
+        "Resource('aws_instance', 'a', ami='ami-a')\n"
+        "Variable('shared', default='a')\n"
+    )
+    tmpdir.join("b.tf.py").write(
+        "from terraformpy import Provider, Resource, Variable\n"
+        "Provider('aws', alias='west2')\n"
+        "Resource('aws_instance', 'b', ami='ami-b')\n"
+        "Variable('shared', default='b')\n"
+    )
+
+    merger = compile_files(["a.tf.py", "b.tf.py"], jobs=2)
+
+    assert merger.result["resource"] == {
+        "aws_instance": {"a": {"ami": "ami-a"}, "b": {"ami": "ami-b"}}
+    }
+    assert [provider["alias"] for provider in merger.result["provider"].values()] == [
+        "east1",
+        "west2",
+    ]
+    assert merger.conflicts == [
+        (("variable", "shared", "default"), "a.tf.py", "b.tf.py"),
+    ]
+
+
+def test_compile_files_in_process(tmpdir, monkeypatch):
+    lib = tmpdir.mkdir("lib")
+    project = tmpdir.mkdir("project")
+    monkeypatch.chdir(project)
+    monkeypatch.syspath_prepend(str(lib))
+    monkeypatch.delitem(sys.modules, "tagging", raising=False)
+
+    # a helper that isn't local to the project, but adds a hook, must add it for every file
+    lib.join("tagging.py").write(
+        "from terraformpy import Resource\n"
+        "def tag(object_id, attrs):\n"
+        "    attrs['tags'] = {'Owner': 'ops'}\n"
+        "    return attrs\n"
+        "Resource.add_hook('aws_instance', tag)\n"
+    )
+    for name in ("a", "b"):
+        project.join("%s.tf.py" % name).write(
+            "import tagging\n"
+            "from terraformpy import Resource\n"
+            "Resource('aws_instance', '%s', ami='ami-%s')\n" % (name, name)
+        )
+
+    merger = compile_files(["a.tf.py", "b.tf.py"], jobs=1)
+
+    assert merger.result["resource"] == {
+        "aws_instance": {
+            "a": {"ami": "ami-a", "tags": {"Owner": "ops"}},
+            "b": {"ami": "ami-b", "tags": {"Owner": "ops"}},
+        }
+    }
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_compile_variants(tmpdir, monkeypatch, jobs):
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join("a.tf.py").write(
+        "from terraformpy import Resource, Variant\n"
+        "Resource('aws_instance', 'a', count=1, prod_variant=dict(count=4))\n"
+        "Resource('aws_s3_bucket', 'b', bucket=Variant.CURRENT_VARIANT.name)\n"
+    )
+
+    results = compile_variants(["stage", "prod"], ["a.tf.py"], jobs=jobs)
+
+    assert [variant for variant, _ in results] == ["stage", "prod"]
+    for variant, config in results:
+        with Variant(variant):
+            TFObject.reset()
+            load_file("a.tf.py")
+            assert config == TFObject.compile()
+
+    assert results[1][1]["resource"]["aws_instance"]["a"] == {"count": 4}
+
+
+def test_compile_variants_warm(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.syspath_prepend(str(tmpdir))
+    for name in ("sizes", "declares", "per_variant"):
+        monkeypatch.delitem(sys.modules, name, raising=False)
+
+    # every import of a module is logged, so we can tell which processes imported it
+    log = "import os\nwith open('imports.log', 'a') as fd: fd.write(__name__ + '\\n')\n"
+    tmpdir.join("sizes.py").write(log + "SIZES = {'stage': 1, 'prod': 4}\n")
+    tmpdir.join("declares.py").write(
+        log + "from terraformpy import Variable\nVariable('shared', default='x')\n"
+    )
+    tmpdir.join("per_variant.py").write(
+        log + "from terraformpy import Variant\nNAME = Variant.CURRENT_VARIANT.name\n"
+    )
+    tmpdir.join("a.tf.py").write(
+        "import declares\n"
+        "from per_variant import NAME\n"
+        "from sizes import SIZES\n"
+        "from terraformpy import Resource\n"
+        "Resource('aws_instance', 'a', count=SIZES[NAME], tags={'Name': NAME})\n"
+    )
+
+    results = compile_variants(["stage", "prod"], ["a.tf.py"], jobs=2)
+
+    for variant, config in results:
+        assert config == {
+            "resource": {
+                "aws_instance": {
+                    "a": {
+                        "count": 4 if variant == "prod" else 1,
+                        "tags": {"Name": variant},
+                    }
+                }
+            },
+            "variable": {"shared": {"default": "x"}},
+        }
+
+    # schematics and the helper that doesn't depend on the variant were imported once, before forking, while the
+    # modules that declare objects or look at the variant were imported by each variant
+    assert "terraformpy.resource_collections" in sys.modules
+    assert "sizes" in sys.modules
+    assert "declares" not in sys.modules
+    assert "per_variant" not in sys.modules
+    imports = sorted(tmpdir.join("imports.log").read().split())
+    assert imports == ["declares"] * 3 + ["per_variant"] * 3 + ["sizes"]
+
+
+def test_compile_variants_in_process(tmpdir, monkeypatch):
+    lib = tmpdir.mkdir("lib")
+    project = tmpdir.mkdir("project")
+    monkeypatch.chdir(project)
+    monkeypatch.syspath_prepend(str(lib))
+    monkeypatch.delitem(sys.modules, "env_tagging", raising=False)
+
+    # a helper that isn't local to the project, but adds a hook for the variant, must add it for every variant
+    lib.join("env_tagging.py").write(
+        "from terraformpy import Resource, Variant\n"
+        "ENV = Variant.CURRENT_VARIANT.name\n"
+        "def tag(object_id, attrs):\n"
+        "    attrs['tags'] = {'Env': ENV}\n"
+        "    return attrs\n"
+        "Resource.add_hook('aws_instance', tag)\n"
+    )
+    project.join("a.tf.py").write(
+        "import env_tagging\n"
+        "from terraformpy import Resource\n"
+        "Resource('aws_instance', 'a', ami='ami-a')\n"
+    )
+
+    results = compile_variants(["stage", "prod"], ["a.tf.py"], jobs=1)
+
+    assert results == [
+        (
+            variant,
+            {
+                "resource": {
+                    "aws_instance": {"a": {"ami": "ami-a", "tags": {"Env": variant}}}
+                }
+            },
+        )
+        for variant in ("stage", "prod")
+    ]
+
+
+@pytest.mark.skipif(sys.version_info < (3, 5), reason="requires importlib")
+def test_load_file_bytecode(tmpdir, monkeypatch, mocker):
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join("a.tf.py").write(
+        "from terraformpy import Resource\n"
+        "from terraformpy.helpers import relative_file\n"
+        "Resource('aws_instance', 'a', user_data=relative_file('init.sh'))\n"
+    )
+
+    module = load_file("a.tf.py")
+    assert module.__name__ == "a"
+    assert os.path.abspath(module.__file__) == str(tmpdir.join("a.tf.py"))
+    assert sys.modules["a"] is module
+    assert len(tmpdir.join(".terraformpy", "bytecode").listdir()) == 1
+
+    expected = {
+        "aws_instance": {"a": {"user_data": '${file("${path.module}/init.sh")}'}}
+    }
+    assert TFObject.compile()["resource"] == expected
+
+    # the cached code is used until the file changes
+    source_to_code = mocker.spy(loader.TFLoader, "source_to_code")
+    TFObject.reset()
+    load_file("a.tf.py")
+    assert source_to_code.call_count == 0
+    assert TFObject.compile()["resource"] == expected
+
+    tmpdir.join("a.tf.py").write("from terraformpy import Variable\nVariable('v')\n")
+    TFObject.reset()
+    load_file("a.tf.py")
+    assert source_to_code.call_count == 1
+    assert list(TFObject.compile()) == ["variable"]
+    sys.modules.pop("a", None)
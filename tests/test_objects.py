@@ -16,6 +16,8 @@ limitations under the License.
 
 import collections
 import json
+import pickle
+import sys
 
 import pytest
 import schematics.types
@@ -23,8 +25,10 @@ import six
 
 from terraformpy import (
     Data,
+    DuplicateKey,
     Module,
     OrderedDict,
+    Output,
     Provider,
     Resource,
     Terraform,
@@ -32,6 +36,16 @@ from terraformpy import (
     Variable,
     Variant,
 )
+from terraformpy.graph import ReferenceGraph
+from terraformpy.objects import (
+    ConfigMerger,
+    ConflictWarning,
+    SharedValues,
+    TypedObjectAttr,
+)
+
+# the order of keys is only kept by the dicts of python 3.6 and newer
+ORDERED_DICTS = sys.version_info >= (3, 6)
 
 
 def test_object_instances():
@@ -94,6 +108,43 @@ def test_compile():
     }
 
 
+def test_compile_conflicts():
+    first = Resource("res1", "foo", attr="value", tags={"a": "a"})
+    second = Resource("res1", "foo", attr="other", tags={"b": "b"})
+
+    with pytest.warns(ConflictWarning, match="resource.res1.foo.attr"):
+        compiled = TFObject.compile()
+
+    assert compiled == {
+        "resource": {
+            "res1": {
+                "foo": {
+                    "attr": "other",
+                    "tags": {"a": "a", "b": "b"},
+                },
+            },
+        },
+    }
+
+    # merging the duplicates must not have modified the objects themselves
+    assert first._values == {"attr": "value", "tags": {"a": "a"}}
+    assert second._values == {"attr": "other", "tags": {"b": "b"}}
+
+
+def test_config_merger_origins():
+    merger = ConfigMerger()
+    merger.merge({"variable": {"foo": {"default": 1}}}, origin="a.tf.py")
+    merger.merge({"variable": {"bar": {"default": 2}}}, origin="b.tf.py")
+    merger.merge({"variable": {"foo": {"default": 3}}}, origin="c.tf.py")
+
+    assert merger.result == {
+        "variable": {"foo": {"default": 3}, "bar": {"default": 2}},
+    }
+    assert merger.conflicts == [
+        (("variable", "foo", "default"), "a.tf.py", "c.tf.py"),
+    ]
+
+
 def test_getattr():
     res1 = Resource("res1", "foo", attr="value")
     assert res1.id == "${res1.foo.id}"
@@ -160,6 +211,16 @@ def test_object_variants():
         assert sg.default != "value"
 
 
+@pytest.mark.skipif(not ORDERED_DICTS, reason="requires ordered keyword arguments")
+def test_object_variants_merged_in_order():
+    # the variant's values are merged where they are given, so later values take precedence over them
+    with Variant("prod"):
+        obj = Resource("t_x", "n", a=1, prod_variant={"b": 2, "c": 9}, c=3)
+
+    assert obj._values == {"a": 1, "b": 2, "c": 3}
+    assert list(obj._values) == ["a", "b", "c"]
+
+
 def test_provider_context():
     with Provider("aws", region="us-east-1", alias="east1"):
         sg1 = Resource("aws_security_group", "sg", ingress=["foo"])
@@ -386,3 +447,412 @@ def test_typed_object_hooks(mocker):
             }
         }
     }
+
+
+def test_hook_dispatch_order(mocker):
+    """Hooks for the full output and for specific objects run in the order they were added, and only for the objects
+    they were added for"""
+    calls = []
+
+    def full_output_hook(output):
+        calls.append(("full", list(output["resource"])))
+        return output
+
+    def typed_hook(object_id, object_attrs):
+        calls.append(("typed", object_id))
+        return object_attrs
+
+    unused_hook = mocker.MagicMock()
+
+    Resource.add_hook("some_type", typed_hook)
+    TFObject.add_hook("resource", full_output_hook)
+    Resource.add_hook("unused_type", unused_hook)
+    Variable.add_hook("unused_var", unused_hook)
+
+    Resource("some_type", "some_id")
+    Resource("other_type", "other_id")
+    Variable("var1", default="foo")
+
+    TFObject.compile()
+
+    assert calls == [
+        ("typed", "some_id"),
+        ("full", ["some_type"]),
+        ("full", ["other_type"]),
+    ]
+    assert unused_hook.mock_calls == []
+
+
+def test_registry():
+    east = Provider("aws", alias="east1")
+    vpc = Resource("aws_vpc", "main", cidr_block="10.0.0.0/16")
+    subnet_a = Resource("aws_subnet", "a", vpc_id=vpc.id)
+    subnet_b = Resource("aws_subnet", "b", vpc_id=vpc.id, public=True)
+    data_subnet = Data("aws_subnet", "a")
+    var = Variable("var1", default="foo")
+
+    assert TFObject.lookup("provider.aws.east1") is east
+    assert TFObject.lookup("resource.aws_subnet.a") is subnet_a
+    assert TFObject.lookup("data.aws_subnet.a") is data_subnet
+    assert TFObject.lookup("variable.var1") is var
+    with pytest.raises(KeyError):
+        TFObject.lookup("resource.aws_subnet.c")
+
+    assert TFObject.select(type="aws_subnet") == [subnet_a, subnet_b, data_subnet]
+    assert TFObject.select(type="aws_subnet", tf_type="resource") == [
+        subnet_a,
+        subnet_b,
+    ]
+    assert TFObject.select(tf_type="variable") == [var]
+    assert TFObject.select(
+        tf_type="resource", predicate=lambda obj: obj._values.get("public")
+    ) == [subnet_b]
+    assert len(TFObject.registry()) == 6
+
+    TFObject.reset()
+    assert TFObject.select() == []
+
+
+def test_duplicate_address():
+    first = Resource("aws_vpc", "main", cidr_block="10.0.0.0/16")
+
+    with pytest.warns(ConflictWarning, match="resource.aws_vpc.main") as record:
+        Resource("aws_vpc", "main", cidr_block="10.1.0.0/16")
+
+    assert TFObject.lookup("resource.aws_vpc.main") is first
+    assert record[0].filename == __file__
+
+
+class TaggedVariable(Variable):
+    def __init__(self, _name, **kwargs):
+        super(TaggedVariable, self).__init__(_name, description=_name, **kwargs)
+
+
+def test_duplicate_address_location():
+    providers = [Provider("aws", alias="a")]
+    Variable("main")
+    Output("main", value="x")
+    Module("main", source="./main")
+    TaggedVariable("tagged")
+    Resource.fan_out("aws_vpc", "main", providers)
+
+    # the warnings point at the code creating the duplicates, however deep their constructors are
+    with pytest.warns(ConflictWarning) as record:
+        Variable("main")
+        Output("main", value="x")
+        Module("main", source="./main")
+        TaggedVariable("tagged")
+        Resource.fan_out("aws_vpc", "main", providers)
+
+    assert [warning.filename for warning in record] == [__file__] * 5
+
+
+def test_non_string_names():
+    # names have always been formatted into the config as they are
+    instance = Resource("aws_instance", 5, ami="ami-1")
+    var = Variable(7, default="foo")
+    records = Resource.bulk("aws_route53_record", [{"name": 1}, {"name": 2}])
+
+    assert TFObject.lookup("resource.aws_instance.5") is instance
+    assert TFObject.lookup("variable.7") is var
+    assert TFObject.lookup("resource.aws_route53_record.2") is records[1]
+    assert TFObject.compile() == {
+        "resource": {
+            "aws_instance": {5: {"ami": "ami-1"}},
+            "aws_route53_record": {1: {}, 2: {}},
+        },
+        "variable": {7: {"default": "foo"}},
+    }
+
+
+def test_subclass_instances():
+    Resource("res1", "foo")
+
+    class TestResource(Resource):
+        pass
+
+    sub = TestResource("res1", "bar")
+
+    assert TestResource._instances == [sub]
+    assert sub not in Resource._instances
+
+
+def test_typed_object_attr_interning():
+    sg = Resource("aws_security_group", "sg")
+
+    assert sg.id is sg.id
+    assert sg.ingress[0].cidr_blocks is sg.ingress[0].cidr_blocks
+    assert sg.ingress[0] is not sg.ingress[1]
+    assert sg.ingress[0].cidr_blocks == "${aws_security_group.sg.ingress.0.cidr_blocks}"
+    assert not hasattr(sg.id, "__dict__")
+
+    # unhashable items are not cached, but still work
+    assert sg.ingress[[0]] == "${aws_security_group.sg.ingress.[0]}"
+
+    # dunder names are not treated as attribute references
+    with pytest.raises(AttributeError):
+        sg.id.__deepcopy_me__
+
+
+def test_typed_object_attr_pickle():
+    attr = Resource("aws_security_group", "sg").ingress[0]
+
+    loaded = pickle.loads(pickle.dumps(attr))
+    assert loaded == attr
+    assert type(loaded) is TypedObjectAttr
+    assert loaded.cidr_blocks == "${aws_security_group.sg.ingress.0.cidr_blocks}"
+
+
+def test_duplicate_key_order():
+    for region in ("us-west-2", "us-east-1"):
+        Provider("aws", alias=region)
+        Provider("google", alias=region)
+
+    keys = list(TFObject.compile()["provider"])
+    assert [str(key) for key in keys] == ["aws", "google", "aws", "google"]
+    assert [key._seq for key in sorted(keys)] == [0, 2, 1, 3]
+    assert len(set(keys)) == 4
+
+    # the sequence starts over after a reset, so the keys are the same from one compile to the next
+    TFObject.reset()
+    assert DuplicateKey("aws")._seq == 0
+
+
+def test_duplicate_keys_survive_subclass_reset():
+    Provider("aws", alias="east1")
+    Provider("aws", alias="west2")
+    Resource("aws_instance", "web")
+
+    # the providers survive, so new keys mustn't be numbered like theirs
+    Resource.reset()
+    Provider("aws", alias="west1")
+
+    providers = TFObject.compile()["provider"]
+    assert len(providers) == 3
+    assert [provider["alias"] for provider in providers.values()] == [
+        "east1",
+        "west2",
+        "west1",
+    ]
+
+
+def test_registry_survives_subclass_reset():
+    east1 = Provider("aws", alias="east1")
+    Variable("ami", default="ami-1")
+    Resource("aws_instance", "web", provider="aws.east1")
+
+    # only the resources are forgotten, the providers and variables can still be found and referenced
+    Resource.reset()
+    Resource("aws_instance", "api", provider="aws.east1", ami="${var.ami}")
+
+    assert TFObject.lookup("provider.aws.east1") is east1
+    with pytest.raises(KeyError):
+        TFObject.lookup("resource.aws_instance.web")
+    assert [obj._address for obj in TFObject.registry()] == [
+        "provider.aws.east1",
+        "variable.ami",
+        "resource.aws_instance.api",
+    ]
+    ReferenceGraph.build().check()
+
+
+def _bulk_rows():
+    return [
+        dict(
+            name="www",
+            zone_id="Z1",
+            records=["10.0.0.1"],
+            prod_variant=dict(ttl=60),
+            stage_variant=dict(ttl=300),
+        ),
+        dict(name="api", zone_id="Z1", records=["10.0.0.2"], provider="aws.other"),
+        dict(name="db", zone_id="Z2", records=["10.0.0.3"]),
+    ]
+
+
+@pytest.mark.parametrize("variant", [None, "prod"])
+def test_typed_object_bulk(variant):
+    def build(create):
+        TFObject.reset()
+        with Provider("aws", alias="west2"):
+            if variant is None:
+                objects = create()
+            else:
+                with Variant(variant):
+                    objects = create()
+        return objects, TFObject.compile()
+
+    def loop():
+        objects = []
+        for row in _bulk_rows():
+            row = dict(row)
+            objects.append(Resource("aws_route53_record", row.pop("name"), **row))
+        return objects
+
+    expected_objects, expected = build(loop)
+    objects, compiled = build(lambda: Resource.bulk("aws_route53_record", _bulk_rows()))
+
+    assert json.dumps(compiled, sort_keys=True) == json.dumps(expected, sort_keys=True)
+    assert objects == expected_objects
+    assert [obj._values for obj in objects] == [obj._values for obj in expected_objects]
+    if ORDERED_DICTS:
+        assert [list(obj._values) for obj in objects] == [
+            list(obj._values) for obj in expected_objects
+        ]
+    assert Resource._instances == objects
+    assert TFObject.lookup("resource.aws_route53_record.api") is objects[1]
+    assert TFObject.select(type="aws_route53_record") == objects
+    assert objects[0].id == "${aws_route53_record.www.id}"
+
+
+def test_typed_object_bulk_columns():
+    columns = collections.OrderedDict(
+        [("id", ["a", "b"]), ("name", ["a.example.com", "b.example.com"])]
+    )
+    records = Data.bulk("aws_route53_record", columns, name_field="id")
+
+    assert [(obj._name, obj._values) for obj in records] == [
+        ("a", {"name": "a.example.com"}),
+        ("b", {"name": "b.example.com"}),
+    ]
+    assert Data._instances == records
+
+    # the name can be computed from the row, and names that are already in use are reported
+    with pytest.warns(ConflictWarning, match="data.aws_route53_record.a"):
+        Data.bulk(
+            "aws_route53_record", [{"zone": "a"}], name_field=lambda row: row["zone"]
+        )
+
+
+def test_typed_object_bulk_subclass():
+    class TaggedResource(Resource):
+        def __init__(self, _type, _name, **kwargs):
+            kwargs.setdefault("tags", {"Name": _name})
+            super(TaggedResource, self).__init__(_type, _name, **kwargs)
+
+    objects = TaggedResource.bulk("aws_instance", [{"name": "web"}])
+
+    assert objects[0]._values == {"tags": {"Name": "web"}}
+    assert TaggedResource._instances == objects
+
+
+def test_shared_values():
+    shared = {"tags": {"Name": "a"}, "count": 1}
+    first = SharedValues(shared)
+    second = SharedValues(shared)
+
+    first["count"] = 2
+    first["tags"]["Env"] = "prod"
+    del second["count"]
+
+    assert first == {"tags": {"Name": "a", "Env": "prod"}, "count": 2}
+    assert second == {"tags": {"Name": "a"}}
+    assert shared == {"tags": {"Name": "a"}, "count": 1}
+    if ORDERED_DICTS:
+        assert list(first) == ["tags", "count"]
+    assert first.plain() == {"tags": {"Name": "a", "Env": "prod"}, "count": 2}
+    assert type(first.plain()["tags"]) is dict
+
+
+def test_shared_values_nested():
+    shared = {"tags": {"Name": "a", "Extra": {"Owner": "infra"}}}
+    bucket = Resource("aws_s3_bucket", "logs", _values=SharedValues(shared))
+
+    # every access returns the same dict, so changes made through any of them are kept
+    first = bucket.tags
+    second = bucket.tags
+    first["Env"] = "prod"
+    second["Team"] = "infra"
+    second["Extra"]["Owner"] = "data"
+
+    assert first is second
+    assert isinstance(bucket.tags, dict)
+    assert json.loads(json.dumps(bucket.tags)) == {
+        "Name": "a",
+        "Extra": {"Owner": "data"},
+        "Env": "prod",
+        "Team": "infra",
+    }
+    assert shared == {"tags": {"Name": "a", "Extra": {"Owner": "infra"}}}
+    assert TFObject.compile()["resource"]["aws_s3_bucket"]["logs"] == {
+        "tags": {
+            "Name": "a",
+            "Extra": {"Owner": "data"},
+            "Env": "prod",
+            "Team": "infra",
+        }
+    }
+
+    # copies don't share the dicts that have been copied either
+    copied = bucket._values.copy()
+    copied["tags"]["Extra"]["Owner"] = "ops"
+    assert bucket._values["tags"]["Extra"] == {"Owner": "data"}
+
+
+def test_fan_out():
+    providers = [
+        Provider("aws", alias=region, region=region)
+        for region in ("us_east_1", "us_west_2")
+    ]
+    policy = {"Statement": [{"Effect": "Allow", "Resource": ["*"]}]}
+
+    with Variant("prod"):
+        buckets = Resource.fan_out(
+            "aws_s3_bucket",
+            "logs",
+            providers,
+            policy=policy,
+            tags={"Team": "infra"},
+            prod_variant=dict(versioning=True),
+        )
+
+    assert [bucket._name for bucket in buckets] == ["logs_us_east_1", "logs_us_west_2"]
+    assert buckets[0]._values["tags"] is not buckets[1]._values["tags"]
+    assert buckets[0]._values._shared is buckets[1]._values._shared
+
+    # changing a replica doesn't change the others
+    buckets[1].tags["Extra"] = "yes"
+
+    # and neither do hooks that change the values they're given in place
+    def hook(object_id, attrs):
+        attrs["policy"]["Statement"][0]["Effect"] = "Deny"
+        return attrs
+
+    Resource.add_hook("aws_s3_bucket", hook)
+
+    compiled = TFObject.compile()["resource"]["aws_s3_bucket"]
+    assert compiled["logs_us_east_1"] == {
+        "policy": {"Statement": [{"Effect": "Deny", "Resource": ["*"]}]},
+        "tags": {"Team": "infra"},
+        "versioning": True,
+        "provider": "aws.us_east_1",
+    }
+    assert compiled["logs_us_west_2"]["tags"] == {"Team": "infra", "Extra": "yes"}
+    assert compiled["logs_us_west_2"]["provider"] == "aws.us_west_2"
+    assert policy["Statement"][0]["Effect"] == "Allow"
+    json.dumps(compiled)
+
+
+def test_fan_out_stays_shared():
+    providers = [
+        Provider("aws", alias=region, region=region)
+        for region in ("us_east_1", "us_west_2")
+    ]
+    role = Resource("aws_iam_role", "logs")
+    buckets = Resource.fan_out(
+        "aws_s3_bucket", "logs", providers, tags={"Role": role.arn}
+    )
+
+    # reading the values of the replicas, rather than changing them, doesn't copy what they share
+    assert buckets[0] != buckets[1]
+    ReferenceGraph.build().check()
+    assert ReferenceGraph.build().references_of(
+        "resource.aws_s3_bucket.logs_us_east_1"
+    ) == [
+        "resource.aws_iam_role.logs",
+        "provider.aws.us_east_1",
+    ]
+
+    for bucket in buckets:
+        assert "tags" not in bucket._values._own
+    assert buckets[0]._values._shared is buckets[1]._values._shared
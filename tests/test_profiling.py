@@ -0,0 +1,51 @@
+from schematics import types
+
+from terraformpy import Resource, ResourceCollection, TFObject, profiling
+
+
+def test_profiler():
+    class Collection(ResourceCollection):
+        name = types.StringType(required=True)
+
+        def create_resources(self):
+            self.res = Resource("aws_instance", self.name)
+
+    def add_tags(object_id, attrs):
+        return dict(attrs, tags={"Name": object_id})
+
+    Resource.add_hook("aws_instance", add_tags)
+
+    profiler = profiling.enable()
+    try:
+        Collection(name="one")
+        Collection(name="two")
+        TFObject.compile()
+    finally:
+        assert profiling.disable() is profiler
+    assert profiling.profiler is None
+
+    calls = dict((row["name"], row["calls"]) for row in profiler.report())
+    assert calls == {"Collection": 2, "resource.aws_instance:add_tags": 2}
+
+    lines = profiler.format_table()
+    assert len(lines) == 3
+    assert lines[0].split() == ["category", "name", "calls", "wall", "ms", "cpu", "ms"]
+
+
+def test_profiler_update(tmpdir):
+    profiler = profiling.Profiler()
+    with profiler.timer("file", "a.tf.py"):
+        pass
+    profiler.update(
+        {("file", "a.tf.py"): [1, 1.0, 0.5], ("file", "b.tf.py"): [1, 2.0, 1.5]}
+    )
+
+    rows = profiler.report()
+    assert [(row["name"], row["calls"]) for row in rows] == [
+        ("b.tf.py", 1),
+        ("a.tf.py", 2),
+    ]
+
+    path = tmpdir.join("profile", "profile.json")
+    profiler.write_json(str(path))
+    assert path.check()
@@ -14,13 +14,22 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import pickle
+import subprocess
+import sys
+
 import pytest
 import schematics.exceptions
 from schematics import types
 from schematics.types import compound
 
 from terraformpy.objects import Data, Resource
-from terraformpy.resource_collections import ResourceCollection, Variant
+from terraformpy.resource_collections import (
+    BatchValidation,
+    BatchValidationError,
+    ResourceCollection,
+    Variant,
+)
 
 if hasattr(schematics.exceptions, "ConversionError"):
     # schematics 2+
@@ -154,6 +163,19 @@ def test_relative_file():
     assert tc.relative_file("foo") == '${file("${path.module}/tests/foo")}'
 
 
+def test_relative_file_cwd(monkeypatch):
+    class TestCollection(ResourceCollection):
+        def create_resources(self):
+            pass
+
+    tc = TestCollection()
+    assert tc.relative_file("foo") == '${file("${path.module}/tests/foo")}'
+
+    # the cached path must follow the current directory
+    monkeypatch.chdir("tests")
+    assert tc.relative_file("foo") == '${file("${path.module}/foo")}'
+
+
 def test_typed_attr_as_strings():
     class TestCollection(ResourceCollection):
         foo = types.StringType(required=True)
@@ -265,3 +287,87 @@ def test_mock_object_creation():
     assert tc.bar is not None
     assert tc.baz is not None
     assert tc.c1.foo is not None
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="requires module __getattr__")
+def test_lazy_schematics():
+    code = (
+        "import sys, terraformpy\n"
+        "assert 'schematics' not in sys.modules\n"
+        "terraformpy.Resource('aws_instance', 'web')\n"
+        "terraformpy.compile()\n"
+        "assert 'schematics' not in sys.modules\n"
+        "from terraformpy.objects import OrderedDict\n"
+        "assert terraformpy.OrderedDict is OrderedDict\n"
+        "assert terraformpy.resource_collections.Variant is terraformpy.Variant\n"
+        "assert 'schematics' in sys.modules\n"
+    )
+    subprocess.check_call([sys.executable, "-c", code])
+
+
+def test_batch_validation():
+    validated = []
+
+    class TestCollection(ResourceCollection):
+        name = types.StringType(required=True)
+        size = types.StringType(choices=["small", "large"])
+        count = types.IntType()
+
+        def validate(self, *args, **kwargs):
+            validated.append(self.name)
+            return super(TestCollection, self).validate(*args, **kwargs)
+
+        def create_resources(self):
+            self.res = Resource("res1", self.name, size=self.size)
+
+    with pytest.raises(BatchValidationError) as excinfo:
+        with BatchValidation():
+            for _ in range(3):
+                TestCollection(name="a", size="small")
+            TestCollection(size="small")
+            TestCollection(name="b", size="huge")
+            TestCollection(name="b", size="huge")
+            TestCollection(name="c", count="notint")
+            TestCollection(name="d", size="large")
+
+    # identical inputs are only validated once, and inputs that can't be converted aren't validated at all
+    assert validated == ["a", None, "b", "d"]
+    # invalid collections don't create their resources
+    assert [res._name for res in Resource._instances] == ["a", "a", "a", "d"]
+
+    errors = excinfo.value.errors
+    assert [name.split(" (")[0] for name in errors] == [
+        "TestCollection #3",
+        "TestCollection #4",
+        "TestCollection #5",
+        "TestCollection #6",
+    ]
+    assert all("test_resource_collections.py:" in name for name in errors)
+    assert [sorted(error) for error in errors.values()] == [
+        ["name"],
+        ["size"],
+        ["size"],
+        ["count"],
+    ]
+
+    # the error can be passed between processes
+    assert pickle.loads(pickle.dumps(excinfo.value)).errors == errors
+
+    # outside of a batch errors are raised right away, as usual
+    with pytest.raises(schematics.exceptions.DataError):
+        TestCollection(name="c", count="notint")
+
+
+def test_batch_validation_valid():
+    class TestCollection(ResourceCollection):
+        name = types.StringType(required=True)
+
+        def create_resources(self):
+            self.res = Resource("res1", self.name)
+
+    with BatchValidation() as batch:
+        TestCollection(name="a")
+        TestCollection(name="b")
+
+    assert batch.errors == {}
+    assert BatchValidation.CURRENT_BATCH is None
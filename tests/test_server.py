@@ -0,0 +1,275 @@
+import json
+import os
+import socket
+import sys
+import threading
+
+import pytest
+
+from terraformpy import Resource, TFObject
+from terraformpy import server
+from terraformpy.context import CompileContext
+from terraformpy.server import (
+    CompileServer,
+    ServerError,
+    ServerUnavailable,
+    compile_request,
+    is_loopback,
+    parse_address,
+    request_compile,
+    request_environment,
+)
+
+
+def make_project(directory, ami):
+    directory.join("helper.py").write("AMI = {0!r}\n".format(ami))
+    directory.join("main.tf.py").write(
+        "import os\n"
+        "from helper import AMI\n"
+        "from terraformpy import Resource\n"
+        "Resource('aws_instance', 'web', ami=AMI, env=os.environ.get('STAGE'))\n"
+    )
+
+
+def make_request(directory, argv=()):
+    return {
+        "version": 1,
+        "directory": str(directory),
+        "files": ["main.tf.py"],
+        "argv": list(argv),
+        "env": {"PYTHONPATH": ".", "STAGE": directory.basename},
+    }
+
+
+def test_parse_address():
+    assert parse_address("8080") == (socket.AF_INET, ("127.0.0.1", 8080))
+    assert parse_address("localhost:8080") == (socket.AF_INET, ("localhost", 8080))
+    assert parse_address("/tmp/terraformpy.sock") == (
+        socket.AF_UNIX,
+        "/tmp/terraformpy.sock",
+    )
+
+
+def test_remote_addresses():
+    assert is_loopback("127.0.0.1")
+    assert is_loopback("localhost")
+    assert not is_loopback("0.0.0.0")
+
+    # listening on an address other machines can reach must be asked for
+    with pytest.raises(ValueError, match="0.0.0.0 isn't a loopback address"):
+        CompileServer("0.0.0.0:0", workers=1)
+
+
+def test_request_environment(monkeypatch):
+    monkeypatch.setattr(
+        os,
+        "environ",
+        {
+            "AWS_SECRET_ACCESS_KEY": "secret",
+            "HOME": "/home/user",
+            "PYTHONPATH": ".",
+            "STAGE": "prod",
+            "TERRAFORMPY_SERVER": "/tmp/terraformpy.sock",
+            "TF_VAR_region": "us-east-1",
+        },
+    )
+
+    assert request_environment() == {
+        "PYTHONPATH": ".",
+        "TERRAFORMPY_SERVER": "/tmp/terraformpy.sock",
+        "TF_VAR_region": "us-east-1",
+    }
+    assert request_environment(["STAGE"])["STAGE"] == "prod"
+
+
+@pytest.fixture(autouse=True)
+def forget_helper(monkeypatch):
+    # other tests import helper modules of their own
+    monkeypatch.delitem(sys.modules, "helper", raising=False)
+
+
+def test_compile_request(tmpdir):
+    first = tmpdir.mkdir("first")
+    second = tmpdir.mkdir("second")
+    make_project(first, "ami-1")
+    make_project(second, "ami-2")
+    cwd = os.getcwd()
+    path = list(sys.path)
+
+    # both projects have a helper module, each request sees its own
+    for directory, ami in ((first, "ami-1"), (second, "ami-2")):
+        response = compile_request(make_request(directory))
+        assert list(response["shards"]) == ["main.tf.json"]
+        assert json.loads(response["shards"]["main.tf.json"]) == {
+            "resource": {
+                "aws_instance": {"web": {"ami": ami, "env": directory.basename}}
+            }
+        }
+        assert "helper" not in sys.modules
+
+    assert os.getcwd() == cwd
+    assert sys.path == path
+    assert "STAGE" not in os.environ
+    assert len(TFObject.registry()) == 0
+
+    response = compile_request(
+        make_request(first, ["--only", "resource.aws_instance.nope"])
+    )
+    assert response["error"] == [
+        "terraformpy - Error: resource.aws_instance.nope doesn't match any objects"
+    ]
+
+    first.join("main.tf.py").write("raise RuntimeError('broken')\n")
+    response = compile_request(make_request(first))
+    assert response["error"][-1] == "RuntimeError: broken"
+
+    # exiting is an error like any other, rather than the end of the worker
+    first.join("main.tf.py").write("import sys\nsys.exit(3)\n")
+    response = compile_request(make_request(first))
+    assert response["error"][-1] == "SystemExit: 3"
+
+
+def test_compile_request_installed_hooks(tmpdir, monkeypatch):
+    # a module that isn't part of the project, i.e. an installed package, that adds a hook when it's imported
+    site = tmpdir.mkdir("site")
+    site.join("tf_tags.py").write(
+        "from terraformpy import Resource\n"
+        "Resource.add_hook('aws_instance', lambda id, attrs: dict(attrs, tags={'Name': id}))\n"
+    )
+    monkeypatch.syspath_prepend(str(site))
+    project = tmpdir.mkdir("project")
+    make_project(project, "ami-1")
+    project.join("main.tf.py").write("import tf_tags\n", mode="a")
+
+    # every request compiled by the same worker gets the hook
+    for _ in range(2):
+        response = compile_request(make_request(project))
+        assert json.loads(response["shards"]["main.tf.json"]) == {
+            "resource": {
+                "aws_instance": {
+                    "web": {"ami": "ami-1", "env": "project", "tags": {"Name": "web"}}
+                }
+            }
+        }
+        assert "tf_tags" not in sys.modules
+
+
+@pytest.mark.parametrize(
+    "argv", [[], ["--variants", "stage,prod"], ["--cache"], ["--shard-by", "source"]]
+)
+def test_compile_request_preloaded_hooks(tmpdir, monkeypatch, argv):
+    # the hooks a preloaded module added when the worker started
+    with CompileContext():
+        Resource.add_hook(
+            "aws_instance", lambda id, attrs: dict(attrs, tags={"Name": id})
+        )
+        monkeypatch.setattr(server, "_preloaded_hooks", tuple(TFObject._hooks))
+    project = tmpdir.mkdir("project")
+    make_project(project, "ami-1")
+
+    # files and variants that are compiled one after the other in the request get them too
+    response = compile_request(make_request(project, argv))
+    assert response["shards"]
+    for shard in response["shards"].values():
+        assert json.loads(shard) == {
+            "resource": {
+                "aws_instance": {
+                    "web": {"ami": "ami-1", "env": "project", "tags": {"Name": "web"}}
+                }
+            }
+        }
+    assert not TFObject._hooks
+
+
+def test_compile_server(tmpdir, monkeypatch):
+    first = tmpdir.mkdir("first")
+    second = tmpdir.mkdir("second")
+    make_project(first, "ami-1")
+    make_project(second, "ami-2")
+    monkeypatch.setenv("PYTHONPATH", ".")
+    address = str(tmpdir.join("server.sock"))
+
+    server = CompileServer(address, workers=2)
+    serving = threading.Thread(target=server.serve_forever)
+    serving.start()
+    try:
+        results = {}
+        for directory in (first, second):
+            monkeypatch.chdir(directory)
+            monkeypatch.setenv("STAGE", directory.basename)
+            results[directory.basename] = request_compile(
+                address, [], ["main.tf.py"], env_names=["STAGE"]
+            )
+
+        assert results == {
+            "first": {
+                "main.tf.json": {
+                    "resource": {
+                        "aws_instance": {"web": {"ami": "ami-1", "env": "first"}}
+                    }
+                }
+            },
+            "second": {
+                "main.tf.json": {
+                    "resource": {
+                        "aws_instance": {"web": {"ami": "ami-2", "env": "second"}}
+                    }
+                }
+            },
+        }
+
+        # requests are compiled in parallel by the workers
+        concurrent = []
+        threads = [
+            threading.Thread(
+                target=lambda: concurrent.append(
+                    request_compile(address, [], ["main.tf.py"], env_names=["STAGE"])
+                )
+            )
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert concurrent == [results["second"]] * 4
+
+        with pytest.raises(ServerError) as exc:
+            request_compile(address, ["--only", "nope"], ["main.tf.py"])
+        assert exc.value.messages == [
+            "terraformpy - Error: nope doesn't match any objects"
+        ]
+    finally:
+        server.shutdown()
+        serving.join()
+        server.close()
+
+    assert not os.path.exists(address)
+    with pytest.raises(ServerUnavailable):
+        request_compile(address, [], ["main.tf.py"])
+
+
+def test_compile_server_dead_worker(tmpdir, monkeypatch):
+    project = tmpdir.mkdir("project")
+    make_project(project, "ami-1")
+    monkeypatch.chdir(project)
+    monkeypatch.setenv("PYTHONPATH", ".")
+    address = str(tmpdir.join("server.sock"))
+
+    server = CompileServer(address, workers=1, timeout=1)
+    serving = threading.Thread(target=server.serve_forever)
+    serving.start()
+    try:
+        project.join("dies.tf.py").write("import os\nos._exit(1)\n")
+        with pytest.raises(ServerError) as exc:
+            request_compile(address, [], ["dies.tf.py"])
+        assert exc.value.messages == [
+            "terraformpy - Error: the compile didn't finish within 1 seconds"
+        ]
+
+        # the worker is replaced
+        assert list(request_compile(address, [], ["main.tf.py"])) == ["main.tf.json"]
+    finally:
+        server.shutdown()
+        serving.join()
+        server.close()
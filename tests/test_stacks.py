@@ -0,0 +1,162 @@
+import pytest
+
+from terraformpy import Data, Output, Provider, Resource, Terraform, Variable
+from terraformpy.graph import NoMatchError, ReferenceGraph, rewrite_references
+from terraformpy.stacks import (
+    StackCycleError,
+    StackOutputError,
+    compile_stack,
+    plan_stacks,
+    write_stacks,
+)
+
+
+def make_objects():
+    Provider("aws", region="${var.region}")
+    Variable("region", default="us-east-1")
+    vpc = Resource("aws_vpc", "main", cidr_block="10.0.0.0/16")
+    subnet = Resource("aws_subnet", "a", vpc_id=vpc.id)
+    bucket = Resource("aws_s3_bucket", "logs", bucket="logs")
+    policy = Data(
+        "aws_iam_policy_document",
+        "logs",
+        statement=[{"resources": ["${aws_s3_bucket.logs.arn}/*"]}],
+    )
+    Resource("aws_iam_policy", "logs", policy=policy.json)
+    Resource(
+        "aws_instance",
+        "web",
+        subnet_id=subnet.id,
+        depends_on=["aws_vpc.main"],
+        user_data='${file("init.sh")}',
+    )
+    Output("web_ip", value="${aws_instance.web.private_ip}")
+
+
+def test_rewrite_references():
+    def rewrite(address, reference):
+        if address == "resource.aws_vpc.main":
+            return "data.terraform_remote_state.net.outputs.aws_vpc_main"
+        return None
+
+    assert (
+        rewrite_references(
+            "${aws_vpc.main.id}-${aws_vpc.other.id}-aws_vpc.main", rewrite
+        )
+        == "${data.terraform_remote_state.net.outputs.aws_vpc_main.id}-${aws_vpc.other.id}-aws_vpc.main"
+    )
+
+
+def test_plan_stacks():
+    make_objects()
+    plan = plan_stacks(ReferenceGraph.build())
+
+    # the bucket and the policy are connected through the policy document data source
+    assert list(plan.stacks) == ["aws_vpc_main", "aws_s3_bucket_logs"]
+    assert plan.stacks["aws_vpc_main"].addresses == [
+        "resource.aws_vpc.main",
+        "resource.aws_subnet.a",
+        "resource.aws_instance.web",
+        "output.web_ip",
+    ]
+    assert plan.stacks["aws_s3_bucket_logs"].addresses == [
+        "resource.aws_s3_bucket.logs",
+        "resource.aws_iam_policy.logs",
+    ]
+    assert not any(stack.imports for stack in plan.stacks.values())
+
+
+def test_explicit_stacks(tmpdir):
+    Terraform(backend={"s3": {"bucket": "state", "key": "prod/terraform.tfstate"}})
+    make_objects()
+    plan = plan_stacks(
+        ReferenceGraph.build(),
+        [
+            ("network", "aws_vpc.*"),
+            ("network", "aws_subnet.*"),
+            ("app", "aws_instance.*"),
+        ],
+    )
+
+    assert list(plan.stacks) == ["network", "aws_s3_bucket_logs", "app"]
+    app, network = plan.stacks["app"], plan.stacks["network"]
+    assert app.addresses == ["resource.aws_instance.web", "output.web_ip"]
+    # depends_on is a reference too, it makes sure the network stack is applied first
+    assert app.imports == {
+        "resource.aws_subnet.a": "network",
+        "resource.aws_vpc.main": "network",
+    }
+    assert app.depends_on() == ["network"]
+    assert network.exports == ["resource.aws_subnet.a", "resource.aws_vpc.main"]
+
+    config = compile_stack(plan, app)
+    assert sorted(config) == [
+        "data",
+        "output",
+        "provider",
+        "resource",
+        "terraform",
+        "variable",
+    ]
+    web = config["resource"]["aws_instance"]["web"]
+    assert (
+        web["subnet_id"]
+        == "${data.terraform_remote_state.network.outputs.aws_subnet_a.id}"
+    )
+    assert web["depends_on"] == []
+    assert web["user_data"] == '${file("init.sh")}'
+    assert config["terraform"]["backend"] == {
+        "s3": {"bucket": "state", "key": "prod/app/terraform.tfstate"}
+    }
+    assert config["data"]["terraform_remote_state"]["network"] == {
+        "backend": "s3",
+        "config": {"bucket": "state", "key": "prod/network/terraform.tfstate"},
+    }
+
+    config = compile_stack(plan, network)
+    assert config["output"] == {
+        "aws_subnet_a": {"value": "${aws_subnet.a}"},
+        "aws_vpc_main": {"value": "${aws_vpc.main}"},
+    }
+    assert list(config["resource"]) == ["aws_vpc", "aws_subnet"]
+
+    written = write_stacks(plan, str(tmpdir))
+    assert sorted(path[len(str(tmpdir)) + 1 :] for path in written) == [
+        "app/main.tf.json",
+        "aws_s3_bucket_logs/main.tf.json",
+        "network/main.tf.json",
+    ]
+
+
+def test_stack_cycles():
+    a = Resource("aws_security_group", "a")
+    b = Resource("aws_security_group", "b", peer=a.id)
+    a._values["peer"] = b.id
+    Resource("aws_instance", "c", sg=a.id)
+
+    with pytest.raises(StackCycleError) as excinfo:
+        plan_stacks(
+            ReferenceGraph.build(),
+            [("one", "aws_security_group.a"), ("two", "aws_security_group.b")],
+        )
+    assert set(excinfo.value.stacks) == set(["one", "two"])
+
+    with pytest.raises(NoMatchError, match="nope"):
+        plan_stacks(ReferenceGraph.build(), [("three", "nope")])
+
+
+def test_stack_output_conflict():
+    vpc = Resource("aws_vpc", "main")
+    Resource("aws_subnet", "a", vpc_id=vpc.id)
+    # the same name the export of the vpc would have
+    Output("aws_vpc_main", value=vpc.arn)
+
+    plan = plan_stacks(
+        ReferenceGraph.build(),
+        [("network", "aws_vpc.*"), ("app", "aws_subnet.*")],
+    )
+    with pytest.raises(StackOutputError) as excinfo:
+        compile_stack(plan, plan.stacks["network"])
+    assert str(excinfo.value) == (
+        "the stack network can't export resource.aws_vpc.main as the output aws_vpc_main, which is already defined"
+    )
@@ -0,0 +1,114 @@
+import os
+import sys
+
+from terraformpy import TFObject
+from terraformpy.loader import load_file
+from terraformpy.watch import Watcher
+
+
+def test_watcher(tmpdir, monkeypatch, request):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.syspath_prepend(str(tmpdir))
+    monkeypatch.setattr(sys, "watch_log", [], raising=False)
+
+    @request.addfinalizer
+    def forget_modules():
+        for name in ("heavy", "tags", "lib", "lib.consts", "main"):
+            sys.modules.pop(name, None)
+
+    log = "import sys\nsys.watch_log.append(__name__)\n"
+    tmpdir.join("heavy.py").write(log + "AMI = 'ami-1'\n")
+    tmpdir.join("tags.py").write(
+        log + "from terraformpy import Resource\n"
+        "Resource.add_hook('aws_instance', lambda id, attrs: dict(attrs, tags={'Name': id}))\n"
+    )
+    tmpdir.join("lib").mkdir().join("__init__.py").write("")
+    tmpdir.join("lib", "consts.py").write(log + "SIZE = 't3.micro'\n")
+    tmpdir.join("main.tf.py").write(
+        "import heavy, tags\n"
+        "from lib import consts\n"
+        "from terraformpy import Resource\n"
+        "Resource('aws_instance', 'web', ami=heavy.AMI, instance_type=consts.SIZE)\n"
+    )
+
+    builds = []
+
+    def build(filenames, load):
+        for filename in filenames:
+            load(filename)
+        builds.append(TFObject.compile())
+
+    def touch(path, content):
+        tmpdir.join(path).write(content)
+        mtime = os.stat(str(tmpdir.join(path))).st_mtime + len(builds)
+        os.utime(str(tmpdir.join(path)), (mtime, mtime))
+
+    watcher = Watcher(build, load_file)
+    assert watcher.run_once()
+    assert sys.watch_log == ["heavy", "tags", "lib.consts"]
+    assert not watcher.run_once()
+
+    # tags declares a hook, so it is executed again along with the module that changed
+    del sys.watch_log[:]
+    touch("lib/consts.py", log + "SIZE = 't3.large'\n")
+    assert watcher.run_once()
+    assert sorted(sys.watch_log) == ["lib.consts", "tags"]
+    assert builds[-1]["resource"]["aws_instance"]["web"] == {
+        "ami": "ami-1",
+        "instance_type": "t3.large",
+        "tags": {"Name": "web"},
+    }
+    assert not watcher.run_once()
+
+    # a failing build is reported, and the next change starts over
+    del sys.watch_log[:]
+    touch("heavy.py", "raise ValueError('broken')\n")
+    assert watcher.run_once()
+    touch("heavy.py", log + "AMI = 'ami-2'\n")
+    assert watcher.run_once()
+    assert builds[-1]["resource"]["aws_instance"]["web"]["ami"] == "ami-2"
+
+
+def test_watcher_submodules(tmpdir, monkeypatch, request):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.syspath_prepend(str(tmpdir))
+
+    @request.addfinalizer
+    def forget_modules():
+        for name in ("mylib", "mylib.tf_hooks", "main"):
+            sys.modules.pop(name, None)
+
+    tmpdir.join("mylib").mkdir().join("__init__.py").write("AMI = 'ami-1'\n")
+    tmpdir.join("mylib", "tf_hooks.py").write(
+        "from terraformpy import Resource\n"
+        "Resource.add_hook('aws_instance', lambda id, attrs: dict(attrs, hooked=True))\n"
+    )
+    # the package is already imported when the submodule, which adds a hook, is imported from it
+    main = (
+        "import mylib\n"
+        "from mylib import tf_hooks\n"
+        "from terraformpy import Resource\n"
+        "Resource('aws_instance', 'web', ami=mylib.AMI, size={0!r})\n"
+    )
+    tmpdir.join("main.tf.py").write(main.format("small"))
+
+    builds = []
+
+    def build(filenames, load):
+        for filename in filenames:
+            load(filename)
+        builds.append(TFObject.compile())
+
+    watcher = Watcher(build, load_file)
+    assert watcher.run_once()
+    assert builds[-1]["resource"]["aws_instance"]["web"]["hooked"]
+
+    tmpdir.join("main.tf.py").write(main.format("large"))
+    mtime = os.stat(str(tmpdir.join("main.tf.py"))).st_mtime + 1
+    os.utime(str(tmpdir.join("main.tf.py")), (mtime, mtime))
+    assert watcher.run_once()
+    assert builds[-1]["resource"]["aws_instance"]["web"] == {
+        "ami": "ami-1",
+        "size": "large",
+        "hooked": True,
+    }
@@ -0,0 +1,135 @@
+import json
+
+import six
+
+from terraformpy import Data, Provider, Resource, TFObject, Variable
+from terraformpy.objects import SharedValues
+from terraformpy.writer import (
+    get_encoder,
+    iter_json,
+    shard_by_type,
+    write_json,
+    write_json_file,
+    write_shards,
+)
+
+
+def make_config():
+    Provider("aws", region="us-east-1", alias="east1")
+    Provider("aws", region="us-west-2", alias="west2")
+    vpc = Data("aws_vpc", "main", tags={"Name": "main"})
+    Resource("aws_subnet", "a", vpc_id=vpc.id, cidr_block="10.0.0.0/24")
+    Resource("aws_subnet", "b", vpc_id=vpc.id, cidr_block="10.0.1.0/24", tags={})
+    Variable("empty", default=[])
+    return TFObject.compile()
+
+
+def test_indented_output_matches_json_dumps():
+    config = make_config()
+
+    assert "".join(iter_json(config)) == json.dumps(
+        config, indent=4, separators=(",", ": ")
+    )
+    assert "".join(iter_json(config, indent=2)) == json.dumps(
+        config, indent=2, separators=(",", ": ")
+    )
+
+
+def test_compact_output():
+    config = make_config()
+
+    stdlib = get_encoder(indent=None, native=False)
+    assert "".join(iter_json(config, indent=None, encoder=stdlib)) == json.dumps(
+        config, separators=(",", ":")
+    )
+
+    # whichever encoder is installed the output must round trip
+    assert json.loads("".join(iter_json(config, indent=None))) == json.loads(
+        json.dumps(config)
+    )
+
+
+def test_mappings():
+    shared = {"tags": {"Name": "main"}, "count": 1}
+    values = SharedValues(shared)
+    values["count"] = 2
+    values["tags"]["Env"] = "prod"
+    config = {"resource": {"aws_vpc": {"main": {"nested": values}}}}
+
+    expected = {
+        "resource": {
+            "aws_vpc": {
+                "main": {
+                    "nested": {"tags": {"Name": "main", "Env": "prod"}, "count": 2}
+                }
+            }
+        }
+    }
+    for indent in (None, 4):
+        assert json.loads("".join(iter_json(config, indent=indent))) == expected
+
+
+def test_duplicate_keys():
+    config = make_config()
+
+    fd = six.StringIO()
+    write_json(config, fd, indent=None)
+
+    text = fd.getvalue()
+    assert text.endswith("}\n")
+    assert text.count('"aws":') == 2
+    assert text.index('"region":"us-east-1"') < text.index('"region":"us-west-2"')
+
+
+def test_write_json_file_only_when_changed(tmpdir):
+    path = str(tmpdir.join("main.tf.json"))
+
+    assert write_json_file(path, {"variable": {"foo": {}}})
+    mtime = tmpdir.join("main.tf.json").mtime()
+    assert not write_json_file(path, {"variable": {"foo": {}}})
+    assert tmpdir.join("main.tf.json").mtime() == mtime
+
+    assert write_json_file(path, {"variable": {"bar": {}}})
+    assert json.loads(tmpdir.join("main.tf.json").read()) == {"variable": {"bar": {}}}
+    assert tmpdir.listdir() == [tmpdir.join("main.tf.json")]
+
+
+def test_shard_by_type():
+    config = make_config()
+    shards = shard_by_type(config)
+
+    assert sorted(shards) == [
+        "data.aws_vpc.tf.json",
+        "provider.tf.json",
+        "resource.aws_subnet.tf.json",
+        "variable.tf.json",
+    ]
+    assert shards["resource.aws_subnet.tf.json"] == {
+        "resource": {"aws_subnet": config["resource"]["aws_subnet"]}
+    }
+
+
+def test_write_shards(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join("main.tf.json").write("{}")
+    tmpdir.join("handwritten.tf.json").write("{}")
+
+    written, removed = write_shards(
+        {"a.tf.json": {"variable": {"a": {}}}, "b.tf.json": {"variable": {"b": {}}}},
+        "manifest.json",
+    )
+    assert written == ["a.tf.json", "b.tf.json"]
+    assert removed == ["main.tf.json"]
+
+    written, removed = write_shards(
+        {"a.tf.json": {"variable": {"a": {}}}, "c.tf.json": {"variable": {"c": {}}}},
+        "manifest.json",
+    )
+    assert written == ["c.tf.json"]
+    assert removed == ["b.tf.json"]
+    assert sorted(path.basename for path in tmpdir.listdir()) == [
+        "a.tf.json",
+        "c.tf.json",
+        "handwritten.tf.json",
+        "manifest.json",
+    ]